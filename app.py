@@ -1,16 +1,21 @@
 # -*- coding: utf-8 -*-
 __author__ = "jmrbcu"
+import os
 import sys
+import errno
+import heapq
 import argparse
+import itertools
 import logging.config
 try:
     import pathlib
 except:
     import pathlib2 as pathlib
 
+import walk
 import plugins
 from args import Command, Argument
-from plugin_manager import PluginManager, ExtensionPoint, extends
+from plugin_manager import PluginManager, PluginBundle, ExtensionPoint, extends
 
 LOG_CONFIG = {
     "version": 1,
@@ -26,7 +31,8 @@ LOG_CONFIG = {
             "class": "logging.StreamHandler",
             "formatter": "default",
             "level": "DEBUG",
-            "stream": "ext://sys.stdout"
+            # stdout is for command output, e.g. the data written by: cat
+            "stream": "ext://sys.stderr"
         },
     },
     "loggers": {
@@ -40,36 +46,71 @@ LOG_CONFIG = {
 logging.config.dictConfig(LOG_CONFIG)
 logger = logging.getLogger(__name__)
 
+# cache with the description of all plugins found, so we don't need to import them on every start
+PLUGIN_MANIFEST = pathlib.Path("~/.cache/fstool/plugin_manifest.json").expanduser()
+
+# optional bundle with all plugins, see: build-bundle command. If it exists, the plugins in the bundle
+# are used instead of the ones in the search path, rebuild it after changing any plugin.
+PLUGIN_BUNDLE = pathlib.Path("~/.cache/fstool/plugins.bundle").expanduser()
+
+
+def fields(value):
+    """Parse a comma separated list of walk.FIELDS"""
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    for name in names:
+        if name not in walk.FIELDS:
+            raise argparse.ArgumentTypeError("unknown field: {0}, choose from: {1}".format(
+                name, ", ".join(walk.FIELDS)
+            ))
+    return names
+
 
 class Application(object):
 
     # example extension point: any plugin can extend this extension point with new commands
     # extension points are lazy, meaning all extenders to this extension point will be evaluated
     # the first time someone access the extension point, after that, the value is cached.
-    arguments = ExtensionPoint("application.arguments")
+    # Commands are indexed by name, the extension point rejects commands with the same name.
+    arguments = ExtensionPoint("application.arguments", key="name")
 
-    def __init__(self, search_path):
+    def __init__(self, search_path, profile=False):
         super(Application, self).__init__()
-        self.commands = {}
+        self.search_path = search_path
         self.disabled_plugins = ["dummy"]
-        self.plugin_manager = PluginManager(str(search_path))
+        self.plugin_manager = PluginManager(
+            str(search_path), manifest=str(PLUGIN_MANIFEST), static=True, bundle=str(PLUGIN_BUNDLE),
+            profile=profile
+        )
 
     @extends("application.arguments")
     def default_commands(self):
         return [
             Command("list", self.list, "list a directory", [
                 Argument("path", help="path to list", nargs="?", default="."),
+                Argument("-r", "--recursive", action="store_true", help="list the subdirectories too"),
+                Argument("--fields", type=fields, default=[],
+                         help="comma separated fields printed after the path: {0}".format(", ".join(walk.FIELDS))),
+                Argument("--sort", choices=walk.SORT_KEYS, help="sort the entries, with bounded memory"),
+                Argument("--reverse", action="store_true", help="reverse the sort order"),
+                Argument("--limit", type=int, help="print at most this number of entries"),
+                Argument("-0", "--null", action="store_true", help="end entries with NUL instead of newline"),
+                Argument("--workers", type=int, default=8, help="threads scanning subdirectories when recursive"),
             ]),
             Command("list-plugins", self.list_plugins, "list all available plugins (not including disabled ones)"),
+            Command("build-bundle", self.build_bundle, "pack all plugins in a single file loaded at startup", [
+                Argument("output", help="path of the bundle", nargs="?", default=str(PLUGIN_BUNDLE)),
+            ]),
+            Command("profile-startup", self.profile_startup, "show the time spent by every plugin during startup", [
+                Argument("-o", "--output", help="also write the full report to this json file"),
+            ]),
         ]
 
     def start(self):
-        # add pluing package to the top level import so we can do this inside the plugins:
+        # the plugin manager resolves the imports of all modules in its search path, so we can do this
+        # inside the plugins:
         # from plugin_abc import xyz
         # instead of:
         # from plugins.plugin_abc import xyz
-        sys.path.append(str(pathlib.Path(plugins.__file__).parent))
-
         exit_code = 0
         try:
             # This is an example of how to register an extension point and extender manually.
@@ -93,23 +134,17 @@ class Application(object):
                 if isinstance(item, Argument):
                     option_parser.add_argument(*item.args, **item.kwargs)
                 elif isinstance(item, Command):
-                    if item.name in self.commands:
-                        raise ValueError("We have a command with the same name: %s", item.name)
-
                     # add sub command
                     parser = command_parser.add_parser(item.name, help=item.help)
                     for argument in item.arguments:
                         parser.add_argument(*argument.args, **argument.kwargs)
 
-                    # store the command so we can later execute it by name
-                    self.commands[item.name] = item
-
             # now that everything is setup, we can parse the command line
             options = option_parser.parse_args()
 
             # execute the command
             logger.debug("Executing command: %s with options: %s", options.command, options)
-            exit_code = self.commands[options.command].run(options)
+            exit_code = Application.arguments[options.command].run(options)
         except SystemExit as e:
             exit_code = e.code
         except:
@@ -119,8 +154,36 @@ class Application(object):
             sys.exit(0 if exit_code is None else exit_code)
 
     def list(self, options):
-        for entry in pathlib.Path(options.path).expanduser().glob("*"):
-            print(entry)
+        path = os.path.expanduser(options.path)
+        # fields needed to sort are read but not printed
+        sort_field = options.sort if options.sort and options.sort != "name" else None
+        extra = [sort_field] if sort_field and sort_field not in options.fields else []
+        batches = walk.walk(path, options.recursive, options.workers)
+        records = walk.records(batches, options.fields + extra)
+
+        if options.sort:
+            index = 0 if options.sort == "name" else 1 + (options.fields + extra).index(sort_field)
+            key = lambda record: record[index]
+            if options.limit is not None:
+                # only the first 'limit' entries are kept in memory
+                select = heapq.nlargest if options.reverse else heapq.nsmallest
+                records = select(options.limit, records, key=key)
+            else:
+                records = walk.external_sort(records, key, options.reverse)
+        elif options.limit is not None:
+            records = itertools.islice(records, options.limit)
+        if extra:
+            records = (record[:-1] for record in records)
+
+        output = getattr(sys.stdout, "buffer", sys.stdout)
+        try:
+            walk.write_records(records, output, b"\0" if options.null else b"\n")
+            output.flush()
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                raise
+            # the reader went away (e.g. piped to head), stop quietly and don't fail flushing stdout at exit
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
 
     def list_plugins(self, options):
         for plugin in self.plugin_manager.plugins:
@@ -128,10 +191,35 @@ class Application(object):
             print("Dependencies: %s" % plugin.depends)
             print("")
 
+    def profile_startup(self, options):
+        profiler = self.plugin_manager.profiler
+        if options.output:
+            profiler.dump(options.output, self.plugin_manager)
+
+        phases = profiler.phases
+        summary = profiler.summary()
+        totals = dict((id, sum(phase["wall"] for phase in summary[id].values())) for id in summary)
+        print(("%-30s" + " %11s" * (len(phases) + 2)) % (("plugin",) + phases + ("total", "cpu")))
+        for id in sorted(summary, key=totals.get, reverse=True):
+            row = [summary[id].get(phase, {}).get("wall", 0.0) * 1000 for phase in phases]
+            cpu = sum(phase["cpu"] for phase in summary[id].values()) * 1000
+            print(("%-30s" + " %11.2f" * (len(phases) + 2)) % tuple([str(id)] + row + [totals[id] * 1000, cpu]))
+
+        path, total = profiler.critical_path(self.plugin_manager)
+        print("")
+        print("Critical path: %.2f ms" % (total * 1000))
+        for id, wall in path:
+            print("  %-28s %11.2f" % (id, wall * 1000))
+
+    def build_bundle(self, options):
+        plugins, modules = PluginBundle.build(str(self.search_path), options.output)
+        print("%s: %d plugins, %d modules" % (options.output, plugins, modules))
+
 
 def main():
     search_path = pathlib.Path(plugins.__file__).parent
-    application = Application(search_path)
+    # the startup happens before the command line is parsed, so profiling must be decided here
+    application = Application(search_path, profile=sys.argv[1:2] == ["profile-startup"])
     application.start()
 
 
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the hot paths of the plugin manager, run them from the root of the project:
+
+    python -m benchmarks --plugins 1000 --output results.json
+    python -m benchmarks --save-baseline master
+    python -m benchmarks --compare master
+
+Plugins are generated in a temporary directory, see: benchmarks.plugin_tree
+"""
+__author__ = "jmrbcu"
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import importlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from plugin_manager import PluginManager, PluginFinder, PluginBundle
+from benchmarks.plugin_tree import PREFIX, EXTENSION_POINT, KINDS, generate_plugin_tree, synthetic_graph
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(ROOT, "benchmarks", "baselines")
+RESULTS_VERSION = 1
+
+_clock = getattr(time, "perf_counter", time.time)
+
+# runs the application with a synthetic search path, without touching the manifest in the user cache
+APP_DRIVER = """
+import sys
+import app
+app.PLUGIN_MANIFEST = app.pathlib.Path(sys.argv[2])
+app.PLUGIN_BUNDLE = app.pathlib.Path(sys.argv[2] + ".bundle")
+search_path = sys.argv[1]
+sys.argv = ["fstool", "list-plugins"]
+app.Application(search_path).start()
+"""
+
+
+def reset(search_path):
+    """Forget everything imported from the synthetic plugins, so the next discovery starts from scratch."""
+    for name in list(sys.modules):
+        if name.startswith(PREFIX):
+            del sys.modules[name]
+    sys.meta_path[:] = [finder for finder in sys.meta_path if not isinstance(finder, (PluginFinder, PluginBundle))]
+    sys.path[:] = [entry for entry in sys.path if not entry.startswith(search_path)]
+    if hasattr(importlib, "invalidate_caches"):
+        importlib.invalidate_caches()
+
+
+def statistics(times):
+    times = sorted(times)
+    middle = len(times) // 2
+    median = times[middle] if len(times) % 2 else (times[middle - 1] + times[middle]) / 2.0
+    return {
+        "min": times[0],
+        "median": median,
+        "mean": sum(times) / len(times),
+        "max": times[-1],
+        "repeat": len(times),
+    }
+
+
+def measure(fn, repeat, setup=None):
+    """Call 'fn' 'repeat' times and return the statistics of the wall time of each call. If 'setup' is given,
+    it is called (not measured) before each call and its result is passed to 'fn'.
+    """
+    times = []
+    for _ in range(repeat):
+        args = (setup(),) if setup is not None else ()
+        start = _clock()
+        fn(*args)
+        times.append(_clock() - start)
+    return statistics(times)
+
+
+def discovered(search_path, **kwargs):
+    reset(search_path)
+    plugin_manager = PluginManager(search_path, **kwargs)
+    plugin_manager.find_plugins()
+    return plugin_manager
+
+
+def enabled(search_path):
+    plugin_manager = discovered(search_path)
+    plugin_manager.configure_plugins()
+    plugin_manager.enable_plugins()
+    return plugin_manager
+
+
+def run_benchmarks(search_path, options):
+    """Run all benchmarks against the plugins in 'search_path'.
+
+    :returns: dict(benchmark name -> statistics)
+    """
+    work = tempfile.mkdtemp(prefix="plugin-benchmarks-")
+    manifest = os.path.join(work, "manifest.json")
+    repeat = options.repeat
+    results = {}
+    try:
+        def fresh(**kwargs):
+            def setup():
+                reset(search_path)
+                return PluginManager(search_path, workers=options.workers, **kwargs)
+            return setup
+
+        results["find_plugins"] = measure(lambda pm: pm.find_plugins(), repeat, fresh())
+        results["find_plugins_static"] = measure(lambda pm: pm.find_plugins(), repeat, fresh(static=True))
+        discovered(search_path, manifest=manifest)
+        results["find_plugins_manifest"] = measure(lambda pm: pm.find_plugins(), repeat, fresh(manifest=manifest))
+
+        def configure_and_enable(plugin_manager):
+            plugin_manager.configure_plugins()
+            plugin_manager.enable_plugins()
+        results["configure_enable_lazy"] = measure(
+            configure_and_enable, repeat, lambda: discovered(search_path, static=True)
+        )
+
+        plugin_manager = enabled(search_path)
+        ids = [plugin.id for plugin in plugin_manager.plugins]
+
+        def unsorted():
+            plugin_manager._sorted_plugins = None
+        results["plugins_order"] = measure(lambda _: plugin_manager.plugins, repeat, unsorted)
+
+        # the order of a big graph alone, a regression from linear to quadratic time stands out here
+        graph, _ = synthetic_graph(options.graph_nodes, options.depth, options.fan_out)
+
+        def unordered():
+            graph._order = None
+        results["dependency_graph_order"] = measure(lambda _: graph.order, repeat, unordered)
+
+        def all_dependencies():
+            for id in ids:
+                plugin_manager.dependencies(id)
+        results["dependencies"] = measure(all_dependencies, repeat)
+
+        extension_point = plugin_manager.get_extension_point(EXTENSION_POINT)
+        results["extension_point_evaluation"] = measure(
+            lambda _: extension_point.reload_extensions(), repeat, extension_point.invalidate
+        )
+        results["extension_point_lookup"] = measure(
+            lambda: [extension_point[id + ".0"] for id in ids], repeat
+        )
+
+        services = [id + ".service" for id in ids]
+
+        def get_services():
+            for _ in range(options.rounds):
+                for id in services:
+                    plugin_manager.get_service(id)
+        get_services()
+        executor = ThreadPoolExecutor(max_workers=options.threads)
+        try:
+            results["get_service_threads"] = measure(
+                lambda: list(executor.map(lambda _: get_services(), range(options.threads))), repeat
+            )
+        finally:
+            executor.shutdown()
+
+        if not options.skip_app:
+            reset(search_path)
+            command = [sys.executable, "-c", APP_DRIVER, search_path, os.path.join(work, "app-manifest.json")]
+
+            def start_application():
+                with open(os.devnull, "w") as devnull:
+                    subprocess.check_call(command, cwd=ROOT, stdout=devnull, stderr=devnull)
+            start_application()
+            results["application_start"] = measure(start_application, repeat)
+    finally:
+        reset(search_path)
+        shutil.rmtree(work, ignore_errors=True)
+
+    return results
+
+
+def commit():
+    try:
+        with open(os.devnull, "w") as devnull:
+            output = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=devnull)
+        return output.decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Compare the median of every benchmark with a baseline.
+
+    :returns: list((name, median, baseline median or None, ratio or None, regression))
+    """
+    comparison = []
+    for name, stats in sorted(results.items()):
+        reference = baseline.get("results", {}).get(name)
+        if reference is None or not reference["median"]:
+            comparison.append((name, stats["median"], None, None, False))
+            continue
+        ratio = stats["median"] / reference["median"]
+        comparison.append((name, stats["median"], reference["median"], ratio, ratio > 1 + threshold))
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks", description="Plugin manager benchmarks")
+    parser.add_argument("--plugins", type=int, default=1000, help="number of synthetic plugins")
+    parser.add_argument("--depth", type=int, default=10, help="number of dependency levels")
+    parser.add_argument("--fan-out", type=int, default=3, help="dependencies of every plugin")
+    parser.add_argument("--graph-nodes", type=int, default=40000, help="nodes of the dependency graph ordered")
+    parser.add_argument("--kinds", default=",".join(KINDS), help="plugin kinds to generate: dir, zip, file")
+    parser.add_argument("--repeat", type=int, default=5, help="times every benchmark is run")
+    parser.add_argument("--workers", type=int, default=8, help="discovery threads of the plugin manager")
+    parser.add_argument("--threads", type=int, default=8, help="threads requesting services")
+    parser.add_argument("--rounds", type=int, default=10, help="times every thread requests every service")
+    parser.add_argument("--skip-app", action="store_true", help="do not measure the application start")
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--save-baseline", metavar="NAME", help="store the results as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare the results with a stored baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown over the baseline reported as a regression (0.2 = 20%%)")
+    options = parser.parse_args()
+
+    # the plugin manager logs every step, keep it out of the measures
+    logging.disable(logging.INFO)
+
+    params = {
+        "plugins": options.plugins, "depth": options.depth, "fan_out": options.fan_out,
+        "graph_nodes": options.graph_nodes,
+        "kinds": options.kinds.split(","), "repeat": options.repeat, "workers": options.workers,
+        "threads": options.threads, "rounds": options.rounds,
+    }
+    search_path = tempfile.mkdtemp(prefix="plugin-tree-")
+    try:
+        generate_plugin_tree(
+            search_path, options.plugins, options.depth, options.fan_out, tuple(params["kinds"])
+        )
+        results = run_benchmarks(search_path, options)
+    finally:
+        shutil.rmtree(search_path, ignore_errors=True)
+
+    report = {
+        "version": RESULTS_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+
+    outputs = [options.output] if options.output else []
+    if options.save_baseline:
+        if not os.path.isdir(BASELINES):
+            os.makedirs(BASELINES)
+        outputs.append(os.path.join(BASELINES, options.save_baseline + ".json"))
+    for output in outputs:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    exit_code = 0
+    if options.compare:
+        with open(os.path.join(BASELINES, options.compare + ".json")) as f:
+            baseline = json.load(f)
+        if baseline.get("params") != params:
+            print("warning: the baseline was taken with different parameters: {0}".format(baseline.get("params")))
+
+        print("{0:<30} {1:>12} {2:>12} {3:>8}".format("benchmark", "median ms", "baseline ms", "ratio"))
+        for name, median, reference, ratio, regression in compare(results, baseline, options.threshold):
+            if reference is None:
+                print("{0:<30} {1:>12.3f} {2:>12} {3:>8}".format(name, median * 1000, "-", "-"))
+                continue
+            print("{0:<30} {1:>12.3f} {2:>12.3f} {3:>8.2f}{4}".format(
+                name, median * 1000, reference * 1000, ratio, "  REGRESSION" if regression else ""
+            ))
+            if regression:
+                exit_code = 1
+    else:
+        print("{0:<30} {1:>12} {2:>12} {3:>12}".format("benchmark", "median ms", "min ms", "max ms"))
+        for name, stats in sorted(results.items()):
+            print("{0:<30} {1:>12.3f} {2:>12.3f} {3:>12.3f}".format(
+                name, stats["median"] * 1000, stats["min"] * 1000, stats["max"] * 1000
+            ))
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
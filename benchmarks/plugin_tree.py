@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import os
+import random
+import zipfile
+
+from plugin_manager import DependencyGraph
+
+# all generated modules start with this prefix, so they can be removed from sys.modules between runs
+PREFIX = "bench_"
+
+# extension point declared by the first plugin and extended by every plugin
+EXTENSION_POINT = "bench.items"
+
+KINDS = ("dir", "zip", "file")
+
+PLUGIN_TEMPLATE = '''# -*- coding: utf-8 -*-
+from plugin_manager import Plugin, ExtensionPoint, extends
+
+
+class Item(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class {class_name}(Plugin):
+
+    id = "{id}"
+    name = "Benchmark plugin {index}"
+    version = "0.1"
+    description = "Synthetic plugin generated for the benchmarks"
+    platform = "all"
+    author = ["benchmarks"]
+    author_email = "benchmarks@localhost"
+    depends = {depends!r}
+    enabled = True
+{extension_point}
+    @extends("{extension_point_id}")
+    def items(self):
+        return [Item("{id}.{{0}}".format(i)) for i in range({items})]
+
+    def enable(self):
+        self.plugin_manager.register_factory("{id}.service", dict)
+'''
+
+
+def plugin_id(index):
+    return "{0}{1:05d}".format(PREFIX, index)
+
+
+def plugin_source(index, depends, items=3):
+    """Return the source of the plugin definitions of a synthetic plugin.
+
+    :param index: Number of the plugin, the first one declares the extension point extended by all plugins.
+    :type index: int
+
+    :param depends: Ids of the plugins this plugin depends on.
+    :type depends: list(str)
+
+    :param items: Number of extensions contributed by the plugin.
+    :type items: int
+
+    :returns: str
+    """
+    extension_point = ""
+    if index == 0:
+        extension_point = '\n    items_extension_point = ExtensionPoint("{0}", key="name")\n'.format(EXTENSION_POINT)
+
+    return PLUGIN_TEMPLATE.format(
+        class_name="BenchmarkPlugin{0:05d}".format(index), id=plugin_id(index), index=index, depends=depends,
+        extension_point=extension_point, extension_point_id=EXTENSION_POINT, items=items
+    )
+
+
+def dependency_levels(count, depth):
+    """Split 'count' plugins in 'depth' levels, plugins only depend on plugins of the previous level.
+
+    :returns: list(list(int))
+    """
+    depth = max(1, min(depth, count))
+    levels = [[] for _ in range(depth)]
+    for index in range(count):
+        levels[index * depth // count].append(index)
+    return levels
+
+
+def synthetic_graph(count, depth=10, fan_out=3, seed=0):
+    """Graph shaped like the synthetic plugin trees: 'depth' levels, every node depends on 'fan_out' random
+    nodes of the previous level. Nodes are added in random order.
+    """
+    rand = random.Random(seed)
+    depends, previous = {}, []
+    for level in dependency_levels(count, depth):
+        for index in level:
+            depends["p{0}".format(index)] = ["p{0}".format(i) for i in rand.sample(previous, min(fan_out, len(previous)))]
+        previous = level
+    ids = list(depends)
+    rand.shuffle(ids)
+
+    graph = DependencyGraph()
+    for id in ids:
+        graph.add(id, depends[id])
+    return graph, depends
+
+
+def generate_plugin_tree(path, count=100, depth=5, fan_out=3, kinds=KINDS, items=3, seed=0):
+    """Generate synthetic plugins in a directory. Plugins are spread in 'depth' levels and every plugin
+    depends on 'fan_out' random plugins of the previous level, so the longest dependency chain has
+    'depth' plugins. Plugin kinds (package directory, zip file or python file) are used in turns.
+
+    :param path: Directory where the plugins are generated, it is created if needed.
+    :type path: str
+
+    :param count: Number of plugins.
+    :type count: int
+
+    :param depth: Number of dependency levels.
+    :type depth: int
+
+    :param fan_out: Number of dependencies of every plugin not in the first level.
+    :type fan_out: int
+
+    :param kinds: Kinds of plugins to generate: "dir", "zip" and/or "file".
+    :type kinds: tuple(str)
+
+    :param items: Number of extensions contributed by every plugin.
+    :type items: int
+
+    :param seed: Seed used to choose the dependencies, the same arguments always generate the same tree.
+    :type seed: int
+
+    :returns: Ids of the plugins generated.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    rand = random.Random(seed)
+    ids = []
+    previous = []
+    for level in dependency_levels(count, depth):
+        for index in level:
+            depends = sorted(plugin_id(i) for i in rand.sample(previous, min(fan_out, len(previous))))
+            source = plugin_source(index, depends, items)
+            write_plugin(path, plugin_id(index), kinds[index % len(kinds)], source)
+            ids.append(plugin_id(index))
+        previous = level
+    return ids
+
+
+def write_plugin(path, id, kind, source):
+    if kind == "dir":
+        package = os.path.join(path, id)
+        os.makedirs(package)
+        with open(os.path.join(package, "__init__.py"), "w") as f:
+            f.write("")
+        with open(os.path.join(package, "plugin_definitions.py"), "w") as f:
+            f.write(source)
+    elif kind == "zip":
+        with zipfile.ZipFile(os.path.join(path, id + ".zip"), "w") as archive:
+            archive.writestr(id + "/__init__.py", "")
+            archive.writestr(id + "/plugin_definitions.py", source)
+    elif kind == "file":
+        with open(os.path.join(path, id + ".py"), "w") as f:
+            f.write(source)
+    else:
+        raise ValueError("Unknown plugin kind: {0}".format(kind))
@@ -1,13 +1,66 @@
 # TODO: Start using pathlib for path manipulation
 import os
 import sys
+import ast
+import json
+import mmap
+import struct
+import marshal
 import logging
+import weakref
 import inspect
 import importlib
-from collections import Iterable, OrderedDict
+import time
+import zipfile
+import zipimport
+import threading
+import contextlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+try:
+    import importlib.util
+    import importlib.machinery
+except ImportError:
+    # python 2: plugins are imported through sys.path and plugin bundles are not supported
+    pass
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
 
 logger = logging.getLogger(__name__)
 
+try:
+    _string_types = (basestring,)
+except NameError:
+    _string_types = (str,)
+
+_iscoroutinefunction = getattr(inspect, "iscoroutinefunction", lambda fn: False)
+_isawaitable = getattr(inspect, "isawaitable", lambda obj: False)
+
+_clock = getattr(time, "monotonic", time.time)
+_perf_clock = getattr(time, "perf_counter", _clock)
+# cpu time of the calling thread when available, so measures taken in thread pools are not mixed up
+_cpu_clock = getattr(time, "thread_time", None) or getattr(time, "process_time", None) or time.clock
+
+# service lifetimes, see: PluginManager.register_factory
+SINGLETON = "singleton"
+THREAD = "thread"
+CONTEXT = "context"
+TRANSIENT = "transient"
+
 
 class PluginError(Exception):
     pass
@@ -32,25 +85,196 @@ class ExtensionPoint(Iterable):
     """
     An extension point is a place where plugins can extend functionality.
     Extension points must have an unique id.
+
+    Extension points declared with a key keep an index of its extensions by that key, so they can be
+    looked up with: extension_point[key] or extension_point.get(key). Extensions with the same key
+    are rejected when they are added to the extension point.
+
+        archivers = ExtensionPoint("archivers", key="file_type")
+
+    The result of every extender is cached, adding or removing an extender evaluates only that extender.
+    Every change increments 'generation' and is notified to the subscribers (see: subscribe).
     """
 
-    def __init__(self, id):
+    def __init__(self, id, key=None):
         """
         Initialize the extension point with an unique id
         :param id: extension point id
         :type id: str
+
+        :param key: Optional attribute name or callable(extension) that returns the key of an extension.
+            Extensions without the attribute (or for which the callable returns None) are not indexed.
+        :type key: str or callable
         """
         self.id = id
+        self.key = key
         self.extenders = []
         self.extensions = []
+        self.index = {}
+        self.loaded = False
+        self.generation = 0
+        self._results = {}
+        self._subscribers = []
+        self._lock = threading.RLock()
+        # set by the plugin manager when the extension point is registered
+        self.profiler = None
 
     def reload_extensions(self):
-        self.extensions = []
-        for extender in self.extenders:
-            extensions = extender()
-            if not hasattr(extensions, "__iter__"):
-                raise TypeError("extender method: {0} must return an iterable".format(extender))
-            self.extensions.extend(extensions)
+        """Evaluate all extenders again."""
+        with self._lock:
+            self.update_results(dict((extender, self._evaluate(extender)) for extender in self.extenders))
+
+    def add_extender(self, extender):
+        """Add an extender. If the extensions are already loaded, only this extender is evaluated."""
+        with self._lock:
+            if extender in self.extenders:
+                return
+
+            if self.loaded:
+                result = self._evaluate(extender)
+                index = dict(self.index)
+                self._index(result, index)
+                self.extenders.append(extender)
+                self._results[extender] = result
+                self.extensions = self.extensions + result
+                self.index = index
+                self._changed()
+            else:
+                self.extenders.append(extender)
+
+    def remove_extender(self, extender):
+        """Remove an extender and its extensions, without evaluating the other extenders."""
+        with self._lock:
+            try:
+                self.extenders.remove(extender)
+            except ValueError:
+                return
+
+            result = self._results.pop(extender, None)
+            if self.loaded:
+                self.extensions = [extension for extender in self.extenders for extension in self._results[extender]]
+                for extension in result:
+                    key = self.key_of(extension) if self.key is not None else None
+                    if key is not None and self.index.get(key) is extension:
+                        del self.index[key]
+                self._changed()
+
+    def update_results(self, results):
+        """Replace the cached result of the extenders and rebuild the extensions.
+
+        :param results: Mapping extender -> list of extensions. Extenders without an entry are evaluated.
+        :type results: dict
+        """
+        with self._lock:
+            extensions, index = [], {}
+            for extender in self.extenders:
+                if extender not in results:
+                    # added while the results were computed
+                    results[extender] = self._evaluate(extender)
+                self._index(results[extender], index)
+                extensions.extend(results[extender])
+
+            self._results = results
+            self.extensions = extensions
+            self.index = index
+            self.loaded = True
+            self._changed()
+
+    def invalidate(self):
+        """Drop the cached extensions, they will be evaluated again the next time they are requested."""
+        with self._lock:
+            self._results = {}
+            self.extensions = []
+            self.index = {}
+            self.loaded = False
+            self._changed()
+
+    def adopt(self, other):
+        """Take the extenders, cached extensions and subscribers of another extension point with the same id.
+        Used to replace a placeholder with the real extension point.
+        """
+        with self._lock:
+            self.extenders = other.extenders
+            self._subscribers = other._subscribers + self._subscribers
+            if other.loaded:
+                self.update_results(other._results)
+
+    def subscribe(self, callback):
+        """Call 'callback(extension_point)' every time the extensions of this extension point change, or are
+        invalidated (see: invalidate). After an invalidation 'loaded' is False and the extensions are evaluated
+        again the next time they are requested, the callback must not reload them itself.
+        """
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        try:
+            self._subscribers.remove(callback)
+        except ValueError:
+            pass
+
+    def key_of(self, extension):
+        """Return the key of an extension or None if it doesn't have one."""
+        if callable(self.key):
+            return self.key(extension)
+        return getattr(extension, self.key, None)
+
+    def get(self, key, default=None):
+        """Return the extension with this key or 'default'."""
+        return self[key] if key in self else default
+
+    def _evaluate(self, extender):
+        profiler = self.profiler
+        if profiler is not None and profiler.enabled:
+            with profiler.measure(_extender_owner(extender), "extenders", self.id):
+                result = extender()
+        else:
+            result = extender()
+        if not hasattr(result, "__iter__"):
+            raise TypeError("extender method: {0} must return an iterable".format(extender))
+        return list(result)
+
+    def _index(self, extensions, index):
+        if self.key is None:
+            return
+        for extension in extensions:
+            key = self.key_of(extension)
+            if key is None:
+                continue
+            if key in index:
+                raise PluginError("Duplicated key: {0} in extension point: {1}".format(key, self.id))
+            index[key] = extension
+
+    def _changed(self):
+        self.generation += 1
+        for callback in list(self._subscribers):
+            callback(self)
+
+    def _load(self):
+        if not self.loaded:
+            self.reload_extensions()
+        return self.extensions
+
+    def __getitem__(self, key):
+        if self.key is None:
+            raise TypeError("Extension point: {0} is not declared with a key".format(self.id))
+        self._load()
+        return self.index[key]
+
+    def __contains__(self, key):
+        if self.key is None:
+            raise TypeError("Extension point: {0} is not declared with a key".format(self.id))
+        self._load()
+        return key in self.index
+
+    def reload_extensions_async(self):
+        """Same as reload_extensions but extenders may be coroutine functions. All extenders are evaluated
+        concurrently. Must be awaited: await extension_point.reload_extensions_async()
+
+        :returns: coroutine
+        """
+        from plugin_manager_async import reload_extensions
+        return reload_extensions(self)
 
     def __iter__(self):
         return self
@@ -65,14 +289,8 @@ class ExtensionPoint(Iterable):
         if instance is None:
             return self
 
-        # return the cached contributions
-        if self.extensions:
-            return self.extensions
-
-        # reload the contributions
-        self.reload_extensions()
-
-        return self.extensions
+        # return the cached contributions or load them
+        return self._load()
 
     def __set__(self, instance, value):
         raise AttributeError("Cannot assign values to an ExtensionPoint")
@@ -81,7 +299,64 @@ class ExtensionPoint(Iterable):
         return self.id
 
 
-class Plugin(object):
+def _extender_owner(extender):
+    """Return the id of the plugin that declares an extender or the qualified name of the extender."""
+    plugin = getattr(extender, "plugin", None) or getattr(extender, "__self__", None)
+    return getattr(plugin, "id", None) or getattr(extender, "__qualname__", getattr(extender, "__name__", None))
+
+
+def with_metaclass(meta, *bases):
+    """Return a base class to create a class with a metaclass, works with python 2 and 3:
+
+        class Plugin(with_metaclass(PluginType, object)):
+    """
+    class metaclass(meta):
+        def __new__(cls, name, this_bases, namespace):
+            return meta(name, bases, namespace)
+    return type.__new__(metaclass, "temporary_class", (), {})
+
+
+class PluginType(type):
+    """Metaclass of plugins. The plugin class is inspected once, when it is created:
+
+    - metadata fields (see: Plugin._fields) are validated. Classes missing some field can't be
+      instantiated: creating an instance raises TypeError, the plugin manager logs it as a loading error.
+    - extension points and extenders declared in the class and its bases are stored as tuples
+      in '_extension_points' and '_extenders' (name, function).
+    - '__slots__' is set to an empty tuple if the class doesn't declare it and opts in with
+      'compact_instances = True' (or a base class did), so plugin instances don't get a '__dict__'.
+      Such plugins must declare the state kept in the instance in '__slots__'.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        compact = namespace.get("compact_instances", any(getattr(base, "compact_instances", False) for base in bases))
+        if compact and "__slots__" not in namespace:
+            namespace["__slots__"] = ()
+        cls = super(PluginType, mcs).__new__(mcs, name, bases, namespace)
+
+        extension_points, extenders, seen = [], [], set()
+        for klass in cls.__mro__:
+            for attr_name, attr in klass.__dict__.items():
+                # names redefined in a subclass hide the ones in the bases
+                if attr_name in seen:
+                    continue
+                seen.add(attr_name)
+                if isinstance(attr, ExtensionPoint):
+                    extension_points.append(attr)
+                elif callable(attr) and hasattr(attr, "_extension_point"):
+                    extenders.append((attr_name, attr))
+        cls._extension_points = tuple(extension_points)
+        cls._extenders = tuple(extenders)
+
+        fields = getattr(cls, "_fields", ())
+        cls._missing_fields = tuple(attr for attr in fields if not hasattr(cls, attr))
+        depends = getattr(cls, "depends", ())
+        if not cls._missing_fields and (isinstance(depends, _string_types) or not isinstance(depends, Iterable)):
+            raise TypeError("Plugin: {0} must declare its dependencies as a list of ids".format(name))
+        return cls
+
+
+class Plugin(with_metaclass(PluginType, object)):
     """A plugin is an object that can declare extension points that other
     plugins can extend (plug in to) by means of extensions. A plugin
     can extend extension points declared by other plugins and itself.
@@ -99,6 +374,8 @@ class Plugin(object):
         Ej. depends = ('imagis.plugins.core', 'imagis.plugins.shell')
             depends = []
     enabled: Enable or disable the plugin
+
+    Set 'compact_instances = True' to create instances without a '__dict__', see: PluginType
     """
 
     _fields = (
@@ -113,37 +390,33 @@ class Plugin(object):
         "enabled",
     )
 
-    def __new__(cls, *args, **kwargs):
-        instance = super(Plugin, cls).__new__(cls)
+    __slots__ = ("plugin_manager", "__weakref__")
+    compact_instances = False
 
-        # check if the plugin instance has declared all metadata fields
-        for attr in cls._fields:
-            if not hasattr(instance, attr):
-                raise TypeError("Missing attribute: {0} in plugin: {1}".format(attr, cls.__name__))
-        return instance
+    def __new__(cls, *args, **kwargs):
+        # metadata fields are checked once, when the class is created (see: PluginType)
+        if cls._missing_fields:
+            raise TypeError("Missing attribute: {0} in plugin: {1}".format(cls._missing_fields[0], cls.__name__))
+        return super(Plugin, cls).__new__(cls)
 
     def __init__(self, plugin_manager):
         self.plugin_manager = plugin_manager
 
     @property
     def extension_points(self):
-        """Return all extension points declared in this plugin.
+        """Return all extension points declared in this plugin and its base classes.
 
-        :returns: list(ExtensionPoint)
+        :returns: tuple(ExtensionPoint)
         """
-        for attr in self.__class__.__dict__.values():
-            if isinstance(attr, ExtensionPoint):
-                yield attr
+        return self._extension_points
 
     @property
     def extenders(self):
-        """Return all extenders declared in this plugin.
+        """Return all extenders declared in this plugin and its base classes.
 
-        :returns: list(callable)
+        :returns: tuple(callable)
         """
-        for name, attr in self.__class__.__dict__.items():
-            if callable(attr) and hasattr(attr, "_extension_point"):
-                yield getattr(self, name)
+        return tuple(getattr(self, name) for name, _ in self._extenders)
 
     def configure(self):
         """Called by the plugin manager "configure_plugins" method to ask the plugin to configure itself.
@@ -160,6 +433,14 @@ class Plugin(object):
         """
         pass
 
+    def disable(self):
+        """Called by the plugin manager when the plugin is about to be unloaded, after all plugins
+        depending on it were disabled. Subclasses may redefine this method to release resources
+        acquired in "enable". Services, extension points and extenders of the plugin are removed
+        by the plugin manager after this call.
+        """
+        pass
+
     def __str__(self):
         result = self.__class__.__name__ + ":\n"
         for attr in self._fields:
@@ -167,6 +448,1700 @@ class Plugin(object):
         return result
 
 
+class LazyExtender(object):
+    """Extender of a plugin that has not been imported yet. Calling it loads the plugin
+    and calls the real extender method.
+    """
+
+    def __init__(self, plugin, name, extension_point_id):
+        self.plugin = plugin
+        self.__name__ = name
+        self.__module__ = plugin.module
+        self._extension_point = extension_point_id
+
+    def __call__(self):
+        return getattr(self.plugin.load(), self.__name__)()
+
+    def __repr__(self):
+        return "<LazyExtender {0}.{1}>".format(self.plugin.class_name, self.__name__)
+
+
+class LazyPlugin(object):
+    """Stand-in used by the plugin manager for every discovered plugin. It knows the plugin
+    metadata, the ids of its extension points and its extenders without importing the plugin
+    module. The real Plugin instance is created the first time something else is needed from it.
+    """
+
+    # plugin hooks that, if not overridden by the plugin class, can be skipped without importing it
+    hooks = ("configure", "enable", "disable")
+
+    def __init__(self, plugin_manager, path, module, class_name, metadata, extension_points=(), extenders=(),
+                 hooks=None, instance=None):
+        """
+        :param plugin_manager: The plugin manager that owns this plugin.
+        :param path: Absolute path of the plugin (directory, zip or python file).
+        :param module: Name of the module where the plugin class is defined.
+        :param class_name: Name of the plugin class.
+        :param metadata: Plugin metadata, a mapping with all the fields in: Plugin._fields
+        :param extension_points: Ids of the extension points declared by the plugin.
+        :param extenders: List of (method name, extension point id) of the extenders declared by the plugin.
+        :param hooks: Name of the hooks (see LazyPlugin.hooks) overridden by the plugin class.
+        :param instance: The real plugin instance, if it was already created.
+        """
+        for attr in Plugin._fields:
+            if attr not in metadata:
+                raise TypeError("Missing attribute: {0} in plugin: {1}".format(attr, class_name))
+            setattr(self, attr, metadata[attr])
+
+        self.plugin_manager = plugin_manager
+        self.path = path
+        self.module = module
+        self.class_name = class_name
+        # extension points are described by its id or by [id, key] if they are declared with a key,
+        # callable keys can't be described, in that case key is True and the plugin is loaded to get them
+        self.extension_point_specs = tuple(
+            (spec, None) if isinstance(spec, _string_types) else tuple(spec) for spec in extension_points
+        )
+        self.extender_specs = tuple(tuple(spec) for spec in extenders)
+        self.overridden_hooks = frozenset(self.hooks if hooks is None else hooks)
+        self.instance = instance
+
+        self._extension_points = None
+        self._extenders = None
+
+    @classmethod
+    def from_plugin(cls, plugin_manager, path, plugin):
+        """Create a stand-in for an already created plugin instance."""
+        klass = plugin.__class__
+        overridden = [
+            hook for hook in cls.hooks
+            if any(hook in base.__dict__ for base in klass.__mro__ if base is not Plugin)
+        ]
+        return cls(
+            plugin_manager, path, klass.__module__, klass.__name__,
+            dict((attr, getattr(plugin, attr)) for attr in Plugin._fields),
+            [
+                [extension_point.id, True if callable(extension_point.key) else extension_point.key]
+                for extension_point in plugin.extension_points
+            ],
+            # names of the class attributes, the function may be named otherwise: foo = extends("id")(bar)
+            [(name, extender._extension_point) for name, extender in klass._extenders],
+            overridden, plugin
+        )
+
+    @classmethod
+    def from_dict(cls, plugin_manager, path, data):
+        """Create a stand-in from the description returned by: to_dict"""
+        return cls(plugin_manager, path, data["module"], data["class"], data["metadata"],
+                   data["extension_points"], data["extenders"], data["hooks"])
+
+    def to_dict(self):
+        """Return a json serializable description of the plugin."""
+        return {
+            "module": self.module,
+            "class": self.class_name,
+            "metadata": dict((attr, getattr(self, attr)) for attr in Plugin._fields),
+            "extension_points": [list(spec) for spec in self.extension_point_specs],
+            "extenders": [list(spec) for spec in self.extender_specs],
+            "hooks": sorted(self.overridden_hooks),
+        }
+
+    @property
+    def loaded(self):
+        return self.instance is not None
+
+    def load(self):
+        """Import the plugin module (if needed) and return the real plugin instance.
+
+        :returns: Plugin
+        """
+        if self.instance is None:
+            with self.plugin_manager._load_lock:
+                if self.instance is None:
+                    logger.debug("Loading plugin: {0} from: {1}".format(self.id, self.module))
+                    instance = self.plugin_manager._instantiate(self)
+                    self.plugin_manager._plugin_loaded(self, instance)
+                    self.instance = instance
+        return self.instance
+
+    @property
+    def extension_points(self):
+        """Return the extension points declared in this plugin. Until the plugin is loaded
+        those are placeholders that get replaced by the real ones when the plugin is loaded.
+
+        :returns: list(ExtensionPoint)
+        """
+        if self.instance is None and any(key is True for _, key in self.extension_point_specs):
+            self.load()
+        if self.instance is not None:
+            return list(self.instance.extension_points)
+        if self._extension_points is None:
+            self._extension_points = [ExtensionPoint(id, key) for id, key in self.extension_point_specs]
+        return self._extension_points
+
+    @property
+    def extenders(self):
+        """Return all extenders declared in this plugin.
+
+        :returns: list(LazyExtender)
+        """
+        if self._extenders is None:
+            self._extenders = [LazyExtender(self, name, id) for name, id in self.extender_specs]
+        return self._extenders
+
+    def configure(self):
+        if "configure" in self.overridden_hooks:
+            return self._call_hook("configure")
+
+    def enable(self):
+        if "enable" in self.overridden_hooks:
+            return self._call_hook("enable")
+
+    def _call_hook(self, hook):
+        with self.plugin_manager.running(self):
+            method = getattr(self.load(), hook)
+            if _iscoroutinefunction(method):
+                # only creates the coroutine, it is measured while awaited, see: plugin_manager_async.run_hooks
+                return method()
+            with self.plugin_manager.profiler.measure(self.id, hook):
+                return method()
+
+    def disable(self):
+        # a plugin never loaded never ran any code, so there is nothing to disable
+        if "disable" in self.overridden_hooks and self.instance is not None:
+            with self.plugin_manager.running(self):
+                return self.instance.disable()
+
+    def __getattr__(self, name):
+        # only called for attributes not found in the stand-in itself
+        if name.startswith("__") or name == "instance":
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __str__(self):
+        result = self.class_name + ":\n"
+        for attr in Plugin._fields:
+            result += "\t" + attr + ": " + str(getattr(self, attr)) + "\n"
+        return result
+
+
+class PluginManifest(object):
+    """Persistent cache with the description of every plugin found in the search path.
+    Entries are keyed by plugin path and validated with the modification time and size
+    of the files of the plugin, so only new or changed plugins must be imported to find
+    out what they declare.
+    """
+
+    version = 4
+
+    def __init__(self, path):
+        """
+        :param path: Path of the manifest file.
+        :type path: str
+        """
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    @staticmethod
+    def stamp(plugin_path, is_dir=None):
+        """Return the stamp used to validate the cached entry of a plugin path, or None if the
+        path can't be cached (it doesn't look like a plugin). A package is stamped with all its
+        modules, plugin_definitions may import the plugin classes from other modules of the package.
+
+        :param is_dir: If the plugin path is a directory, if it is already known.
+        :type is_dir: bool
+
+        :returns: [mtime, size] of a file, [last mtime, total size, number of modules] of a package or None
+        """
+        if is_dir is None:
+            is_dir = os.path.isdir(plugin_path)
+
+        if not is_dir:
+            if not plugin_path.endswith((".zip", ".py", ".pyc")):
+                return None
+            try:
+                st = os.stat(plugin_path)
+            except OSError:
+                return None
+            return [getattr(st, "st_mtime_ns", int(st.st_mtime * 1e9)), st.st_size]
+
+        # modules without source are stamped by their compiled files, the compiled files of the sources
+        # are skipped, they are written (next to the source in python 2) when the plugin is imported
+        for ext in (".py", ".pyc"):
+            if os.path.exists(os.path.join(plugin_path, "plugin_definitions" + ext)):
+                break
+        else:
+            return None
+
+        mtime = size = files = 0
+        for directory, dirnames, filenames in os.walk(plugin_path):
+            dirnames[:] = [dirname for dirname in dirnames if dirname != "__pycache__"]
+            for filename in filenames:
+                if os.path.splitext(filename)[1] != ext:
+                    continue
+                try:
+                    st = os.stat(os.path.join(directory, filename))
+                except OSError:
+                    continue
+                mtime = max(mtime, getattr(st, "st_mtime_ns", int(st.st_mtime * 1e9)))
+                size += st.st_size
+                files += 1
+        return [mtime, size, files]
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+
+        if data.get("version") == self.version:
+            self.entries = data.get("entries", {})
+        else:
+            logger.debug("Ignoring plugin manifest with unknown version: {0}".format(self.path))
+
+    def get(self, plugin_path, stamp):
+        """Return the plugin descriptions cached for this plugin path or None if there is no
+        entry or it is stale.
+
+        :returns: list(dict) or None
+        """
+        entry = self.entries.get(plugin_path)
+        if entry is not None and entry["stamp"] == stamp:
+            return entry["plugins"]
+        return None
+
+    def put(self, plugin_path, stamp, plugins):
+        self.entries[plugin_path] = {"stamp": stamp, "plugins": plugins}
+        self.dirty = True
+
+    def prune(self, search_path, seen):
+        """Drop the entries of plugins that were in one of the directories in 'search_path' but
+        are not there anymore.
+        """
+        search_path = set(search_path)
+        for plugin_path in list(self.entries):
+            if plugin_path not in seen and os.path.dirname(plugin_path) in search_path:
+                del self.entries[plugin_path]
+                self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        directory = os.path.dirname(self.path)
+        tmp = "{0}.{1}.tmp".format(self.path, os.getpid())
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(tmp, "w") as f:
+                json.dump({"version": self.version, "entries": self.entries}, f)
+            getattr(os, "replace", os.rename)(tmp, self.path)
+            self.dirty = False
+        except (IOError, OSError) as e:
+            logger.warning("Unable to save the plugin manifest: {0}, reason: {1}".format(self.path, e))
+
+
+class DependencyGraph(object):
+    """Dependency graph of the plugins. Besides the dependencies of every node it keeps the reverse
+    dependencies (dependents) so both can be walked without scanning the whole graph. The topological
+    order is computed once (Kahn's algorithm, O(V+E)) and cached until a node is added or removed.
+    """
+
+    def __init__(self):
+        self.depends = OrderedDict()
+        self.dependents = {}
+        self._order = None
+
+    def __contains__(self, id):
+        return id in self.depends
+
+    def __len__(self):
+        return len(self.depends)
+
+    def add(self, id, depends):
+        """Add a node to the graph. Dependencies don't need to be in the graph yet.
+
+        :param id: Node id.
+        :type id: str
+
+        :param depends: Ids of the nodes this node depends on.
+        :type depends: iterable(str)
+        """
+        if id in self.depends:
+            raise PluginError("Duplicated plugin: {0}".format(id))
+
+        self.depends[id] = tuple(depends)
+        self.dependents.setdefault(id, [])
+        for dep in self.depends[id]:
+            self.dependents.setdefault(dep, []).append(id)
+        self._order = None
+
+    def remove(self, id):
+        """Remove a node from the graph. Nodes depending on it will have a missing dependency."""
+        for dep in self.depends.pop(id):
+            self.dependents[dep].remove(id)
+            if not self.dependents[dep] and dep not in self.depends:
+                del self.dependents[dep]
+        if not self.dependents.get(id):
+            self.dependents.pop(id, None)
+        self._order = None
+
+    @property
+    def order(self):
+        """Return all node ids sorted so every node comes after its dependencies.
+
+        :returns: tuple(str)
+        """
+        if self._order is None:
+            pending = OrderedDict()
+            for id, depends in self.depends.items():
+                for dep in depends:
+                    if dep not in self.depends:
+                        raise PluginError("Missing dependency: {0} for plugin: {1} ".format(dep, id))
+                pending[id] = len(depends)
+
+            order = []
+            ready = deque(id for id, count in pending.items() if not count)
+            while ready:
+                id = ready.popleft()
+                order.append(id)
+                for dependent in self.dependents[id]:
+                    pending[dependent] -= 1
+                    if not pending[dependent]:
+                        ready.append(dependent)
+
+            if len(order) != len(self.depends):
+                raise PluginError("Cyclic dependency detected: {0}".format(" --> ".join(self._cycle(pending))))
+            self._order = tuple(order)
+        return self._order
+
+    def _cycle(self, pending):
+        """Return one of the cycles left by Kahn's algorithm, the first node repeated at the end. Every node
+        left has a dependency left, so following them always ends in a cycle.
+        """
+        remaining = set(id for id, count in pending.items() if count)
+        path, index = [], {}
+        node = next(id for id in pending if id in remaining)
+        while node not in index:
+            index[node] = len(path)
+            path.append(node)
+            node = next(dep for dep in self.depends[node] if dep in remaining)
+        return path[index[node]:] + [node]
+
+    def dependencies(self, id, include_self=True):
+        """Return the transitive dependencies of a node, sorted so every node comes after its dependencies.
+
+        :returns: list(str)
+        """
+        if id not in self.depends:
+            raise PluginError("Missing plugin: {0}".format(id))
+
+        resolved, done, unresolved = [], set(), set([id])
+        stack = [(id, iter(self.depends[id]))]
+        while stack:
+            node, deps = stack[-1]
+            for dep in deps:
+                if dep in done:
+                    continue
+                if dep not in self.depends:
+                    raise PluginError("Missing dependency: {0} for plugin: {1} ".format(dep, node))
+                if dep in unresolved:
+                    raise PluginError("Cyclic dependency detected: {0} --> {1}".format(node, dep))
+                unresolved.add(dep)
+                stack.append((dep, iter(self.depends[dep])))
+                break
+            else:
+                stack.pop()
+                unresolved.discard(node)
+                done.add(node)
+                resolved.append(node)
+
+        return resolved if include_self else resolved[:-1]
+
+    def all_dependents(self, id, include_self=True):
+        """Return the nodes that depend, directly or not, on a node, sorted so every node comes after
+        its dependencies.
+
+        :returns: list(str)
+        """
+        found, pending = set([id]), [id]
+        while pending:
+            for dependent in self.dependents.get(pending.pop(), ()):
+                if dependent not in found:
+                    found.add(dependent)
+                    pending.append(dependent)
+
+        if not include_self:
+            found.discard(id)
+        return [node for node in self.order if node in found]
+
+
+def _scan_plugin_path(path):
+    """Return the (path, is_dir) of every module in a directory of the search path, sorted by name. Entries
+    that are not modules (e.g. __pycache__) are skipped, see: PluginFinder.module_name. The type of the
+    entries comes from the directory listing itself when the filesystem provides it.
+    """
+    entries = []
+    try:
+        for entry in scandir(path):
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if PluginFinder.module_name(entry.path, is_dir) is not None:
+                entries.append((entry.name, entry.path, is_dir))
+    except OSError as e:
+        logger.error("error scanning plugin path: {0}, reason: {1}".format(path, e))
+    return [(entry_path, is_dir) for _, entry_path, is_dir in sorted(entries)]
+
+
+# async def is only in the grammar of python 3.5+
+_function_defs = (ast.FunctionDef, getattr(ast, "AsyncFunctionDef", ()))
+
+
+def _name(node):
+    """Return the dotted name of a Name/Attribute node or None."""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        base = _name(node.value)
+        return base + "." + node.attr if base else None
+    return None
+
+
+def _call_argument(node, callee):
+    """If node is a call to 'callee' return its first argument, otherwise None. Raise ValueError if the
+    argument is not a string literal (e.g. a constant), the call can't be described without importing.
+    """
+    if isinstance(node, ast.Call) and (_name(node.func) or "").split(".")[-1] == callee:
+        value = ast.literal_eval(node.args[0]) if node.args else None
+        if not isinstance(value, _string_types):
+            raise ValueError("Not a string literal")
+        return value
+    return None
+
+
+def _call_keyword(node, name, position):
+    """Return the literal value of an argument of a call node, given by name or position, or None if it
+    is not in the call. Raise ValueError if the argument is not a literal.
+    """
+    for keyword in node.keywords:
+        if keyword.arg == name:
+            return ast.literal_eval(keyword.value)
+    if len(node.args) > position:
+        return ast.literal_eval(node.args[position])
+    return None
+
+
+def _declares(node, types, callee=None):
+    """Return True if a statement has, at any depth, a node of some types or a call to 'callee'."""
+    for child in ast.walk(node):
+        if isinstance(child, types):
+            return True
+        if callee is not None and isinstance(child, ast.Call) and (_name(child.func) or "").split(".")[-1] == callee:
+            return True
+    return False
+
+
+def parse_plugin_definitions(source, module, filename="<unknown>"):
+    """Find the plugins defined in the source code of a plugin definitions module without executing it.
+    Only plugin classes directly derived from Plugin and defined at the top level of the module, whose
+    metadata fields are literals and whose extenders are decorated methods, can be described this way;
+    if the module defines anything else that could be a plugin or an extender (e.g. classes defined inside
+    an if or try statement or extenders assigned to a class attribute), None is returned so the caller can
+    fall back to import the module.
+
+    :param source: Source code of the plugin definitions module.
+    :type source: str
+
+    :param module: Name of the module.
+    :type module: str
+
+    :param filename: File name used in syntax errors.
+    :type filename: str
+
+    :returns: list(dict) in the format of LazyPlugin.to_dict or None.
+    """
+    try:
+        tree = ast.parse(source, filename)
+    except SyntaxError:
+        return None
+
+    plugins = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            if _declares(node, ast.ClassDef, "extends"):
+                # classes defined conditionally or extenders added out of a class body
+                return None
+            continue
+
+        bases = [(_name(base) or "").split(".")[-1] for base in node.bases]
+        if "Plugin" not in bases:
+            if any(base != "object" for base in bases):
+                # this class may inherit from a plugin, we can't know without importing the module
+                return None
+            continue
+        elif len(bases) > 1:
+            return None
+
+        metadata, extension_points, extenders, hooks = {}, [], [], []
+        for item in node.body:
+            if isinstance(item, ast.Assign) and len(item.targets) == 1 and isinstance(item.targets[0], ast.Name):
+                attr = item.targets[0].id
+                try:
+                    extension_point = _call_argument(item.value, "ExtensionPoint")
+                except ValueError:
+                    return None
+                if extension_point is not None:
+                    try:
+                        key = _call_keyword(item.value, "key", 1)
+                    except ValueError:
+                        # not a literal key, probably a callable
+                        return None
+                    extension_points.append([extension_point, key])
+                elif attr in Plugin._fields:
+                    try:
+                        metadata[attr] = ast.literal_eval(item.value)
+                    except ValueError:
+                        return None
+                elif isinstance(item.value, ast.Name) or _declares(item.value, (), "extends"):
+                    # maybe an extender assigned or aliased: foo = extends("id")(bar) or foo = bar
+                    return None
+            elif isinstance(item, _function_defs):
+                if item.name in LazyPlugin.hooks:
+                    hooks.append(item.name)
+                for decorator in item.decorator_list:
+                    try:
+                        extension_point = _call_argument(decorator, "extends")
+                    except ValueError:
+                        return None
+                    if extension_point is not None:
+                        extenders.append([item.name, extension_point])
+            elif not isinstance(item, (ast.Expr, ast.Pass)) and _declares(item, (ast.Assign,) + _function_defs):
+                # methods, extenders or fields defined inside an if, try, etc.
+                return None
+
+        if any(attr not in metadata for attr in Plugin._fields):
+            return None
+
+        plugins.append({
+            "module": module,
+            "class": node.name,
+            "metadata": metadata,
+            "extension_points": extension_points,
+            "extenders": extenders,
+            "hooks": hooks,
+        })
+    return plugins
+
+
+class _ThreadLocalVar(threading.local):
+    """Minimal replacement of contextvars.ContextVar for python versions without it."""
+
+    value = None
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        token, self.value = self.value, value
+        return token
+
+    def reset(self, token):
+        self.value = token
+
+
+class ServicePool(object):
+    """Bounded pool of objects created by a factory, for services that can't be shared, e.g. connections.
+    Objects are handed out with 'acquire' and returned to the pool when the block ends:
+
+        with pool.acquire() as connection:
+            ...
+
+    The most recently returned object is handed out first, objects idle for more than 'idle_timeout'
+    seconds are discarded (keeping at least 'min_size' objects) and, if there is a health check, objects
+    failing it are discarded instead of being handed out. When 'max_size' objects are in use, callers wait.
+    """
+
+    def __init__(self, factory, min_size=0, max_size=10, idle_timeout=None, health_check=None, dispose=None):
+        """
+        :param factory: Callable that creates a new object.
+        :type factory: callable() -> object
+
+        :param min_size: Number of objects created up front and never discarded for being idle.
+        :type min_size: int
+
+        :param max_size: Maximum number of objects, in use or idle.
+        :type max_size: int
+
+        :param idle_timeout: Seconds an object can stay idle before it is discarded.
+        :type idle_timeout: float
+
+        :param health_check: Called before handing out an idle object, the object is discarded if it returns False.
+        :type health_check: callable(object) -> bool
+
+        :param dispose: Called with every object discarded by the pool, e.g. to close it.
+        :type dispose: callable(object)
+        """
+        if max_size < 1 or not 0 <= min_size <= max_size:
+            raise ValueError("Invalid pool size: min_size={0}, max_size={1}".format(min_size, max_size))
+
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.dispose = dispose
+        self.closed = False
+
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._condition = threading.Condition()
+        self._stats = dict.fromkeys((
+            "acquisitions", "hits", "creations", "evictions", "failed_health_checks", "waits"
+        ), 0)
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+        for _ in range(min_size):
+            self._idle.append((self._create(), _clock()))
+            self._size += 1
+            self._stats["creations"] += 1
+
+    @contextlib.contextmanager
+    def acquire(self, timeout=None):
+        """Context manager that takes an object from the pool and returns it when the block ends.
+
+        :param timeout: Maximum number of seconds to wait for an object, raise PluginError after that.
+        :type timeout: float
+        """
+        obj = self._checkout(timeout)
+        try:
+            yield obj
+        finally:
+            self._checkin(obj)
+
+    @property
+    def stats(self):
+        """Return the pool statistics: size, idle, in_use, acquisitions, hits (idle objects reused), creations,
+        evictions (idle objects discarded), failed_health_checks, waits (acquisitions that had to wait),
+        wait_time (total seconds spent acquiring), max_wait_time and avg_wait_time.
+
+        :returns: dict
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._in_use,
+                wait_time=self._wait_time,
+                max_wait_time=self._max_wait_time,
+                avg_wait_time=self._wait_time / stats["acquisitions"] if stats["acquisitions"] else 0.0,
+            )
+        return stats
+
+    def close(self):
+        """Discard all idle objects, objects in use are discarded when they are returned."""
+        with self._condition:
+            self.closed = True
+            discarded = [obj for obj, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(discarded)
+            self._condition.notify_all()
+        self._dispose(discarded)
+
+    def _checkout(self, timeout):
+        start = _clock()
+        deadline = start + timeout if timeout is not None else None
+        waited = False
+        while True:
+            obj, create, expired = None, False, []
+            with self._condition:
+                while True:
+                    if self.closed:
+                        raise PluginError("The service pool is closed")
+
+                    expired.extend(self._expire())
+                    if self._idle:
+                        obj = self._idle.pop()[0]
+                        break
+                    elif self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                        break
+
+                    remaining = deadline - _clock() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        raise PluginError("Timeout waiting for an object of the service pool")
+                    waited = True
+                    self._condition.wait(remaining)
+            self._dispose(expired)
+
+            if create:
+                try:
+                    obj = self._create()
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+            elif self.health_check is not None and not self._healthy(obj):
+                with self._condition:
+                    self._size -= 1
+                    self._stats["failed_health_checks"] += 1
+                    self._condition.notify()
+                self._dispose([obj])
+                continue
+
+            wait_time = _clock() - start
+            with self._condition:
+                self._in_use += 1
+                self._stats["acquisitions"] += 1
+                self._stats["hits" if not create else "creations"] += 1
+                self._stats["waits"] += waited
+                self._wait_time += wait_time
+                self._max_wait_time = max(self._max_wait_time, wait_time)
+            return obj
+
+    def _checkin(self, obj):
+        with self._condition:
+            self._in_use -= 1
+            if self.closed:
+                self._size -= 1
+            else:
+                self._idle.append((obj, _clock()))
+                self._condition.notify()
+                return
+        self._dispose([obj])
+
+    def _expire(self):
+        """Remove from the pool the objects idle for too long, the oldest are at the left of the queue.
+        Must be called with the condition acquired.
+        """
+        expired = []
+        if self.idle_timeout is not None:
+            limit = _clock() - self.idle_timeout
+            while self._idle and self._size > self.min_size and self._idle[0][1] < limit:
+                expired.append(self._idle.popleft()[0])
+                self._size -= 1
+                self._stats["evictions"] += 1
+        return expired
+
+    def _create(self):
+        return self.factory()
+
+    def _healthy(self, obj):
+        try:
+            return bool(self.health_check(obj))
+        except Exception as e:
+            logger.debug("Service pool health check failed: {0}".format(e))
+            return False
+
+    def _dispose(self, objects):
+        if self.dispose is None:
+            return
+        for obj in objects:
+            try:
+                self.dispose(obj)
+            except Exception as e:
+                logger.warning("Error disposing pooled object: {0}, reason: {1}".format(obj, e))
+
+
+class _Registration(object):
+    """Identity of a factory registration. THREAD and CONTEXT instances are cached by registration in weak
+    dictionaries, so when a service is removed its cached instances are dropped everywhere and a new factory
+    registered with the same id never returns them. Singletons are created holding the lock of their registration.
+    """
+
+    __slots__ = ("lock", "__weakref__")
+
+    def __init__(self):
+        self.lock = threading.RLock()
+
+
+class _TimedCall(object):
+    """Callable recording when it started running, see: PluginManager._run_parallel"""
+
+    __slots__ = ("fn", "args", "start")
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+        self.start = None
+
+    def __call__(self):
+        self.start = _clock()
+        return self.fn(*self.args)
+
+
+def _run_hook(plugin, hook):
+    """Call a hook of a plugin (configure or enable) from the synchronous api. An async hook returns a
+    coroutine that nobody would await, it is an error: such plugins must be run with the asyncio api
+    (see: plugin_manager_async.run_hooks).
+    """
+    result = getattr(plugin, hook)()
+    if _isawaitable(result):
+        if hasattr(result, "close"):
+            # never started, so no "never awaited" warning
+            result.close()
+        raise PluginError("The '{0}' of plugin: {1} is async, use: {0}_plugins_async".format(hook, plugin.id))
+    return result
+
+
+class ServiceRegistry(object):
+    """Registry of services. Services are registered either as instances or as factories with a lifetime:
+
+    SINGLETON: the factory is called once, the first time the service is requested, even if many
+        threads request it at the same time.
+    THREAD: the factory is called once per thread.
+    CONTEXT: the factory is called once per service scope (see: scope), scopes follow contextvars,
+        so they work with threads and asyncio tasks, e.g. one scope per request.
+    TRANSIENT: the factory is called every time the service is requested.
+
+    Registered instances and already created singletons are read without any locking.
+    """
+
+    lifetimes = (SINGLETON, THREAD, CONTEXT, TRANSIENT)
+
+    def __init__(self, profiler=None):
+        """
+        :param profiler: Optional profiler used to measure the service factories.
+        :type profiler: PluginProfiler
+        """
+        self.profiler = profiler
+        self.instances = {}
+        self.factories = {}
+        self.owners = {}
+        self._registrations = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._context = contextvars.ContextVar("services", default=None) if contextvars else None
+
+    def register_instance(self, id, service, owner=None):
+        if id in self:
+            raise PluginError("Existing service: {0}".format(id))
+        self.instances[id] = service
+        self.owners[id] = owner
+
+    def register_factory(self, id, factory, lifetime=SINGLETON, owner=None):
+        if id in self:
+            raise PluginError("Existing service: {0}".format(id))
+        if not callable(factory):
+            raise TypeError("Service factory must be callable: {0}".format(id))
+        if lifetime not in self.lifetimes:
+            raise ValueError("Unknown service lifetime: {0}".format(lifetime))
+        if lifetime == CONTEXT and self._context is None:
+            raise PluginError("Context services require the contextvars module")
+        self.factories[id] = (factory, lifetime)
+        self._registrations[id] = _Registration()
+        self.owners[id] = owner
+
+    def owned_by(self, owner):
+        """Return the ids of the services registered by a plugin.
+
+        :param owner: Plugin id.
+        :type owner: str
+
+        :returns: list(str)
+        """
+        return [id for id, service_owner in list(self.owners.items()) if service_owner == owner]
+
+    def remove(self, id):
+        if id not in self:
+            raise PluginError("Service not found: {0}".format(id))
+        with self._lock:
+            service = self.instances.pop(id, None)
+            self.factories.pop(id, None)
+            self._registrations.pop(id, None)
+            self.owners.pop(id, None)
+        if isinstance(service, ServicePool):
+            service.close()
+
+    def get(self, id):
+        """Return the service or None if there is no such service.
+
+        :param id: Unique id of the service.
+        :type id: str
+        """
+        try:
+            return self.instances[id]
+        except KeyError:
+            pass
+
+        try:
+            factory, lifetime = self.factories[id]
+        except KeyError:
+            return None
+
+        if _iscoroutinefunction(factory):
+            raise PluginError("Service: {0} has an async factory, use: get_service_async".format(id))
+
+        if lifetime == TRANSIENT:
+            return self._create(id, factory)
+
+        registration = self._registrations.get(id)
+        if registration is None:
+            # removed meanwhile
+            return None
+        if lifetime == SINGLETON:
+            with registration.lock:
+                try:
+                    return self.instances[id]
+                except KeyError:
+                    return self._store(id, registration, self._create(id, factory))
+        elif lifetime == THREAD:
+            services = getattr(self._local, "services", None)
+            if services is None:
+                services = self._local.services = weakref.WeakKeyDictionary()
+        else:
+            services = self._context.get()
+            if services is None:
+                raise PluginError("Service: {0} must be requested inside a service scope".format(id))
+
+        try:
+            return services[registration]
+        except KeyError:
+            instance = services[registration] = self._create(id, factory)
+            return instance
+
+    @contextlib.contextmanager
+    def scope(self):
+        """Context manager that opens a new scope for CONTEXT services. Services created inside the
+        scope are discarded when it ends.
+        """
+        if self._context is None:
+            raise PluginError("Service scopes require the contextvars module")
+
+        token = self._context.set(weakref.WeakKeyDictionary())
+        try:
+            yield
+        finally:
+            self._context.reset(token)
+
+    def _create(self, id, factory):
+        if self.profiler is None:
+            return factory()
+        with self.profiler.measure(self.owners.get(id), "service", id):
+            return factory()
+
+    def _store(self, id, registration, instance):
+        """Keep a singleton created by the factory of 'registration'. If the service was removed, or registered
+        again, while the factory was running, the instance is discarded and None is returned.
+        """
+        with self._lock:
+            if self._registrations.get(id) is registration:
+                self.instances[id] = instance
+                return instance
+        if isinstance(instance, ServicePool):
+            instance.close()
+        return None
+
+    def __contains__(self, id):
+        return id in self.instances or id in self.factories
+
+    def __iter__(self):
+        return iter(set(self.instances).union(self.factories))
+
+    def __len__(self):
+        return len(set(self.instances).union(self.factories))
+
+
+class _NullMeasure(object):
+    """Measure returned when the profiler is disabled. A single instance is shared by all threads, so it has
+    no state and can't be changed.
+    """
+
+    __slots__ = ()
+
+    plugin_id = None
+
+    def discard(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_MEASURE = _NullMeasure()
+
+
+class _Measure(object):
+    """Context manager that records the time spent inside the block, see: PluginProfiler.measure"""
+
+    __slots__ = (
+        "profiler", "plugin_id", "phase", "detail", "start", "cpu", "children_wall", "children_cpu", "discarded"
+    )
+
+    def __init__(self, profiler, plugin_id, phase, detail):
+        self.profiler = profiler
+        self.plugin_id = plugin_id
+        self.phase = phase
+        self.detail = detail
+        self.children_wall = self.children_cpu = 0.0
+        self.discarded = False
+
+    def discard(self):
+        """Don't record this measure, e.g. the code measured didn't belong to any plugin."""
+        self.discarded = True
+
+    def __enter__(self):
+        self.profiler._stack().append(self)
+        self.cpu = _cpu_clock()
+        self.start = _perf_clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = _perf_clock() - self.start
+        cpu = _cpu_clock() - self.cpu
+        stack = self.profiler._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children_wall += wall
+            stack[-1].children_cpu += cpu
+        if not self.discarded:
+            self.profiler.record(
+                self.plugin_id, self.phase, self.start, wall - self.children_wall, cpu - self.children_cpu,
+                wall, self.detail
+            )
+        return False
+
+
+class PluginProfiler(object):
+    """Record the wall and cpu time spent by every plugin in each startup phase:
+
+    import: importing the plugin module.
+    instantiate: creating the plugin instance.
+    register: registering the extension points and extenders of the plugin.
+    extenders: evaluating the extenders of the plugin.
+    configure, enable: running the plugin hooks.
+    service: running the service factories registered by the plugin.
+
+    Measures can be nested (e.g. a plugin imported while one of its extenders is evaluated), the time of
+    the inner measure is not counted in the outer one, so the time of all records can be added up. While
+    disabled, measuring is a single attribute check.
+
+        plugin_manager = PluginManager(search_path, profile=True)
+        ...
+        plugin_manager.profiler.dump("startup.json", plugin_manager)
+    """
+
+    phases = ("import", "instantiate", "register", "extenders", "configure", "enable", "service")
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.records = []
+        self.origin = _perf_clock()
+        self._local = threading.local()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self.records = []
+        self.origin = _perf_clock()
+
+    def measure(self, plugin_id, phase, detail=None):
+        """Return a context manager that records the time spent inside the block.
+
+        :param plugin_id: Id of the plugin running code.
+        :type plugin_id: str
+
+        :param phase: One of: PluginProfiler.phases
+        :type phase: str
+
+        :param detail: Optional description, e.g. the module imported or the service created.
+        :type detail: str
+        """
+        if not self.enabled:
+            return _NULL_MEASURE
+        return _Measure(self, plugin_id, phase, detail)
+
+    def record(self, plugin_id, phase, start, wall, cpu, inclusive_wall=None, detail=None):
+        self.records.append({
+            "plugin": plugin_id,
+            "phase": phase,
+            "start": start - self.origin,
+            "wall": wall,
+            "cpu": cpu,
+            "inclusive_wall": wall if inclusive_wall is None else inclusive_wall,
+            "thread": threading.current_thread().name,
+            "detail": detail,
+        })
+
+    def summary(self):
+        """Return the time spent by every plugin in each phase.
+
+        :returns: dict(plugin id -> dict(phase -> {"wall": seconds, "cpu": seconds, "count": measures}))
+        """
+        summary = {}
+        for record in list(self.records):
+            phases = summary.setdefault(record["plugin"], {})
+            phase = phases.setdefault(record["phase"], {"wall": 0.0, "cpu": 0.0, "count": 0})
+            phase["wall"] += record["wall"]
+            phase["cpu"] += record["cpu"]
+            phase["count"] += 1
+        return summary
+
+    def critical_path(self, plugin_manager):
+        """Return the most expensive chain of dependent plugins: the startup time that can't be reduced
+        running independent plugins in parallel. The cost of a plugin is the wall time of all its phases.
+
+        :param plugin_manager: The plugin manager with the dependency graph.
+        :type plugin_manager: PluginManager
+
+        :returns: (list((plugin id, seconds)) from the first dependency to the last dependent, total seconds)
+        """
+        cost = dict(
+            (id, sum(phase["wall"] for phase in phases.values())) for id, phases in self.summary().items()
+        )
+        finish, previous = {}, {}
+        for plugin in plugin_manager.plugins:
+            slowest = None
+            for dependency in plugin.depends:
+                if dependency in finish and (slowest is None or finish[dependency] > finish[slowest]):
+                    slowest = dependency
+            finish[plugin.id] = cost.get(plugin.id, 0.0) + (finish[slowest] if slowest is not None else 0.0)
+            previous[plugin.id] = slowest
+
+        if not finish:
+            return [], 0.0
+
+        last = max(finish, key=finish.get)
+        path, id = [], last
+        while id is not None:
+            path.append((id, cost.get(id, 0.0)))
+            id = previous[id]
+        return path[::-1], finish[last]
+
+    def to_dict(self, plugin_manager=None):
+        """Return a json serializable report: all records, the summary and, if the plugin manager is given,
+        the critical path.
+        """
+        report = {"records": list(self.records), "summary": self.summary()}
+        if plugin_manager is not None:
+            path, total = self.critical_path(plugin_manager)
+            report["critical_path"] = {"plugins": [{"plugin": id, "wall": wall} for id, wall in path], "wall": total}
+        return report
+
+    def dump(self, path, plugin_manager=None):
+        """Write the report returned by: to_dict to a json file."""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(plugin_manager), f, indent=2, default=str)
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+def _path_module_names():
+    """Return the names of the top level modules found in sys.path, the builtin modules and the standard
+    library, listing every sys.path entry once. Packages and extension modules are included, so the names
+    may be more than the importable ones, never less.
+    """
+    names = set(sys.builtin_module_names)
+    names.update(getattr(sys, "stdlib_module_names", ()))
+    suffixes = tuple(importlib.machinery.all_suffixes())
+    for entry in sys.path:
+        entry = entry or os.getcwd()
+        try:
+            if zipfile.is_zipfile(entry):
+                with zipfile.ZipFile(entry) as archive:
+                    filenames = set(filename.split("/")[0] for filename in archive.namelist())
+            else:
+                filenames = [dir_entry.name for dir_entry in scandir(entry)]
+        except (IOError, OSError):
+            continue
+        for filename in filenames:
+            if filename.endswith(suffixes):
+                names.add(filename.split(".")[0])
+            elif "." not in filename:
+                names.add(filename)
+    return names
+
+
+def _insert_finder(finder):
+    """Insert an import finder in sys.meta_path right before the path finder."""
+    try:
+        index = sys.meta_path.index(importlib.machinery.PathFinder)
+    except ValueError:
+        index = len(sys.meta_path)
+    sys.meta_path.insert(index, finder)
+
+
+class PluginFinder(object):
+    """Import finder (sys.meta_path) for the top level modules and packages in the search path of a plugin
+    manager: directories, zip files and python files. It keeps an index from module name to location, so
+    plugin imports are resolved with a dict lookup and the search path doesn't need to be added to sys.path,
+    which would make every other import in the process look into it. Submodules of plugin packages are
+    found through the package __path__ by the default import machinery.
+
+    The finder goes before the path finder in sys.meta_path, so plugin imports don't look into every sys.path
+    entry first. It only claims the modules it owns: names also found in sys.path (or builtin) are left to the
+    path finder, modules in the search path never hide the standard library or installed packages. Finding
+    those names costs one listing of every sys.path entry each time entries are added (see: add_entries).
+    """
+
+    def __init__(self):
+        self.index = {}
+        # names provided by sys.path, left to the path finder, see: _path_module_names
+        self.shadowed = frozenset()
+        self._zip_importers = {}
+
+    @staticmethod
+    def module_name(path, is_dir):
+        """Return the name of the top level module in a search path entry or None if it is not a module."""
+        name, ext = os.path.splitext(os.path.basename(path))
+        if is_dir:
+            return name if not ext and name != "__pycache__" else None
+        if ext in (".py", ".pyc", ".zip") and name != "__init__" and "." not in name:
+            return name
+        return None
+
+    def add_entries(self, entries):
+        """Index the modules in some search path entries. The first entry found for a name wins.
+
+        :param entries: List of (absolute path, is directory).
+        :type entries: list(tuple(str, bool))
+        """
+        for path, is_dir in entries:
+            name = self.module_name(path, is_dir)
+            if name is not None:
+                self.index.setdefault(name, (path, is_dir))
+        self.shadowed = frozenset(_path_module_names())
+
+    def remove(self, name):
+        path, _ = self.index.pop(name, (None, None))
+        self._zip_importers.pop(path, None)
+
+    def find_spec(self, fullname, path=None, target=None):
+        # submodules are looked up in the package __path__, not here
+        if path is not None or fullname not in self.index or fullname in self.shadowed:
+            return None
+
+        location, is_dir = self.index[fullname]
+        if is_dir:
+            for init in ("__init__.py", "__init__.pyc"):
+                filename = os.path.join(location, init)
+                if os.path.isfile(filename):
+                    return importlib.util.spec_from_file_location(
+                        fullname, filename, submodule_search_locations=[location]
+                    )
+            return None
+        elif location.endswith(".zip"):
+            importer = self._zip_importers.get(location)
+            if importer is None:
+                importer = self._zip_importers[location] = zipimport.zipimporter(location)
+            if hasattr(importer, "find_spec"):
+                return importer.find_spec(fullname)
+            loader = importer.find_module(fullname)
+            if loader is None:
+                return None
+            return importlib.util.spec_from_loader(
+                fullname, loader, origin=location, is_package=loader.is_package(fullname)
+            )
+        return importlib.util.spec_from_file_location(fullname, location)
+
+    def invalidate_caches(self):
+        self._zip_importers.clear()
+
+
+class PluginBundle(object):
+    """Single file with the description and the compiled modules of all plugins in a search path, see:
+    PluginBundle.build. The file is memory mapped and modules are imported straight from the mapped
+    buffer, so starting with hundreds of plugins doesn't need thousands of open/stat calls nor reading
+    the directory of every zip file. The bundle is an import finder (sys.meta_path) for its modules.
+
+    File format: magic, header size, json header, data. The header has the python bytecode magic
+    number, the plugin entries found in the search path with their plugin descriptions (see:
+    LazyPlugin.to_dict) and the offset and size in the data of the marshalled code of every module.
+    Every entry keeps the path it was built from and the stamp (see: PluginManifest.stamp) of every
+    source file, so entries whose sources changed or disappeared can be discarded, see: discard_stale
+    """
+
+    magic = b"PLGB"
+    version = 2
+    _prefix = struct.Struct("<4sII")
+
+    def __init__(self, path):
+        """
+        :param path: Path of the bundle file.
+        :type path: str
+        """
+        self.path = os.path.abspath(os.path.expanduser(path))
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, size = self._prefix.unpack_from(self._map)
+            if magic != self.magic or version != self.version:
+                raise PluginError("Unknown plugin bundle format: {0}".format(self.path))
+            header = json.loads(self._map[self._prefix.size:self._prefix.size + size].decode("utf-8"))
+            if header["python"] != _bytecode_magic():
+                raise PluginError("Plugin bundle built for another python version: {0}".format(self.path))
+        except (struct.error, ValueError, KeyError) as e:
+            self._map.close()
+            raise PluginError("Invalid plugin bundle: {0}, reason: {1}".format(self.path, e))
+        except PluginError:
+            self._map.close()
+            raise
+
+        self.entries = header["entries"]
+        self.modules = header["modules"]
+        self.names = frozenset(entry["name"] for entry in self.entries)
+        # top level names left to the path finder, see: PluginFinder
+        self.shadowed = frozenset()
+        self._data = self._prefix.size + size
+
+    @classmethod
+    def build(cls, search_path, output):
+        """Create a plugin bundle with all plugins and modules in a search path. Plugins are described as
+        in the discovery process of the plugin manager (statically when possible) and every python module is
+        compiled. When more than one entry in the search path has the same name, the first one is used.
+
+        :param search_path: Search path to look for plugins
+        :type search_path: str or list(str)
+
+        :param output: Path of the bundle file.
+        :type output: str
+
+        :returns: The number of plugins and the number of modules in the bundle.
+        """
+        output = os.path.abspath(os.path.expanduser(output))
+        plugin_manager = PluginManager(search_path, static=True)
+        scanned = [entry for path in plugin_manager.search_path for entry in _scan_plugin_path(path)]
+
+        # plugins that must be imported to be described, import the modules of the search path
+        plugin_manager.finder.add_entries(scanned)
+        _insert_finder(plugin_manager.finder)
+        entries, modules, chunks = [], {}, []
+        offset = 0
+        try:
+            for plugin_path, is_dir in scanned:
+                name = PluginFinder.module_name(plugin_path, is_dir)
+                if name is None or name in plugin_manager.finder.index and \
+                        plugin_manager.finder.index[name][0] != plugin_path:
+                    continue
+
+                relpath = os.path.basename(plugin_path)
+                names, stamps = [], {}
+                for module, filename, is_package, source in cls._sources(plugin_path, is_dir):
+                    # zip files are stamped as a whole
+                    stamp_name = filename if is_dir else ""
+                    stamps[stamp_name] = PluginManifest.stamp(cls._source_path(plugin_path, stamp_name), False)
+                    filename = os.path.join(relpath, filename) if filename else relpath
+                    try:
+                        code = marshal.dumps(compile(source, os.path.join(output, filename), "exec", dont_inherit=True))
+                    except SyntaxError as e:
+                        logger.warning("Skipping module: {0} in plugin bundle, reason: {1}".format(module, e))
+                        continue
+                    modules[module] = [offset, len(code), is_package, filename]
+                    names.append(module)
+                    chunks.append(code)
+                    offset += len(code)
+
+                plugins = plugin_manager._discover(plugin_path, is_dir)
+                entries.append({
+                    "name": name, "path": relpath, "is_dir": is_dir, "source": plugin_path,
+                    "modules": names, "stamps": stamps, "plugins": [plugin.to_dict() for plugin in plugins],
+                })
+        finally:
+            sys.meta_path.remove(plugin_manager.finder)
+
+        header = json.dumps({"python": _bytecode_magic(), "entries": entries, "modules": modules}).encode("utf-8")
+        directory = os.path.dirname(output)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = "{0}.{1}.tmp".format(output, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(cls._prefix.pack(cls.magic, cls.version, len(header)))
+            f.write(header)
+            for chunk in chunks:
+                f.write(chunk)
+        getattr(os, "replace", os.rename)(tmp, output)
+
+        return sum(len(entry["plugins"]) for entry in entries), len(modules)
+
+    @staticmethod
+    def _sources(plugin_path, is_dir):
+        """Yield (module name, file name relative to the plugin path, is package, source) for every python
+        module in a plugin path.
+        """
+        if is_dir:
+            package = os.path.basename(plugin_path)
+            for root, dirs, files in os.walk(plugin_path):
+                dirs[:] = sorted(d for d in dirs if d != "__pycache__" and "." not in d)
+                relroot = os.path.relpath(root, plugin_path)
+                parts = [package] if relroot == os.curdir else [package] + relroot.split(os.sep)
+                for filename in sorted(files):
+                    name, ext = os.path.splitext(filename)
+                    if ext != ".py" or "." in name:
+                        continue
+                    with open(os.path.join(root, filename), "rb") as f:
+                        source = f.read()
+                    relname = filename if relroot == os.curdir else os.path.join(relroot, filename)
+                    if name == "__init__":
+                        yield ".".join(parts), relname, True, source
+                    else:
+                        yield ".".join(parts + [name]), relname, False, source
+        elif plugin_path.endswith(".zip"):
+            with zipfile.ZipFile(plugin_path) as archive:
+                for filename in sorted(archive.namelist()):
+                    parts = filename.split("/")
+                    name, ext = os.path.splitext(parts[-1])
+                    if ext != ".py" or "." in name or any("." in part for part in parts[:-1]):
+                        continue
+                    source = archive.read(filename)
+                    relname = os.path.join(*parts)
+                    if name == "__init__":
+                        yield ".".join(parts[:-1]), relname, True, source
+                    else:
+                        yield ".".join(parts[:-1] + [name]), relname, False, source
+        elif plugin_path.endswith(".py"):
+            with open(plugin_path, "rb") as f:
+                yield os.path.splitext(os.path.basename(plugin_path))[0], "", False, f.read()
+
+    def discard_stale(self):
+        """Forget the entries whose source files changed or disappeared since the bundle was built, and their
+        modules, so they are loaded from the search path instead. Costs one stat call per bundled module.
+
+        :returns: Names of the entries discarded.
+        """
+        stale = []
+        for entry in self.entries:
+            for filename, stamp in entry["stamps"].items():
+                if PluginManifest.stamp(self._source_path(entry["source"], filename), False) != stamp:
+                    stale.append(entry)
+                    break
+
+        self.discard(stale)
+        return [entry["name"] for entry in stale]
+
+    def discard(self, entries):
+        """Forget some entries and their modules, so they are loaded from the search path instead.
+
+        :param entries: Entries of the bundle, items of: PluginBundle.entries
+        :type entries: list(dict)
+        """
+        for entry in entries:
+            self.entries.remove(entry)
+            for module in entry["modules"]:
+                self.modules.pop(module, None)
+        self.names = frozenset(entry["name"] for entry in self.entries)
+
+    @staticmethod
+    def _source_path(plugin_path, filename):
+        return os.path.join(plugin_path, filename) if filename else plugin_path
+
+    def plugin_path(self, entry):
+        """Return the path used for the plugins of a bundle entry: the bundle path followed by the entry name."""
+        return os.path.join(self.path, entry["path"])
+
+    def find_spec(self, fullname, path=None, target=None):
+        module = self.modules.get(fullname)
+        if module is None or fullname.split(".")[0] in self.shadowed:
+            return None
+
+        _, _, is_package, filename = module
+        origin = os.path.join(self.path, filename)
+        spec = importlib.machinery.ModuleSpec(fullname, self, origin=origin, is_package=is_package)
+        if is_package:
+            spec.submodule_search_locations = [os.path.dirname(origin)]
+        spec.has_location = True
+        return spec
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        exec(self.get_code(module.__name__), module.__dict__)
+
+    def get_code(self, fullname):
+        """Return the code object of a module, unmarshalled from the mapped file without copying it."""
+        offset, size, _, _ = self.modules[fullname]
+        start = self._data + offset
+        view = memoryview(self._map)
+        try:
+            return marshal.loads(view[start:start + size])
+        finally:
+            view.release()
+
+    def get_source(self, fullname):
+        return None
+
+    def is_package(self, fullname):
+        return self.modules[fullname][2]
+
+    def invalidate_caches(self):
+        pass
+
+    def close(self):
+        self._map.close()
+
+
+def _bytecode_magic():
+    return importlib.util.MAGIC_NUMBER.hex()
+
+
+class PluginWatcher(object):
+    """Watch the search path of a plugin manager and reload the plugins that change, see:
+    PluginManager.reload_plugins. Changes are detected comparing snapshots of the modification
+    time, size and inode of the plugin files. If the 'inotify_simple' module is available, the
+    watcher sleeps until the filesystem reports a change instead of taking a snapshot every interval.
+
+        watcher = PluginWatcher(plugin_manager)
+        watcher.start()
+    """
+
+    def __init__(self, plugin_manager, interval=1.0, notify=None):
+        """
+        :param plugin_manager: The plugin manager to watch.
+        :type plugin_manager: PluginManager
+
+        :param interval: Seconds between checks.
+        :type interval: float
+
+        :param notify: See: PluginManager.enable_plugins
+        :type: callable(enabled, plugin)
+        """
+        self.plugin_manager = plugin_manager
+        self.interval = interval
+        self.notify = notify
+        self.snapshot = self.take_snapshot()
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify = None
+        # inotify watch descriptor -> watched directory
+        self._watches = None
+        if inotify_simple is not None:
+            try:
+                self._inotify = inotify_simple.INotify()
+            except OSError as e:
+                logger.debug("inotify not available, using polling: {0}".format(e))
+
+    def take_snapshot(self):
+        """Return the signature of every plugin path in the search path.
+
+        :returns: dict(plugin path -> signature)
+        """
+        snapshot = {}
+        for path in self.plugin_manager.search_path:
+            for plugin_path, is_dir in _scan_plugin_path(path):
+                snapshot[plugin_path] = self._signature(plugin_path, is_dir)
+        return snapshot
+
+    def poll(self):
+        """Check for changes and reload the plugins that changed.
+
+        :returns: Ids of the plugins reloaded.
+        """
+        snapshot = self.take_snapshot()
+        changed = [
+            plugin_path for plugin_path in set(snapshot).union(self.snapshot)
+            if snapshot.get(plugin_path) != self.snapshot.get(plugin_path)
+        ]
+        self.snapshot = snapshot
+        if not changed:
+            return []
+
+        logger.debug("Plugin paths changed: {0}".format(", ".join(sorted(changed))))
+        return self.plugin_manager.reload_plugins(changed, self.notify)
+
+    def start(self):
+        """Start watching in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="PluginWatcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self._wait():
+                continue
+            try:
+                self.poll()
+            except Exception:
+                logger.error("Error reloading plugins", exc_info=True)
+
+    def _wait(self):
+        """Wait for the next check, return False if there is nothing to check."""
+        if self._inotify is None:
+            self._stop.wait(self.interval)
+            return True
+
+        flags = inotify_simple.flags
+        if self._watches is None:
+            self._watches = {}
+            for path in self.plugin_manager.search_path:
+                self._watch(path)
+
+        events = self._inotify.read(timeout=int(self.interval * 1000))
+        for event in events:
+            if event.mask & flags.IGNORED:
+                # the directory was removed
+                self._watches.pop(event.wd, None)
+            elif event.mask & flags.ISDIR and event.mask & (flags.CREATE | flags.MOVED_TO):
+                parent = self._watches.get(event.wd)
+                if parent is not None:
+                    self._watch(os.path.join(parent, event.name))
+        return bool(events)
+
+    def _watch(self, path):
+        # inotify watches are not recursive, every directory must be watched
+        flags = inotify_simple.flags
+        mask = flags.CREATE | flags.DELETE | flags.MODIFY | flags.MOVED_FROM | flags.MOVED_TO | flags.CLOSE_WRITE
+        try:
+            self._watches[self._inotify.add_watch(path, mask)] = path
+            for entry in scandir(path):
+                if entry.is_dir(follow_symlinks=False) and entry.name != "__pycache__":
+                    self._watch(entry.path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _signature(plugin_path, is_dir):
+        """Return the modification time, size and inode of the plugin files."""
+        def stat(path):
+            st = os.stat(path)
+            return path, getattr(st, "st_mtime_ns", st.st_mtime), st.st_size, st.st_ino
+
+        try:
+            if not is_dir:
+                return stat(plugin_path)
+
+            signature, pending = [], [plugin_path]
+            while pending:
+                for entry in scandir(pending.pop()):
+                    if entry.is_dir():
+                        if entry.name != "__pycache__":
+                            pending.append(entry.path)
+                    elif entry.name.endswith((".py", ".pyc", ".so", ".pyd")):
+                        signature.append(stat(entry.path))
+            return tuple(sorted(signature))
+        except OSError:
+            return None
+
+
 class PluginManager(object):
     """The plugin manager is in charged to find, register and enable all plugins
     based on its dependencies. It searches for plugins in a list of file system paths.
@@ -175,20 +2150,56 @@ class PluginManager(object):
     with a unique id so that later we can lookup for it using its id.
     """
 
-    def __init__(self, search_path):
+    def __init__(self, search_path, manifest=None, static=False, workers=8, bundle=None, profile=False):
         """
         :param search_path: Search path to look for plugins
         :type search_path: str or list(str)
+
+        :param manifest: Optional path of the file used to cache the description of all plugins found.
+            With a manifest, only new or changed plugins are imported during the discovery process.
+        :type manifest: str
+
+        :param static: If True, plugin definitions are parsed instead of imported during the discovery
+            process (see: parse_plugin_definitions). Plugins are imported later, only if they are used.
+        :type static: bool
+
+        :param workers: Number of threads used to scan the search path and read plugin descriptions.
+        :type workers: int
+
+        :param bundle: Optional path of a plugin bundle (see: PluginBundle). The plugins and modules in the
+            bundle are used instead of the ones with the same name in the search path, unless their source
+            files changed since the bundle was built.
+        :type bundle: str
+
+        :param profile: Measure the time spent by every plugin during the startup, see: PluginProfiler.
+            The profiler can be enabled later too: plugin_manager.profiler.enable()
+        :type profile: bool
         """
 
         self.extension_points = {}
-        self.services = {}
+        self.profiler = PluginProfiler(profile)
+        self.services = ServiceRegistry(self.profiler)
         self.disabled = []
+        self.manifest = PluginManifest(manifest) if manifest else None
+        self.static = static
+        self.workers = workers
         self._plugins = {}
+        self._graph = DependencyGraph()
+        self._sorted_plugins = None
+        self._load_lock = threading.RLock()
+        self._service_futures = {}
+        self._plugin_paths = set()
+        self._user_disabled = set()
+        self._sys_path_entries = set()
+        self.finder = PluginFinder() if hasattr(importlib, "util") else None
+        self.bundle = None
+        self._bundle_path = os.path.abspath(os.path.expanduser(bundle)) if bundle else None
+        self._detached_extenders = {}
+        self._owner = contextvars.ContextVar("plugin_owner", default=None) if contextvars else _ThreadLocalVar()
 
         if isinstance(search_path, str):
             search_path = [search_path]
-        self.search_path = (os.path.abspath(path) for path in search_path if os.path.exists(path))
+        self.search_path = [os.path.abspath(path) for path in search_path if os.path.exists(path)]
 
     @property
     def plugins(self):
@@ -197,17 +2208,9 @@ class PluginManager(object):
 
         :returns: list(Plugin)
         """
-        def sort():
-            sorted_plugins = []
-            for id in self._plugins:
-                for dep in self.dependencies(id):
-                    if self._plugins[dep] not in sorted_plugins:
-                        sorted_plugins.append(self._plugins[dep])
-            return sorted_plugins
-
-        if not hasattr(sort, "_sorted_plugins"):
-            sort._sorted_plugins = sort()
-        return sort._sorted_plugins
+        if self._sorted_plugins is None:
+            self._sorted_plugins = [self._plugins[id] for id in self._graph.order]
+        return self._sorted_plugins
 
     def find_plugins(self, disabled_plugins=None):
         """Look for plugins in 'search_path' and register them with the plugin manager if they are enabled.
@@ -219,58 +2222,138 @@ class PluginManager(object):
         """
         logger.debug("Starting plugin discovery process...")
 
-        disabled_plugins = set(disabled_plugins) if disabled_plugins else set()
-        for path in self.search_path:
-            sys.path.append(path)
-            for filename in os.listdir(path):
-                # register individual plugins and its extension points
-                plugin_path = os.path.join(path, filename)
-                for plugin in self._loader(plugin_path):
-                    disabled_dependencies = disabled_plugins.intersection(set(plugin.depends))
-                    if not plugin.enabled:
-                        logger.debug("Plugin disabled by default: {0}".format(plugin.id))
-                        disabled_plugins.add(plugin.id)
-                        self.disabled.append(plugin)
-                        continue
-                    elif plugin.id in disabled_plugins:
-                        logger.debug("Plugin disabled by user: {0}".format(plugin.id))
-                        self.disabled.append(plugin)
-                        continue
-                    elif disabled_dependencies:
-                        msg = "Plugin disabled because of disabled dependencies: {0} --> [{1}]"
-                        logger.debug(msg.format(plugin.id, ", ".join([pid for pid in disabled_dependencies])))
-                        disabled_plugins.add(plugin.id)
-                        self.disabled.append(plugin)
-                        continue
-
-                    logger.debug("Found plugin: {0}".format(plugin.id))
-                    self._plugins.setdefault(plugin.id, plugin)
-
-                    # register plugin's extension points
+        self._user_disabled.update(disabled_plugins or ())
+        disabled_plugins = self._user_disabled.union(plugin.id for plugin in self.disabled)
+        bundle = self._open_bundle()
+        # Scanning directories and reading plugin descriptions is mostly waiting for the filesystem, do it
+        # in a thread pool. Results are merged in search path and name order, so discovery is deterministic.
+        executor = ThreadPoolExecutor(max_workers=max(1, self.workers))
+        try:
+            scanned = [entry for entries in executor.map(_scan_plugin_path, self.search_path) for entry in entries]
+            entries = [entry for entry in scanned if entry[0] not in self._plugin_paths]
+            if bundle is not None:
+                # entries in the bundle replace the ones in the search path with the same name
+                entries = [
+                    entry for entry in entries if PluginFinder.module_name(entry[0], entry[1]) not in bundle.names
+                ]
+            descriptions = list(executor.map(self._describe, entries))
+        finally:
+            executor.shutdown()
+
+        if bundle is not None:
+            bundled = [
+                ((bundle.plugin_path(entry), entry["is_dir"]), (None, entry["plugins"], True))
+                for entry in bundle.entries if bundle.plugin_path(entry) not in self._plugin_paths
+            ]
+            entries = [entry for entry, _ in bundled] + entries
+            descriptions = [description for _, description in bundled] + descriptions
+
+        # make the modules in the search path importable, so plugins can import each other
+        if self.finder is not None:
+            self.finder.add_entries(scanned)
+            # before the path finder, claiming only the modules that are not in sys.path, see: PluginFinder
+            if self.finder not in sys.meta_path:
+                _insert_finder(self.finder)
+            if bundle is not None:
+                bundle.shadowed = self.finder.shadowed
+                if bundle not in sys.meta_path:
+                    # entries in the bundle replace the ones in the search path
+                    sys.meta_path.insert(sys.meta_path.index(self.finder), bundle)
+        else:
+            for path in self.search_path:
+                if path not in sys.path:
+                    sys.path.append(path)
+                    self._sys_path_entries.add(path)
+
+        for (plugin_path, is_dir), description in zip(entries, descriptions):
+            # imports are not thread safe, so plugins without a description are loaded here, in order
+            self._plugin_paths.add(plugin_path)
+            for plugin in self._discover(plugin_path, is_dir, description):
+                disabled_dependencies = disabled_plugins.intersection(set(plugin.depends))
+                if not plugin.enabled:
+                    logger.debug("Plugin disabled by default: {0}".format(plugin.id))
+                    disabled_plugins.add(plugin.id)
+                    self.disabled.append(plugin)
+                    continue
+                elif plugin.id in disabled_plugins:
+                    logger.debug("Plugin disabled by user: {0}".format(plugin.id))
+                    self.disabled.append(plugin)
+                    continue
+                elif disabled_dependencies:
+                    msg = "Plugin disabled because of disabled dependencies: {0} --> [{1}]"
+                    logger.debug(msg.format(plugin.id, ", ".join([pid for pid in disabled_dependencies])))
+                    disabled_plugins.add(plugin.id)
+                    self.disabled.append(plugin)
+                    continue
+
+                if plugin.id in self._plugins:
+                    logger.warning("Duplicated plugin: {0} in: {1}".format(plugin.id, plugin.path))
+                    continue
+
+                logger.debug("Found plugin: {0}".format(plugin.id))
+                self._add_plugin(plugin)
+
+                # register plugin's extension points
+                with self.profiler.measure(plugin.id, "register"):
                     for extension_point in plugin.extension_points:
                         self.register_extension_point(extension_point)
 
         # register all plugin's extenders
         logger.debug("Registering all extenders")
         for plugin in self.plugins:
-            for extender in plugin.extenders:
-                self.register_extender(extender)
+            with self.profiler.measure(plugin.id, "register"):
+                for extender in plugin.extenders:
+                    self.register_extender(extender)
+
+        if self.manifest is not None:
+            self.manifest.prune(self.search_path, set(plugin_path for plugin_path, _ in scanned))
+            self.manifest.save()
 
         logger.debug("Plugin discovery process finished.")
 
-    def configure_plugins(self):
-        """Run the configure for each plugin. The call order is based on plugin dependencies."""
+    def configure_plugins(self, parallel=False, max_workers=None, timeout=None):
+        """Run the configure for each plugin. The call order is based on plugin dependencies. A PluginError
+        is raised for a plugin whose configure is a coroutine function, see: configure_plugins_async
+
+        :param parallel: Configure plugins in a thread pool. A plugin is configured as soon as all
+            its dependencies are configured, so plugins not depending on each other run concurrently.
+        :type parallel: bool
+
+        :param max_workers: Maximum number of threads used when running in parallel.
+        :type max_workers: int
+
+        :param timeout: Maximum number of seconds the configure of each plugin can take when running in parallel.
+        :type timeout: float
+        """
+        if parallel:
+            return self._run_parallel("configure", max_workers=max_workers, timeout=timeout)
+
         for plugin in self.plugins:
             logger.debug("Configuring plugin: {}".format(plugin.id))
-            plugin.configure()
+            _run_hook(plugin, "configure")
 
-    def enable_plugins(self, notify=None):
-        """Enable all discovered plugins. The order is based on plugin dependencies.
+    def enable_plugins(self, notify=None, parallel=False, max_workers=None, timeout=None):
+        """Enable all discovered plugins. The order is based on plugin dependencies. A PluginError is raised
+        for a plugin whose enable is a coroutine function, see: enable_plugins_async
 
         :param notify: Callable used to notify when a plugin is about to be enabled and when the plugin is enabled.
         :type: callable(enabled, plugin) where "enabled" is False if the plugin is about to be enabled and True
             if the plugin is already enabled.
+
+        :param parallel: Enable plugins in a thread pool. A plugin is enabled as soon as all its dependencies
+            are enabled, so plugins not depending on each other run concurrently. Notifications are always
+            made from the calling thread.
+        :type parallel: bool
+
+        :param max_workers: Maximum number of threads used when running in parallel.
+        :type max_workers: int
+
+        :param timeout: Maximum number of seconds the enable of each plugin can take when running in parallel.
+        :type timeout: float
         """
+        if parallel:
+            return self._run_parallel("enable", notify, max_workers, timeout)
+
         for plugin in self.plugins:
             # notify that the plugin is about to be enabled
             if callable(notify):
@@ -278,17 +2361,109 @@ class PluginManager(object):
 
             # enable the plugin
             logger.debug('Enabling plugin: {0}'.format(plugin.id))
-            plugin.enable()
+            _run_hook(plugin, "enable")
 
             # notify that the plugin has been enabled
             if callable(notify):
                 notify(True, plugin)
 
+    def configure_plugins_async(self, notify=None):
+        """Asyncio version of configure_plugins, the configure of the plugins may be a coroutine function.
+        A plugin is configured as soon as all its dependencies are configured, so plugins not depending on
+        each other run concurrently. Must be awaited: await plugin_manager.configure_plugins_async()
+
+        :param notify: Same as in: enable_plugins
+        :type: callable(configured, plugin)
+
+        :returns: coroutine
+        """
+        from plugin_manager_async import run_hooks
+        return run_hooks(self, "configure", notify)
+
+    def enable_plugins_async(self, notify=None):
+        """Asyncio version of enable_plugins, the enable of the plugins may be a coroutine function.
+        A plugin is enabled as soon as all its dependencies are enabled, so plugins not depending on
+        each other run concurrently. Must be awaited: await plugin_manager.enable_plugins_async()
+
+        :param notify: See: enable_plugins
+        :type: callable(enabled, plugin)
+
+        :returns: coroutine
+        """
+        from plugin_manager_async import run_hooks
+        return run_hooks(self, "enable", notify)
+
+    def _run_parallel(self, hook, notify=None, max_workers=None, timeout=None):
+        """Call a hook of every plugin in a thread pool, starting each plugin only after all its dependencies
+        are done. The first error (or timeout) stops the scheduling of new plugins and is raised. Threads
+        can't be interrupted, so hooks still running when that happens are left to finish in background.
+
+        :param hook: Name of the plugin method to call: configure or enable.
+        :type hook: str
+        """
+        plugins = self.plugins
+        if not plugins:
+            return
+
+        pending = dict((plugin.id, len(self._graph.depends[plugin.id])) for plugin in plugins)
+        ready = deque(plugin for plugin in plugins if not pending[plugin.id])
+        running = {}
+
+        executor = ThreadPoolExecutor(max_workers=max_workers or min(32, len(plugins)))
+        try:
+            while ready or running:
+                while ready:
+                    plugin = ready.popleft()
+                    if callable(notify):
+                        notify(False, plugin)
+
+                    logger.debug("Running '{0}' of plugin: {1}".format(hook, plugin.id))
+                    call = _TimedCall(_run_hook, plugin, hook)
+                    running[executor.submit(call)] = (plugin, call)
+
+                wait_timeout = None
+                if timeout is not None:
+                    # hooks waiting for a thread don't have a deadline yet, check again at most after 'timeout'
+                    deadlines = [call.start + timeout if call.start is not None else _clock() + timeout
+                                 for _, call in running.values()]
+                    wait_timeout = max(0, min(deadlines) - _clock())
+                done, _ = wait(running, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    plugin, _ = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        logger.error("Error running '{0}' of plugin: {1}, reason: {2}".format(hook, plugin.id, error))
+                        raise error
+
+                    if callable(notify):
+                        notify(True, plugin)
+
+                    for dependent in self._graph.dependents[plugin.id]:
+                        pending[dependent] -= 1
+                        if not pending[dependent]:
+                            ready.append(self._plugins[dependent])
+
+                now = _clock()
+                for plugin, call in running.values():
+                    # the timeout starts when the hook starts running, not when it is queued
+                    if timeout is not None and call.start is not None and now >= call.start + timeout:
+                        raise PluginError("Timeout running '{0}' of plugin: {1}".format(hook, plugin.id))
+        finally:
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=False)
+
     def register_extension_point(self, extension_point):
         logger.debug("Registering extension point: {}".format(extension_point.id))
         if extension_point.id in self.extension_points:
             raise PluginError("Duplicated extension point: {}".format(extension_point.id))
         self.extension_points[extension_point.id] = extension_point
+        extension_point.profiler = self.profiler
+
+        # extenders left behind when a previous extension point with this id was unloaded
+        for extender in self._detached_extenders.pop(extension_point.id, ()):
+            extension_point.add_extender(extender)
 
     def remove_extension_point(self, extension_point):
         logger.debug("Removing extension point: {}".format(extension_point.id))
@@ -310,8 +2485,7 @@ class PluginManager(object):
             extender.__module__, extender.__name__, extension_point_id)
         )
 
-        if extender not in self.extension_points[extension_point_id].extenders:
-            self.extension_points[extension_point_id].extenders.append(extender)
+        self.extension_points[extension_point_id].add_extender(extender)
 
     def remove_extender(self, extender):
         if not callable(extender) or not hasattr(extender, "_extension_point"):
@@ -322,27 +2496,39 @@ class PluginManager(object):
             raise PluginError("Unknown extension point: '{0}'".format(extension_point_id))
 
         logger.debug("Removing extender from extension point: {}".format(extension_point_id))
-        try:
-            self.extension_points[extension_point_id].extenders.remove(extender)
-        except ValueError:
-            pass
+        self.extension_points[extension_point_id].remove_extender(extender)
 
     def register_service(self, id, service):
-        """Register a service with the plugin manager. Raise a PluginError exception if there is an
-        existing service with this id.
+        """Register a service instance with the plugin manager. Raise a PluginError exception if there is an
+        existing service with this id. The service is registered as is, even if it is callable, to register
+        a factory use: register_factory
 
         :param id: Unique id of the service.
         :type id: str
 
-        :param service: The service instance or a factory that create it.
-            Factories can be any callable that return the service instance.
-        :type: any or callable() -> service instance
+        :param service: The service instance.
+        :type: any
         """
-        if id in self.services:
-            raise PluginError("Existing service: {0}".format(id))
-
         logger.debug("Registering service: {}".format(id))
-        self.services[id] = service
+        self.services.register_instance(id, service, self._owner.get())
+
+    def register_factory(self, id, factory, lifetime=SINGLETON):
+        """Register a factory that creates a service. Raise a PluginError exception if there is an
+        existing service with this id.
+
+        :param id: Unique id of the service.
+        :type id: str
+
+        :param factory: Callable that returns the service instance. It may be a coroutine function
+            if the service is requested with: get_service_async
+        :type factory: callable() -> service instance
+
+        :param lifetime: When the factory is called, one of: SINGLETON, THREAD, CONTEXT or TRANSIENT.
+            See: ServiceRegistry
+        :type lifetime: str
+        """
+        logger.debug("Registering service factory: {} ({})".format(id, lifetime))
+        self.services.register_factory(id, factory, lifetime, self._owner.get())
 
     def remove_service(self, id):
         """Remove the service from the plugin manager. Raise a PluginError exception if there is no such service.
@@ -350,26 +2536,85 @@ class PluginManager(object):
         :param id: Unique id of the service.
         :type id: str
         """
-        if not id in self.services:
-            raise PluginError("Service not found: {0}".format(id))
-
         logger.debug("Unregistering service: {}".format(id))
-        del self.services[id]
+        self.services.remove(id)
 
     def get_service(self, id):
         """Lookup a service using its unique id. If the service was registered as a factory, then it will be called
-        to create the real service and, any subsequent call will return the service created by the factory.
+        to create the service according to its lifetime (see: register_factory).
 
         :param id: Unique id of the service.
         :type id: str
 
         :returns: Service instance or None.
         """
-        service = self.services.get(id)
-        if callable(service):
-            self.services[id] = service()
-            return self.services[id]
-        return service
+        return self.services.get(id)
+
+    def register_pool(self, id, factory, min_size=0, max_size=10, idle_timeout=None, health_check=None,
+                      dispose=None):
+        """Register a pooled service: a bounded set of objects created by a factory that are used by one caller
+        at a time, see: acquire_service. Raise a PluginError exception if there is an existing service with
+        this id. Arguments are described in: ServicePool
+
+        :returns: ServicePool
+        """
+        logger.debug("Registering service pool: {}".format(id))
+        pool = ServicePool(factory, min_size, max_size, idle_timeout, health_check, dispose)
+        try:
+            self.services.register_instance(id, pool, self._owner.get())
+        except PluginError:
+            pool.close()
+            raise
+        return pool
+
+    def acquire_service(self, id, timeout=None):
+        """Return a context manager that takes an object from a pooled service and returns it to the pool
+        when the block ends:
+
+            with plugin_manager.acquire_service("db") as connection:
+                ...
+
+        :param id: Unique id of the pooled service.
+        :type id: str
+
+        :param timeout: Maximum number of seconds to wait for an object, raise PluginError after that.
+        :type timeout: float
+        """
+        pool = self.services.get(id)
+        if not isinstance(pool, ServicePool):
+            raise PluginError("Service: {0} is not a pooled service".format(id))
+        return pool.acquire(timeout)
+
+    def pool_stats(self, id):
+        """Return the statistics of a pooled service, see: ServicePool.stats
+
+        :returns: dict
+        """
+        pool = self.services.get(id)
+        if not isinstance(pool, ServicePool):
+            raise PluginError("Service: {0} is not a pooled service".format(id))
+        return pool.stats
+
+    def service_scope(self):
+        """Return a context manager that opens a new scope for services registered with the CONTEXT lifetime:
+
+            with plugin_manager.service_scope():
+                session = plugin_manager.get_service("db_session")
+        """
+        return self.services.scope()
+
+    def get_service_async(self, id):
+        """Asyncio version of get_service, factories may be coroutine functions. Concurrent requests of a
+        service not created yet share a single call to its factory. Must be awaited:
+        await plugin_manager.get_service_async(id)
+
+        :param id: Unique id of the service.
+        :type id: str
+
+        :returns: coroutine
+        """
+        from plugin_manager_async import get_service
+        return get_service(self, id)
 
     def dependencies(self, id, include_self=True):
         """Search for dependencies of this plugin and return it. This method does not analyze plugin versions.
@@ -382,64 +2627,414 @@ class PluginManager(object):
 
         :returns: List of plugin ids sorted by its dependencies.
         """
-        def _resolve(id):
-            unresolved.append(id)
+        return self._graph.dependencies(id, include_self)
+
+    def dependents(self, id, include_self=True):
+        """Search for the plugins that depend, directly or not, on this plugin.
+
+        :param id: Unique id of the plugin
+        :type id: str
+
+        :param include_self: If this plugin id must be in the result list.
+        :type include_self: bool
+
+        :returns: List of plugin ids sorted by its dependencies.
+        """
+        if id not in self._plugins:
+            raise PluginError("Missing plugin: {0}".format(id))
+        return self._graph.all_dependents(id, include_self)
+
+    def running(self, plugin):
+        """Return a context manager that marks 'plugin' as the owner of the services registered inside
+        the block. The plugin manager uses it when it calls the plugin hooks.
+
+        :param plugin: The plugin running code.
+        :type plugin: Plugin or LazyPlugin
+        """
+        @contextlib.contextmanager
+        def running():
+            token = self._owner.set(plugin.id)
+            try:
+                yield
+            finally:
+                self._owner.reset(token)
+        return running()
+
+    def reload_plugins(self, plugin_paths, notify=None):
+        """Reload the plugins found in some plugin paths (e.g. because they changed) and all plugins depending
+        on them, without touching any other plugin. Affected plugins are unloaded (their services, extenders and
+        extension points are removed and their modules removed from sys.modules), then the plugin paths are
+        discovered again and the plugins found are configured and enabled in dependency order. Plugin paths
+        not seen before are discovered too.
+
+        :param plugin_paths: Absolute paths of the changed plugins (directory, zip or python file). Plugins
+            loaded from a plugin bundle are reloaded from these paths too, not from the bundle.
+        :type plugin_paths: iterable(str)
+
+        :param notify: See: enable_plugins
+        :type: callable(enabled, plugin)
+
+        :returns: Ids of the plugins loaded after the reload, sorted by dependencies.
+        """
+        plugin_paths = set(plugin_paths)
+        if self.bundle is not None:
+            # bundled plugins are known by their path in the bundle, the changed ones are loaded from their sources
+            stale = [entry for entry in self.bundle.entries if entry["source"] in plugin_paths]
+            plugin_paths.update(self.bundle.plugin_path(entry) for entry in stale)
+            self.bundle.discard(stale)
+
+        changed = [plugin.id for plugin in self.plugins if plugin.path in plugin_paths]
+        affected = set()
+        for id in changed:
+            affected.update(self.dependents(id))
+
+        logger.debug("Reloading plugins: {0}".format(", ".join(sorted(affected)) or "-"))
+        plugin_paths.update(self._plugins[id].path for id in affected)
+        self._unload_plugins(affected)
+
+        # forget the plugin paths, so they are discovered again
+        self.disabled = [plugin for plugin in self.disabled if plugin.path not in plugin_paths]
+        self._plugin_paths.difference_update(plugin_paths)
+        if hasattr(importlib, "invalidate_caches"):
+            importlib.invalidate_caches()
+
+        known = set(self._plugins)
+        self.find_plugins()
+
+        loaded = [plugin for plugin in self.plugins if plugin.id not in known]
+        for plugin in loaded:
+            logger.debug("Configuring plugin: {}".format(plugin.id))
+            _run_hook(plugin, "configure")
+
+        for plugin in loaded:
+            if callable(notify):
+                notify(False, plugin)
+            logger.debug('Enabling plugin: {0}'.format(plugin.id))
+            _run_hook(plugin, "enable")
+            if callable(notify):
+                notify(True, plugin)
+
+        return [plugin.id for plugin in loaded]
+
+    def unload_plugin(self, id):
+        """Unload a plugin and all plugins depending on it, dependents first. For each plugin its "disable"
+        hook is called, then its services, extenders and extension points are removed, its modules removed
+        from sys.modules and the sys.path entries added for it by the plugin manager removed. Unloaded plugins
+        are not discovered again by find_plugins, use reload_plugins to load them again.
+
+        :param id: Unique id of the plugin.
+        :type id: str
+
+        :returns: Ids of the plugins unloaded.
+        """
+        ids = self.dependents(id)
+        logger.debug("Unloading plugins: {0}".format(", ".join(ids)))
+        self._unload_plugins(ids)
+        return ids
+
+    def _unload_plugins(self, ids):
+        """Remove some plugins from the plugin manager, dependents first. The caller must make sure no other
+        plugin depends on them. Extenders of other plugins to the extension points removed are kept aside and
+        added again if an extension point with the same id is registered later.
+
+        :param ids: Ids of the plugins to remove.
+        :type ids: iterable(str)
+        """
+        ids = set(ids)
+        plugins = [plugin for plugin in reversed(self.plugins) if plugin.id in ids]
+        for plugin in plugins:
+            logger.debug("Disabling plugin: {0}".format(plugin.id))
             try:
-                dependencies = self._plugins[id].depends
-            except (KeyError, TypeError):
-                raise PluginError("Missing plugin: {0}".format(id))
+                plugin.disable()
+            except Exception:
+                logger.error("Error disabling plugin: {0}".format(plugin.id), exc_info=True)
 
-            for dep in dependencies:
-                if dep not in self._plugins:
-                    raise PluginError("Missing dependency: {0} for plugin: {1} ".format(dep, id))
+        for plugin in plugins:
+            logger.debug("Unloading plugin: {0}".format(plugin.id))
+            for service_id in self.services.owned_by(plugin.id):
+                self.remove_service(service_id)
 
-                if dep not in resolved:
-                    if dep in unresolved:
-                        raise PluginError("Cyclic dependency detected: {0} --> {1}".format(id, dep))
-                    _resolve(dep)
+            for extender in plugin.extenders:
+                if extender._extension_point in self.extension_points:
+                    self.remove_extender(extender)
+
+        for plugin in plugins:
+            for extension_point_id, _ in plugin.extension_point_specs:
+                extension_point = self.extension_points.get(extension_point_id)
+                if extension_point is None:
+                    continue
+                self.remove_extension_point(extension_point)
+                if extension_point.extenders:
+                    self._detached_extenders.setdefault(extension_point_id, []).extend(extension_point.extenders)
+
+            self._remove_plugin(plugin.id)
+            self._purge_modules(plugin)
+
+        self._purge_sys_path()
+
+    def _purge_sys_path(self):
+        """Remove the sys.path entries added by the plugin manager that no loaded plugin needs anymore:
+        zip plugins and search paths without plugins. Only used when plugins are imported through sys.path
+        (python 2), otherwise, the plugin finder is removed from sys.meta_path if there are no plugins.
+        """
+        if self.finder is not None and not self._plugins:
+            for finder in (self.finder, self.bundle):
+                if finder in sys.meta_path:
+                    sys.meta_path.remove(finder)
+
+        needed = set()
+        for plugin in self._plugins.values():
+            needed.add(plugin.path if plugin.path.endswith(".zip") else os.path.dirname(plugin.path))
+
+        for entry in list(self._sys_path_entries):
+            if entry not in needed:
+                logger.debug("Removing from sys.path: {0}".format(entry))
+                while entry in sys.path:
+                    sys.path.remove(entry)
+                sys.path_importer_cache.pop(entry, None)
+                self._sys_path_entries.discard(entry)
+
+    def _purge_modules(self, plugin):
+        """Remove from sys.modules all modules of a plugin, so the next import loads them again.
+
+        :param plugin: The plugin.
+        :type plugin: LazyPlugin
+        """
+        package = plugin.module.split(".")[0]
+        if self.finder is not None:
+            self.finder.remove(package)
+
+        path = plugin.path + os.sep
+        for name, module in list(sys.modules.items()):
+            filename = getattr(module, "__file__", None) or ""
+            if name == package or name.startswith(package + ".") or filename.startswith(path):
+                del sys.modules[name]
+
+        if plugin.path.endswith(".zip"):
+            # zip importers cache the archive directory
+            sys.path_importer_cache.pop(plugin.path, None)
+            try:
+                zipimport._zip_directory_cache.pop(plugin.path, None)
+            except AttributeError:
+                pass
+
+    def _open_bundle(self):
+        """Return the plugin bundle of the plugin manager, mapping it the first time, or None if there is no
+        bundle or it can't be used.
+        """
+        if self.bundle is not None or self._bundle_path is None:
+            return self.bundle
+
+        path, self._bundle_path = self._bundle_path, None
+        if self.finder is None:
+            logger.warning("Plugin bundles are not supported in this python version: {0}".format(path))
+        elif not os.path.isfile(path):
+            logger.debug("Plugin bundle not found: {0}".format(path))
+        else:
+            try:
+                self.bundle = PluginBundle(path)
+                logger.debug("Using plugin bundle: {0}".format(path))
+                stale = self.bundle.discard_stale()
+                if stale:
+                    logger.debug("Stale plugin bundle entries, using the search path: {0}".format(", ".join(stale)))
+            except (IOError, OSError, ValueError, PluginError) as e:
+                logger.warning("Unable to use plugin bundle: {0}, reason: {1}".format(path, e))
+        return self.bundle
+
+    def _add_plugin(self, plugin):
+        self._plugins[plugin.id] = plugin
+        self._graph.add(plugin.id, plugin.depends)
+        self._sorted_plugins = None
+
+    def _remove_plugin(self, id):
+        plugin = self._plugins.pop(id)
+        self._graph.remove(id)
+        self._sorted_plugins = None
+        return plugin
+
+    def _describe(self, entry):
+        """Return the description of the plugins in a plugin path, without importing anything: from the manifest
+        if it is up to date or parsing the plugin definitions in static mode. It runs in the discovery thread pool.
+
+        :param entry: The absolute path to the plugin and if it is a directory.
+        :type entry: tuple(str, bool)
+
+        :returns: (stamp, list(dict) or None if the plugin path must be loaded, True if taken from the manifest)
+        """
+        plugin_path, is_dir = entry
+        stamp = None
+        if self.manifest is not None:
+            stamp = self.manifest.stamp(plugin_path, is_dir)
+            cached = self.manifest.get(plugin_path, stamp) if stamp is not None else None
+            if cached is not None:
+                return stamp, cached, True
 
-            resolved.append(id)
-            unresolved.remove(id)
+        descriptions = self._static_loader(plugin_path, is_dir) if self.static else None
+        return stamp, descriptions, False
 
-        resolved, unresolved = [], []
-        _resolve(id)
+    def _discover(self, plugin_path, is_dir=None, description=None):
+        """Return the plugins found in a plugin path. The description of the plugins is taken from the
+        manifest if it is up to date, otherwise, the plugin path is loaded and the manifest updated.
 
-        if include_self:
-            return resolved
-        return resolved[:-1]
+        :param plugin_path: The absolute path to the plugin
+        :type plugin_path: str
+
+        :param is_dir: If the plugin path is a directory, if it is already known.
+        :type is_dir: bool
+
+        :param description: The result of: _describe, if it is already known.
+        :type description: tuple
 
-    def _loader(self, plugin_path):
+        :returns: list(LazyPlugin)
+        """
+        stamp, descriptions, cached = description or self._describe((plugin_path, is_dir))
+        if descriptions is not None:
+            plugins = [LazyPlugin.from_dict(self, plugin_path, data) for data in descriptions]
+        else:
+            plugins = [
+                LazyPlugin.from_plugin(self, plugin_path, plugin) for plugin in self._loader(plugin_path, is_dir)
+            ]
+
+        if stamp is not None and plugins and not cached:
+            self.manifest.put(plugin_path, stamp, [plugin.to_dict() for plugin in plugins])
+        return plugins
+
+    def _static_loader(self, plugin_path, is_dir=None):
+        """Describe the plugins in a plugin path parsing its plugin definitions module, without importing it.
+
+        :param plugin_path: The absolute path to the plugin
+        :type plugin_path: str
+
+        :param is_dir: If the plugin path is a directory, if it is already known.
+        :type is_dir: bool
+
+        :returns: list(dict) in the format of LazyPlugin.to_dict or None if the plugins must be imported
+            to know what they declare.
+        """
+        basename = os.path.basename(plugin_path)
+        if is_dir is None:
+            is_dir = os.path.isdir(plugin_path)
+
+        try:
+            if is_dir:
+                module = basename + ".plugin_definitions"
+                filename = os.path.join(plugin_path, "plugin_definitions.py")
+                with open(filename, "rb") as f:
+                    source = f.read()
+            elif plugin_path.endswith(".zip"):
+                package_name = os.path.splitext(basename)[0]
+                module = package_name + ".plugin_definitions"
+                filename = os.path.join(plugin_path, package_name, "plugin_definitions.py")
+                with zipfile.ZipFile(plugin_path) as archive:
+                    source = archive.read(package_name + "/plugin_definitions.py")
+            elif plugin_path.endswith(".py") and not basename.startswith("__init__"):
+                module = os.path.splitext(basename)[0]
+                filename = plugin_path
+                with open(filename, "rb") as f:
+                    source = f.read()
+            else:
+                return None
+        except (IOError, OSError, KeyError, zipfile.BadZipfile):
+            return None
+
+        return parse_plugin_definitions(source, module, filename)
+
+    def _instantiate(self, plugin):
+        """Import the module of a plugin that was discovered without loading it and create the plugin instance.
+
+        :param plugin: The plugin to load.
+        :type plugin: LazyPlugin
+
+        :returns: Plugin
+        """
+        if self.finder is None and plugin.path.endswith(".zip") and plugin.path not in sys.path:
+            sys.path.insert(0, plugin.path)
+            self._sys_path_entries.add(plugin.path)
+
+        try:
+            with self.profiler.measure(plugin.id, "import", plugin.module):
+                module = importlib.import_module(plugin.module)
+            with self.profiler.measure(plugin.id, "instantiate"):
+                return getattr(module, plugin.class_name)(self)
+        except Exception as e:
+            error = "error loading plugin: {0} from: {1}, reason: {2}"
+            raise PluginError(error.format(plugin.id, plugin.path, e))
+
+    def _plugin_loaded(self, plugin, instance):
+        """Replace the placeholders registered for the extension points of a plugin that has just
+        been loaded with the real extension points, keeping their extenders.
+
+        :param plugin: The plugin just loaded.
+        :type plugin: LazyPlugin
+
+        :param instance: The real plugin instance.
+        :type instance: Plugin
+        """
+        for extension_point in instance.extension_points:
+            placeholder = self.extension_points.get(extension_point.id)
+            if placeholder is None or placeholder is extension_point:
+                continue
+            extension_point.adopt(placeholder)
+            extension_point.profiler = self.profiler
+            self.extension_points[extension_point.id] = extension_point
+
+    def _loader(self, plugin_path, is_dir=None):
         """Load a plugin and return it. This function doesn't activate the plugin, just create an instance of it.
 
         :param plugin_path: The absolute path to the plugin
         :type plugin_path: str
 
+        :param is_dir: If the plugin path is a directory, if it is already known.
+        :type is_dir: bool
+
         :returns: List of plugins found or an empty list.
         """
 
+        if is_dir is None:
+            is_dir = os.path.isdir(plugin_path)
+
         name = None
-        if os.path.isfile(plugin_path):
+        if not is_dir and os.path.exists(plugin_path):
             if plugin_path.endswith(".zip"):
                 package_name, ext = os.path.splitext(plugin_path)
-                sys.path.insert(0, plugin_path)
+                if self.finder is None and plugin_path not in sys.path:
+                    sys.path.insert(0, plugin_path)
+                    self._sys_path_entries.add(plugin_path)
                 name = os.path.basename(package_name) + ".plugin_definitions"
             elif (plugin_path.endswith('.py') or plugin_path.endswith(".pyc")) and \
                     not os.path.basename(plugin_path).startswith('__init__'):
                 name = os.path.splitext(os.path.basename(plugin_path))[0]
             else:
                 return ()
-        elif os.path.isdir(plugin_path):
+        elif is_dir:
             name = os.path.basename(plugin_path) + ".plugin_definitions"
         else:
             return ()
 
         try:
-            plugin_definitions = importlib.import_module(name)
-            plugins = [
-                klass(self) for _, klass in
-                inspect.getmembers(plugin_definitions, inspect.isclass)
-                if (issubclass(klass, Plugin) and klass is not Plugin)
-            ]
+            classes = []
+            with self.profiler.measure(None, "import", name) as measure:
+                try:
+                    plugin_definitions = importlib.import_module(name)
+                    classes = [
+                        klass for _, klass in
+                        inspect.getmembers(plugin_definitions, inspect.isclass)
+                        if issubclass(klass, Plugin) and klass is not Plugin
+                    ]
+                finally:
+                    # the import is measured as part of the first plugin defined in the module, imports that
+                    # failed or of modules without plugins (e.g. a directory that is not a plugin) are not
+                    owners = [klass.id for klass in classes if klass.__module__ == name and not klass._missing_fields]
+                    if not owners:
+                        measure.discard()
+                    elif measure is not _NULL_MEASURE:
+                        # profiling, the shared null measure is never changed
+                        measure.plugin_id = owners[0]
+
+            plugins = []
+            for klass in classes:
+                with self.profiler.measure(getattr(klass, "id", None), "instantiate"):
+                    plugins.append(klass(self))
             return plugins
         except Exception as e:
             error = "error loading plugin: {0} in: {1}, reason: {2}"
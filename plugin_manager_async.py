@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Asyncio support for the plugin manager. It lives in its own module so the plugin manager
+can still be imported by python versions without async/await, use it through the plugin manager:
+
+    await plugin_manager.configure_plugins_async()
+    await plugin_manager.enable_plugins_async()
+    service = await plugin_manager.get_service_async("my_service")
+"""
+__author__ = "jmrbcu"
+import asyncio
+import inspect
+import logging
+
+from plugin_manager import SINGLETON, TRANSIENT, PluginError, _Measure, _cpu_clock, _perf_clock
+
+logger = logging.getLogger(__name__)
+
+
+async def _call(fn, *args):
+    """Call fn and await the result if it is awaitable, so sync and async callables can be mixed."""
+    result = fn(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+class _Measured(object):
+    """Awaitable recording in a profiler the time spent awaiting another awaitable: the wall time until it is
+    done and the cpu time of its own steps, not the one of the tasks running meanwhile. As in
+    PluginProfiler.measure, the time of the measures taken inside its steps is not counted.
+    """
+
+    def __init__(self, profiler, plugin_id, phase, awaitable):
+        self.profiler = profiler
+        self.plugin_id = plugin_id
+        self.phase = phase
+        self.awaitable = awaitable
+
+    def __await__(self):
+        iterator = self.awaitable.__await__()
+        if not self.profiler.enabled:
+            return (yield from iterator)
+
+        # collects the time of the measures nested in the steps
+        frame = _Measure(self.profiler, self.plugin_id, self.phase, None)
+        start, cpu = _perf_clock(), 0.0
+        value, error = None, None
+        try:
+            while True:
+                stack = self.profiler._stack()
+                stack.append(frame)
+                step = _cpu_clock()
+                try:
+                    yielded = iterator.send(value) if error is None else iterator.throw(error)
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    cpu += _cpu_clock() - step
+                    stack.pop()
+
+                try:
+                    value, error = (yield yielded), None
+                except GeneratorExit:
+                    iterator.close()
+                    raise
+                except BaseException as e:
+                    value, error = None, e
+        finally:
+            wall = _perf_clock() - start
+            stack = self.profiler._stack()
+            if stack:
+                stack[-1].children_wall += wall
+                stack[-1].children_cpu += cpu
+            self.profiler.record(
+                self.plugin_id, self.phase, start, wall - frame.children_wall, cpu - frame.children_cpu, wall
+            )
+
+
+async def run_hooks(plugin_manager, hook, notify=None):
+    """Call a hook of every plugin. Each plugin waits only for its dependencies, so plugins not depending
+    on each other run concurrently. The first error cancels everything that is still pending and is raised.
+
+    :param hook: Name of the plugin method to call: configure or enable.
+    :type hook: str
+
+    :param notify: Same as in: PluginManager.enable_plugins
+    :type notify: callable(enabled, plugin)
+    """
+    async def run(plugin, dependencies):
+        if dependencies:
+            await asyncio.gather(*dependencies)
+
+        if callable(notify):
+            notify(False, plugin)
+
+        logger.debug("Running '{0}' of plugin: {1}".format(hook, plugin.id))
+        with plugin_manager.running(plugin):
+            result = getattr(plugin, hook)()
+            if inspect.isawaitable(result):
+                # sync hooks are measured by the plugin itself, see: LazyPlugin.configure
+                await _Measured(plugin_manager.profiler, plugin.id, hook, result)
+
+        if callable(notify):
+            notify(True, plugin)
+
+    # plugins are sorted by dependencies, so the tasks of the dependencies already exist
+    tasks = {}
+    for plugin in plugin_manager.plugins:
+        dependencies = [tasks[dep] for dep in plugin_manager._graph.depends[plugin.id]]
+        tasks[plugin.id] = asyncio.ensure_future(run(plugin, dependencies))
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+
+
+async def reload_extensions(extension_point):
+    """Evaluate all the extenders of an extension point concurrently, awaiting the ones returning awaitables.
+    Extensions keep the order of the extenders.
+    """
+    extenders = list(extension_point.extenders)
+    results = await asyncio.gather(*[_call(extender) for extender in extenders])
+
+    for extender, result in zip(extenders, results):
+        if not hasattr(result, "__iter__"):
+            raise TypeError("extender method: {0} must return an iterable".format(extender))
+
+    extension_point.update_results(dict((extender, list(result)) for extender, result in zip(extenders, results)))
+    return extension_point.extensions
+
+
+async def get_service(plugin_manager, id):
+    """Lookup a service using its unique id. Factories may be coroutine functions. When many coroutines
+    request a singleton service that is not created yet, its factory is called only once and all of them
+    get the same instance. If the factory fails, the error is raised to all of them and the next request
+    retries. Async factories can only be used with the SINGLETON and TRANSIENT lifetimes.
+    """
+    registry = plugin_manager.services
+    try:
+        return registry.instances[id]
+    except KeyError:
+        pass
+
+    factory, lifetime = registry.factories.get(id, (None, None))
+    if factory is None or not inspect.iscoroutinefunction(factory):
+        return registry.get(id)
+    elif lifetime == TRANSIENT:
+        return await factory()
+    elif lifetime != SINGLETON:
+        raise PluginError("Service: {0} has an async factory with unsupported lifetime: {1}".format(id, lifetime))
+
+    registration = registry._registrations.get(id)
+    if registration is None:
+        # removed meanwhile
+        return None
+    # a service registered again while the previous factory is running gets its own creation
+    future = plugin_manager._service_futures.get(registration)
+    if future is None:
+        async def create():
+            try:
+                return registry._store(id, registration, await factory())
+            finally:
+                del plugin_manager._service_futures[registration]
+
+        future = plugin_manager._service_futures[registration] = asyncio.ensure_future(create())
+
+    # a cancelled caller must not cancel the creation for everybody else
+    return await asyncio.shield(future)
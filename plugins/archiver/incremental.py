@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Support for incremental archives: a sidecar manifest (archive.manifest.json) keeps the path, size,
+modification time and content hash of every file in the archive, so the next run only writes new or
+modified files.
+"""
+__author__ = "jmrbcu"
+import os
+import copy
+import json
+import stat
+import hashlib
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def arcname(path):
+    """Return the name of a file inside an archive, the same name used by tarfile and zipfile."""
+    return os.path.splitdrive(path)[1].lstrip(os.sep).replace(os.sep, "/")
+
+
+def scan(filename):
+    """Return the regular files in a file or directory tree.
+
+    :returns: dict(arcname -> (path, size, mtime_ns))
+    """
+    def entry(path, st):
+        mtime = getattr(st, "st_mtime_ns", int(st.st_mtime * 1e9))
+        return path, st.st_size, mtime
+
+    if not os.path.isdir(filename):
+        return {arcname(filename): entry(filename, os.stat(filename))}
+
+    files = {}
+    for root, dirs, names in os.walk(filename):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                files[arcname(path)] = entry(path, st)
+    return files
+
+
+class HashingReader(object):
+    """File object wrapper that hashes and counts the bytes read through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hash.update(data)
+        self.bytes_read += len(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+def hash_file(path):
+    """Return the sha256 of a file and its size, reading it in chunks."""
+    with open(path, "rb") as f:
+        reader = HashingReader(f)
+        while reader.read(CHUNK_SIZE):
+            pass
+    return reader.hexdigest(), reader.bytes_read
+
+
+class Report(dict):
+    """Result of an incremental compress: number of files added, modified, unchanged and removed, bytes read
+    from the files and archives and bytes written to the archives.
+    """
+
+    def __init__(self, archive):
+        super(Report, self).__init__(
+            archive=archive, added=0, modified=0, unchanged=0, removed=0, bytes_read=0, bytes_written=0,
+            rebuilt=False
+        )
+
+
+class ArchiveManifest(object):
+    """Sidecar manifest of an incremental archive. An archive is made of one or more layers (files),
+    the manifest is only valid while every layer has the size recorded in it.
+    """
+
+    version = 1
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.path = archive + ".manifest.json"
+        self.layers = []
+        self.entries = {}
+
+    def load(self):
+        """Load the manifest, return False if there is no valid manifest for the archive."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+
+        if data.get("version") != self.version:
+            return False
+        directory = os.path.dirname(self.archive)
+        for layer in data["layers"]:
+            try:
+                if os.path.getsize(os.path.join(directory, layer["file"])) != layer["size"]:
+                    return False
+            except OSError:
+                return False
+
+        self.layers = data["layers"]
+        self.entries = data["entries"]
+        return True
+
+    def save(self):
+        tmp = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({"version": self.version, "layers": self.layers, "entries": self.entries}, f)
+        getattr(os, "replace", os.rename)(tmp, self.path)
+
+    def add_layer(self, path, removed=()):
+        self.layers.append({"file": os.path.basename(path), "size": os.path.getsize(path), "removed": list(removed)})
+
+    def plan(self, files, report):
+        """Compare the files with the manifest entries. Files whose size and modification time didn't change
+        are not read, the others are hashed to find out if their content changed.
+
+        :param files: The result of: scan
+        :param report: Report updated with the files unchanged and the bytes read.
+
+        :returns: (arcnames added, arcnames modified, arcnames removed)
+        """
+        added, modified = [], []
+        for name, (path, size, mtime) in sorted(files.items()):
+            entry = self.entries.get(name)
+            if entry is None:
+                added.append(name)
+            elif entry["size"] == size and entry["mtime_ns"] == mtime:
+                report["unchanged"] += 1
+            else:
+                digest, read = hash_file(path)
+                report["bytes_read"] += read
+                if digest == entry["sha256"]:
+                    # touched but not changed
+                    entry["size"], entry["mtime_ns"] = size, mtime
+                    report["unchanged"] += 1
+                else:
+                    modified.append(name)
+        removed = sorted(name for name in self.entries if name not in files)
+        return added, modified, removed
+
+    def put(self, name, size, mtime, digest, layer=0):
+        self.entries[name] = {"size": size, "mtime_ns": mtime, "sha256": digest, "layer": layer}
+
+
+def copy_zip_member(source, target, info, end):
+    """Copy a member from one zip file to another without decompressing it: its local header, data and
+    data descriptor are copied verbatim and a copy of its ZipInfo added to the central directory of the target.
+
+    :param source: Zip file open for reading.
+    :param target: Zip file open for writing.
+    :param info: ZipInfo of the member in the source.
+    :param end: Offset of the end of the member in the source (next local header or central directory).
+
+    :returns: Bytes copied.
+    """
+    source.fp.seek(info.header_offset)
+    remaining = end - info.header_offset
+    new_info = copy.copy(info)
+    new_info.header_offset = target.fp.tell()
+    while remaining > 0:
+        data = source.fp.read(min(CHUNK_SIZE, remaining))
+        if not data:
+            raise zipfile.BadZipfile("Truncated member: {0}".format(info.filename))
+        target.fp.write(data)
+        remaining -= len(data)
+
+    target.filelist.append(new_info)
+    target.NameToInfo[new_info.filename] = new_info
+    target.start_dir = target.fp.tell()
+    target._didModify = True
+    return end - info.header_offset
+
+
+def member_ends(archive):
+    """Return the offset where every member of a zip file ends, keyed by member name."""
+    infos = sorted(archive.infolist(), key=lambda info: info.header_offset)
+    ends = [info.header_offset for info in infos[1:]] + [archive.start_dir]
+    return dict((info.filename, end) for info, end in zip(infos, ends))
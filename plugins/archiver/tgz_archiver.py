@@ -4,8 +4,126 @@ try:
     import pathlib
 except:
     import pathlib2 as pathlib
+import os
+import zlib
 import tarfile
+import shutil
+import contextlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from basic.archiver import Archiver
+from .incremental import ArchiveManifest, HashingReader, Report, scan
+from .tgz_index import CHUNK_SIZE, IndexingTarFile, TgzIndex, index_path, open_stream
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# refuse absolute paths, paths outside of the destination and special files, where tarfile supports it
+_EXTRACT_OPTIONS = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+
+
+def _inside(path, root):
+    return path == root or path.startswith(os.path.join(root, ""))
+
+
+def _check_member(info, dest):
+    """Raise tarfile.ExtractError if extracting the member in 'dest' could write outside of it, what the "data"
+    filter refuses in the python versions that have it: absolute names, names or link targets that resolve outside
+    of 'dest' and device files.
+    """
+    root = os.path.realpath(dest)
+    if os.path.isabs(info.name):
+        raise tarfile.ExtractError("{0}: absolute path".format(info.name))
+    path = os.path.join(root, info.name)
+    if not _inside(os.path.realpath(path), root):
+        raise tarfile.ExtractError("{0}: outside of the destination".format(info.name))
+    if info.isdev():
+        raise tarfile.ExtractError("{0}: special file".format(info.name))
+    if info.issym() or info.islnk():
+        if os.path.isabs(info.linkname):
+            raise tarfile.ExtractError("{0}: absolute link {1}".format(info.name, info.linkname))
+        # symbolic links are relative to the directory of the link, hard links to the root of the archive
+        base = os.path.dirname(path) if info.issym() else root
+        if not _inside(os.path.realpath(os.path.join(base, info.linkname)), root):
+            raise tarfile.ExtractError("{0}: link outside of the destination".format(info.name))
+
+
+def _gzip_member(block, level):
+    # wbits=31: deflate with gzip header and trailer, each block is a complete gzip member
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(block) + compressor.flush()
+
+
+class ParallelGzipWriter(object):
+    """Write only file object that compresses the data written to it pigz style: the data is split in fixed size
+    blocks, blocks are compressed concurrently in a thread pool (zlib releases the GIL) and written in order as
+    independent gzip members. A multi-member gzip file is standard, gzip, tar and python read it as a single stream.
+    """
+
+    def __init__(self, fileobj, workers=None, block_size=DEFAULT_BLOCK_SIZE, level=9):
+        """
+        :param fileobj: File object where the gzip members are written.
+        :param workers: Number of compression threads, all cpus by default.
+        :param block_size: Size in bytes of the uncompressed blocks.
+        :param level: Compression level, from 1 to 9, 9 as the default of tarfile.
+        """
+        self.fileobj = fileobj
+        self.workers = workers or getattr(os, "cpu_count", multiprocessing.cpu_count)() or 1
+        self.block_size = block_size
+        self.level = level
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._members = 0
+        self._compressed = 0
+        self._uncompressed = 0
+        # (compressed offset, uncompressed offset) of every gzip member written, decompression can start there
+        self.checkpoints = []
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        try:
+            if self._buffer or not self._members:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._write_member()
+        finally:
+            for future, _ in self._pending:
+                future.cancel()
+            self._executor.shutdown()
+
+    def _submit(self, block):
+        self._pending.append((self._executor.submit(_gzip_member, block, self.level), len(block)))
+        self._members += 1
+
+        # bound the memory used: wait for the oldest block when there are enough blocks in flight
+        while len(self._pending) > 2 * self.workers:
+            self._write_member()
+
+    def _write_member(self):
+        future, size = self._pending.popleft()
+        member = future.result()
+        self.fileobj.write(member)
+        self.checkpoints.append((self._compressed, self._uncompressed))
+        self._compressed += len(member)
+        self._uncompressed += size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 class TgzArchiver(Archiver):
@@ -14,8 +132,204 @@ class TgzArchiver(Archiver):
         super(TgzArchiver, self).__init__()
         self.file_type = "tar.gz"
 
-    def compress(self, filename):
+    def compress(self, filename, workers=None, block_size=None, incremental=False, max_layers=8, index=False,
+                 index_interval=0, level=9, **options):
+        """Create filename.tar.gz, the tar stream is compressed in parallel, see: ParallelGzipWriter.
+
+        :param workers: Number of compression threads, all cpus by default.
+        :param block_size: Size in bytes of the blocks compressed independently.
+        :param incremental: Only write the files that changed since the last incremental compress,
+            see: compress_incremental
+        :param max_layers: Number of layers of an incremental archive before it is rebuilt.
+        :param index: Write a random access index next to the archive (next to every layer if incremental),
+            see: TgzIndex
+        :param index_interval: Minimum uncompressed distance between checkpoints of the index, every
+            'block_size' by default.
+        :param level: Compression level, from 1 to 9.
+        """
         dest = str(pathlib.Path(filename).with_suffix(".tar.gz"))
-        with tarfile.open(dest, "w:gz") as tar:
+        tar_index = TgzIndex(index_interval) if index else None
+        if incremental:
+            return self.compress_incremental(filename, dest, workers, block_size, max_layers, tar_index, level)
+
+        with self._writer(dest, workers, block_size, tar_index, level) as tar:
             tar.add(str(filename))
+        if tar_index is not None:
+            tar_index.save(dest)
         return True
+
+    def compress_incremental(self, filename, dest, workers=None, block_size=None, max_layers=8, tar_index=None,
+                             level=9):
+        """Archive the regular files in 'filename' (a file or a directory tree) writing only the files that
+        changed since the last run according to the sidecar manifest of the archive. A tar.gz can't be
+        updated in place, so changes are written as layers: dest is the base layer and dest.N.tar.gz
+        has the files added or modified in the run N. The manifest records the files removed in every
+        layer. To restore, extract the layers in order deleting the files removed by each one. When there
+        are 'max_layers' layers the archive is rebuilt as a single layer.
+
+        :param tar_index: Empty TgzIndex to write a random access index of the layer written.
+
+        :returns: Report
+        """
+        report = Report(dest)
+        files = scan(filename)
+        manifest = ArchiveManifest(dest)
+        loaded = os.path.exists(dest) and manifest.load()
+        if loaded:
+            added, modified, removed = manifest.plan(files, report)
+            report.update(added=len(added), modified=len(modified), removed=len(removed))
+            if not (added or modified or removed):
+                manifest.save()
+                return report
+
+        if loaded and len(manifest.layers) < max_layers:
+            names, layer = added + modified, len(manifest.layers)
+            path = self._layer_path(dest, layer)
+        else:
+            report["rebuilt"] = True
+            if not loaded:
+                report["added"] = len(files)
+            manifest = ArchiveManifest(dest)
+            names, layer, removed, path = sorted(files), 0, [], dest
+
+        tmp = "{0}.{1}.tmp".format(path, os.getpid())
+        with self._writer(tmp, workers, block_size, tar_index, level) as tar:
+            for name in names:
+                source, size, mtime = files[name]
+                info = tar.gettarinfo(source, name)
+                with open(source, "rb") as f:
+                    reader = HashingReader(f)
+                    tar.addfile(info, reader)
+                report["bytes_read"] += reader.bytes_read
+                manifest.put(name, size, mtime, reader.hexdigest(), layer)
+        getattr(os, "replace", os.rename)(tmp, path)
+        report["bytes_written"] += os.path.getsize(path)
+        if tar_index is not None:
+            tar_index.save(path)
+
+        if layer == 0:
+            # layers of the previous archive
+            index = 1
+            while os.path.exists(self._layer_path(dest, index)):
+                os.remove(self._layer_path(dest, index))
+                if os.path.exists(index_path(self._layer_path(dest, index))):
+                    os.remove(index_path(self._layer_path(dest, index)))
+                index += 1
+
+        for name in removed:
+            del manifest.entries[name]
+        manifest.add_layer(path, removed)
+        manifest.save()
+        return report
+
+    @staticmethod
+    def _layer_path(dest, layer):
+        return dest if layer == 0 else "{0}.{1}.tar.gz".format(dest[:-len(".tar.gz")], layer)
+
+    def build_index(self, archive, interval=0, **options):
+        """Build the random access index of an existing archive, see: TgzIndex
+
+        :returns: Number of members indexed.
+        """
+        tar_index = TgzIndex.build(archive, interval)
+        tar_index.save(archive)
+        return len(tar_index.names)
+
+    def extract(self, archive, dest=".", members=None, output=None, **options):
+        """Extract the members of an archive reading it as a stream, see: Archiver.extract. The gzip stream is
+        decompressed sequentially. The layers of an incremental archive (see: compress_incremental) are extracted
+        in order, every file from the layer with its last version and files removed by a layer are skipped.
+        When writing some members to 'output' and a layer has a valid index, only their data is decompressed.
+        """
+        wanted = set(members) if members else None
+        manifest = ArchiveManifest(archive)
+        if os.path.exists(manifest.path) and manifest.load():
+            directory = os.path.dirname(archive)
+            layers = [(os.path.join(directory, layer["file"]), i) for i, layer in enumerate(manifest.layers)]
+        else:
+            layers = [(archive, None)]
+
+        count = 0
+        for path, layer in layers:
+            def selected(name, layer=layer):
+                if wanted is not None and name not in wanted:
+                    return False
+                if layer is None:
+                    return True
+                entry = manifest.entries.get(name)
+                return entry is not None and entry["layer"] == layer
+            count += self._extract_layer(path, dest, selected, output, wanted is not None)
+        return count
+
+    def _extract_layer(self, path, dest, selected, output, some):
+        tar_index = TgzIndex.load(path) if output is not None and some else None
+        if tar_index is not None:
+            count = 0
+            for i, name in enumerate(tar_index.names):
+                # a repeated name is the last version of the file
+                if selected(name) and tar_index.members[name] == i:
+                    tar_index.read(path, name, output)
+                    count += 1
+            return count
+
+        count = 0
+        with open_stream(path) as tar:
+            for info in tar:
+                if not selected(info.name):
+                    continue
+                if output is None:
+                    if not _EXTRACT_OPTIONS:
+                        _check_member(info, dest)
+                    tar.extract(info, dest, **_EXTRACT_OPTIONS)
+                elif info.isreg():
+                    shutil.copyfileobj(tar.extractfile(info), output, CHUNK_SIZE)
+                count += info.isreg()
+        return count
+
+    def cat(self, archive, member, output):
+        """Write the data of a member to a binary file object. With a valid index only the gzip members that
+        hold the data are decompressed, otherwise the archive is read from the start until the member is found.
+        The last version of a file in an incremental archive is read from the layer that has it, files removed
+        by a layer are not found.
+        """
+        manifest = ArchiveManifest(archive)
+        if os.path.exists(manifest.path) and manifest.load():
+            entry = manifest.entries.get(member)
+            if entry is None:
+                return False
+            archive = os.path.join(os.path.dirname(archive), manifest.layers[entry["layer"]]["file"])
+
+        tar_index = TgzIndex.load(archive)
+        if tar_index is not None:
+            if member not in tar_index:
+                return False
+            tar_index.read(archive, member, output)
+            return True
+
+        with open_stream(archive) as tar:
+            for info in tar:
+                if info.name == member and info.isreg():
+                    shutil.copyfileobj(tar.extractfile(info), output, CHUNK_SIZE)
+                    return True
+        return False
+
+    @contextlib.contextmanager
+    def _writer(self, dest, workers=None, block_size=None, index=None, level=9):
+        """Open a tar file to write a tar.gz compressed in parallel, the file is removed on errors. If 'index' is
+        given, the checkpoints and the members written are added to it.
+        """
+        try:
+            with open(dest, "wb") as f:
+                with ParallelGzipWriter(f, workers, block_size or DEFAULT_BLOCK_SIZE, level) as gz:
+                    with IndexingTarFile.open(fileobj=gz, mode="w|") as tar:
+                        yield tar
+        except BaseException:
+            if os.path.exists(dest):
+                os.remove(dest)
+            raise
+
+        if index is not None:
+            for compressed, uncompressed in gz.checkpoints:
+                index.add_checkpoint(compressed, uncompressed)
+            for name, offset, size in tar.data_offsets:
+                index.add_member(name, offset, size)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""Random access to tar.gz archives: a sidecar index (archive.index) keeps checkpoints where decompression can
+start, pairs of (compressed offset, uncompressed offset), and the offset and size of the data of every member.
+
+zlib can't resume inflating a deflate stream in the middle of a byte (there is no inflatePrime in python), so the
+checkpoints are the starts of the gzip members. Archives written by ParallelGzipWriter have a member every block,
+archives made by other tools usually have a single member, the index still works for them but every read
+decompresses from the start of the archive.
+"""
+__author__ = "jmrbcu"
+import os
+import sys
+import zlib
+import array
+import bisect
+import struct
+import hashlib
+import tarfile
+import contextlib
+
+CHUNK_SIZE = 64 * 1024
+
+# bytes hashed at the start, the middle and the end of the archive to recognize it
+SAMPLE_SIZE = 64 * 1024
+
+
+def index_path(archive):
+    return archive + ".index"
+
+
+def signature(archive):
+    """Return the size of a file and the sha256 of some samples of it, enough to tell a file from a different
+    version of it without reading it all.
+    """
+    size = os.path.getsize(archive)
+    digest = hashlib.sha256(str(size).encode("ascii"))
+    with open(archive, "rb") as f:
+        for offset in sorted(set([0, max(0, size // 2 - SAMPLE_SIZE // 2), max(0, size - SAMPLE_SIZE)])):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_SIZE))
+    return size, digest.digest()
+
+
+def inflate(fileobj, on_member=None):
+    """Decompress the gzip members read from a file object, from its current position, yielding chunks of at
+    most CHUNK_SIZE bytes.
+
+    :param on_member: Called with (compressed offset, uncompressed offset) at the start of every member, offsets
+        relative to the initial position.
+    """
+    read = produced = 0
+    data = fileobj.read(CHUNK_SIZE)
+    read += len(data)
+    while data:
+        if on_member is not None:
+            # 'data' is the input not decompressed yet
+            on_member(read - len(data), produced)
+        decompressor = zlib.decompressobj(31)
+        while True:
+            chunk = decompressor.decompress(data, CHUNK_SIZE)
+            if chunk:
+                produced += len(chunk)
+                yield chunk
+            if _finished(decompressor):
+                break
+            if decompressor.unconsumed_tail:
+                data = decompressor.unconsumed_tail
+                continue
+            data = fileobj.read(CHUNK_SIZE)
+            read += len(data)
+            if not data:
+                chunk = decompressor.flush()
+                if chunk:
+                    produced += len(chunk)
+                    yield chunk
+                if not getattr(decompressor, "eof", True):
+                    raise zlib.error("Truncated gzip member")
+                break
+
+        data = decompressor.unused_data
+        if not data:
+            data = fileobj.read(CHUNK_SIZE)
+            read += len(data)
+        if data and not data.startswith(b"\x1f\x8b"):
+            # trailing garbage (e.g. zero padding), gzip ignores it too
+            break
+
+
+def _finished(decompressor):
+    # python 2 has no "eof", the end of a member is noticed when there is data after it (or no more input)
+    return getattr(decompressor, "eof", bool(decompressor.unused_data))
+
+
+class _InflateReader(object):
+    """Read only file object over the decompressed data of the gzip members of a file."""
+
+    def __init__(self, fileobj, on_member=None):
+        self._chunks = inflate(fileobj, on_member)
+        self._buffer = bytearray()
+        self._position = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) - self._position < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            del self._buffer[:self._position]
+            self._position = 0
+            self._buffer += chunk
+        end = len(self._buffer) if size < 0 else min(len(self._buffer), self._position + size)
+        data = bytes(self._buffer[self._position:end])
+        self._position = end
+        return data
+
+
+@contextlib.contextmanager
+def open_stream(archive):
+    """Open a tar.gz archive to read it sequentially, like tarfile mode "r|gz". tarfile stops at the end of the
+    first gzip member in that mode, so it can't read the archives written by ParallelGzipWriter.
+    """
+    with open(archive, "rb") as f:
+        with tarfile.open(fileobj=_InflateReader(f), mode="r|") as tar:
+            yield tar
+
+
+def _uint64_typecode():
+    # python 2 has no "Q", "L" has 8 bytes there on 64 bit unix
+    for typecode in ("Q", "L"):
+        try:
+            if array.array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    raise ImportError("No array type of 8 bytes")
+
+
+_UINT64 = _uint64_typecode()
+
+
+def _uint64(values=()):
+    return array.array(_UINT64, values)
+
+
+def _tobytes(values):
+    if sys.byteorder != "little":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    # tostring/fromstring: python 2
+    return values.tobytes() if hasattr(values, "tobytes") else values.tostring()
+
+
+def _frombytes(data):
+    values = _uint64()
+    if hasattr(values, "frombytes"):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class IndexingTarFile(tarfile.TarFile):
+    """TarFile that records where the data of every member is in the uncompressed stream, while writing it."""
+
+    def __init__(self, *args, **kwargs):
+        self.data_offsets = []
+        super(IndexingTarFile, self).__init__(*args, **kwargs)
+
+    def addfile(self, tarinfo, fileobj=None):
+        super(IndexingTarFile, self).addfile(tarinfo, fileobj)
+        if tarinfo.isreg():
+            # the data is padded to a whole number of blocks and ends at the current offset
+            padded = -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE if fileobj is not None else 0
+            self.data_offsets.append((tarinfo.name, self.offset - padded, tarinfo.size))
+
+
+class TgzIndex(object):
+    """Sidecar random access index of a tar.gz archive. The index is a small binary file loaded with a few reads,
+    it is only valid for the archive it was built from: same size and same content samples, see: signature.
+    """
+
+    magic = b"TGZI"
+    version = 1
+    _header = struct.Struct("<4sIQ32sQQQ")
+
+    def __init__(self, interval=0):
+        """
+        :param interval: Minimum uncompressed distance between checkpoints, 0 keeps a checkpoint at every
+            gzip member.
+        """
+        self.interval = interval
+        self.size = 0
+        self.digest = b""
+        self.compressed = _uint64()
+        self.uncompressed = _uint64()
+        self.names = []
+        self.offsets = _uint64()
+        self.sizes = _uint64()
+        self._members = None
+
+    def add_checkpoint(self, compressed, uncompressed):
+        if not self.uncompressed or uncompressed >= self.uncompressed[-1] + max(self.interval, 1):
+            self.compressed.append(compressed)
+            self.uncompressed.append(uncompressed)
+
+    def add_member(self, name, offset, size):
+        self.names.append(name)
+        self.offsets.append(offset)
+        self.sizes.append(size)
+        self._members = None
+
+    @classmethod
+    def build(cls, archive, interval=0):
+        """Build the index of an existing tar.gz archive, it is decompressed once."""
+        index = cls(interval)
+        with open(archive, "rb") as f:
+            with tarfile.open(fileobj=_InflateReader(f, index.add_checkpoint), mode="r|") as tar:
+                for info in tar:
+                    if info.isreg():
+                        index.add_member(info.name, info.offset_data, info.size)
+        return index
+
+    @classmethod
+    def load(cls, archive):
+        """Load the index of an archive, return None if there is no valid index for it."""
+        try:
+            with open(index_path(archive), "rb") as f:
+                header = f.read(cls._header.size)
+                if len(header) != cls._header.size:
+                    return None
+                magic, version, size, digest, interval, checkpoints, members = cls._header.unpack(header)
+                if magic != cls.magic or version != cls.version or (size, digest) != signature(archive):
+                    return None
+
+                index = cls(interval)
+                index.size, index.digest = size, digest
+                index.compressed = _frombytes(f.read(8 * checkpoints))
+                index.uncompressed = _frombytes(f.read(8 * checkpoints))
+                index.offsets = _frombytes(f.read(8 * members))
+                index.sizes = _frombytes(f.read(8 * members))
+                index.names = f.read().decode("utf-8").split("\0") if members else []
+        except (IOError, OSError, ValueError):
+            return None
+
+        if len(index.uncompressed) != checkpoints or len(index.sizes) != members or len(index.names) != members:
+            return None
+        return index
+
+    def save(self, archive):
+        """Write the index next to the archive, it is bound to the archive as it is now."""
+        self.size, self.digest = signature(archive)
+        path = index_path(archive)
+        tmp = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(self._header.pack(
+                self.magic, self.version, self.size, self.digest, self.interval, len(self.compressed), len(self.names)
+            ))
+            for values in (self.compressed, self.uncompressed, self.offsets, self.sizes):
+                f.write(_tobytes(values))
+            f.write("\0".join(self.names).encode("utf-8"))
+        getattr(os, "replace", os.rename)(tmp, path)
+
+    def __contains__(self, name):
+        return name in self.members
+
+    @property
+    def members(self):
+        """dict(name -> position in the member table), the last member wins if a name is repeated, like tar."""
+        if self._members is None:
+            self._members = dict((name, i) for i, name in enumerate(self.names))
+        return self._members
+
+    def read(self, archive, name, output):
+        """Write the data of a member to a binary file object, decompressing from the nearest checkpoint.
+
+        :returns: Bytes written.
+        """
+        i = self.members[name]
+        offset, remaining = self.offsets[i], self.sizes[i]
+        checkpoint = max(0, bisect.bisect_right(self.uncompressed, offset) - 1)
+        skip = offset - self.uncompressed[checkpoint] if self.uncompressed else offset
+
+        with open(archive, "rb") as f:
+            f.seek(self.compressed[checkpoint] if self.compressed else 0)
+            for chunk in inflate(f):
+                if not remaining:
+                    break
+                if skip >= len(chunk):
+                    skip -= len(chunk)
+                    continue
+                chunk = chunk[skip:skip + remaining]
+                skip = 0
+                output.write(chunk)
+                remaining -= len(chunk)
+
+        if remaining:
+            raise tarfile.ReadError("Unexpected end of data: {0}".format(name))
+        return self.sizes[i]
@@ -4,8 +4,35 @@ try:
     import pathlib
 except:
     import pathlib2 as pathlib
+import os
+import time
+import errno
+import shutil
+import zipfile
+import threading
+import multiprocessing
 from zipfile import ZipFile
+from concurrent.futures import ThreadPoolExecutor
 from basic.archiver import Archiver
+from .incremental import CHUNK_SIZE, ArchiveManifest, HashingReader, Report, scan, copy_zip_member, member_ends
+
+
+def _zip_info(path, name):
+    """Return the ZipInfo of a file like ZipInfo.from_file, which is not available before python 3.6."""
+    st = os.stat(path)
+    date_time = time.localtime(st.st_mtime)[:6]
+    if date_time[0] < 1980:
+        # zip can't store older dates
+        date_time = (1980, 1, 1, 0, 0, 0)
+    info = zipfile.ZipInfo(name, date_time)
+    info.external_attr = (st.st_mode & 0xFFFF) << 16
+    info.file_size = st.st_size
+    return info
+
+
+def _is_dir(info):
+    # ZipInfo.is_dir is not available before python 3.6
+    return info.filename.endswith("/")
 
 
 class ZipArchiver(Archiver):
@@ -14,9 +41,142 @@ class ZipArchiver(Archiver):
         super(ZipArchiver, self).__init__()
         self.file_type = "zip"
 
-    def compress(self, filename):
+    def compress(self, filename, incremental=False, **options):
+        """Create filename.zip.
+
+        :param incremental: Only write the files that changed since the last incremental compress,
+            see: compress_incremental
+        """
         dest = str(pathlib.Path(filename).with_suffix(".zip"))
+        if incremental:
+            return self.compress_incremental(filename, dest)
+
         with ZipFile(dest, "w") as zip:
             zip.write(str(filename))
         return True
 
+    def compress_incremental(self, filename, dest):
+        """Add the regular files in 'filename' (a file or a directory tree) to a zip file, writing only the
+        files that changed since the last run according to the sidecar manifest of the archive. New files
+        are appended to the archive. If files were modified or removed the archive is rewritten, copying the
+        compressed data of the unchanged members instead of reading the files again.
+
+        :returns: Report
+        """
+        report = Report(dest)
+        files = scan(filename)
+        manifest = ArchiveManifest(dest)
+        loaded = os.path.exists(dest) and manifest.load()
+        if loaded:
+            added, modified, removed = manifest.plan(files, report)
+        else:
+            added, modified, removed = sorted(files), [], []
+            report["rebuilt"] = True
+
+        if loaded and not modified and not removed:
+            if added:
+                with ZipFile(dest, "a") as target:
+                    start = target.start_dir
+                    for name in added:
+                        self._write(target, name, files[name], manifest, report)
+                report["bytes_written"] += os.path.getsize(dest) - start
+        else:
+            tmp = "{0}.{1}.tmp".format(dest, os.getpid())
+            try:
+                with ZipFile(tmp, "w") as target:
+                    if loaded:
+                        with ZipFile(dest) as source:
+                            ends = member_ends(source)
+                            for info in source.infolist():
+                                if info.filename in files and info.filename not in modified:
+                                    report["bytes_read"] += copy_zip_member(source, target, info, ends[info.filename])
+                    for name in modified + added:
+                        self._write(target, name, files[name], manifest, report)
+                getattr(os, "replace", os.rename)(tmp, dest)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            report["bytes_written"] += os.path.getsize(dest)
+
+        for name in removed:
+            del manifest.entries[name]
+        report.update(added=len(added), modified=len(modified), removed=len(removed))
+        manifest.layers = []
+        manifest.add_layer(dest)
+        manifest.save()
+        return report
+
+    def extract(self, archive, dest=".", members=None, output=None, workers=None, **options):
+        """Extract the members of a zip file. Members are compressed independently, so they are extracted
+        concurrently by a pool of threads, every thread with its own handle of the archive (zlib releases the GIL).
+        Writing to 'output' is sequential, in archive order. See: Archiver.extract
+
+        :param workers: Number of extraction threads, all cpus by default.
+        """
+        with ZipFile(archive) as source:
+            infos = source.infolist()
+            if members:
+                wanted = set(members)
+                infos = [info for info in infos if info.filename in wanted]
+
+            if output is not None:
+                files = [info for info in infos if not _is_dir(info)]
+                for info in files:
+                    with source.open(info) as data:
+                        shutil.copyfileobj(data, output, CHUNK_SIZE)
+                return len(files)
+
+        local = threading.local()
+        handles = []
+        lock = threading.Lock()
+
+        def extract_member(info):
+            handle = getattr(local, "handle", None)
+            if handle is None:
+                handle = local.handle = ZipFile(archive)
+                with lock:
+                    handles.append(handle)
+            try:
+                handle.extract(info.filename, dest)
+            except OSError as e:
+                # another thread created the same parent directory at the same time
+                if e.errno != errno.EEXIST:
+                    raise
+                handle.extract(info.filename, dest)
+
+        workers = workers or getattr(os, "cpu_count", multiprocessing.cpu_count)() or 1
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for _ in executor.map(extract_member, infos):
+                    pass
+        finally:
+            for handle in handles:
+                handle.close()
+        return len([info for info in infos if not _is_dir(info)])
+
+    def cat(self, archive, member, output):
+        """Write the data of a member to a binary file object, zip members can be read directly."""
+        with ZipFile(archive) as source:
+            try:
+                info = source.getinfo(member)
+            except KeyError:
+                return False
+            with source.open(info) as data:
+                shutil.copyfileobj(data, output, CHUNK_SIZE)
+        return True
+
+    def _write(self, target, name, entry, manifest, report):
+        path, size, mtime = entry
+        info = _zip_info(path, name)
+        info.compress_type = target.compression
+        with open(path, "rb") as f:
+            reader = HashingReader(f)
+            if hasattr(zipfile.ZipFile, "_open_to_write"):
+                with target.open(info, "w") as member:
+                    shutil.copyfileobj(reader, member, CHUNK_SIZE)
+            else:
+                # members can't be written as a stream before python 3.6, the file is read in memory
+                target.writestr(info, reader.read())
+        report["bytes_read"] += reader.bytes_read
+        manifest.put(name, size, mtime, reader.hexdigest())
@@ -7,5 +7,35 @@ class Archiver(object):
     def __init__(self):
         self.file_type = None
 
-    def compress(self, filename):
-        pass
\ No newline at end of file
+    def compress(self, filename, **options):
+        """Compress a file. Options are archiver specific (e.g. workers, block_size), archivers ignore the
+        options they don't support.
+        """
+        pass
+
+    def extract(self, archive, dest=".", members=None, output=None, **options):
+        """Extract the members of an archive reading it as a stream, the memory used doesn't depend on the size of
+        the files. Options are archiver specific (e.g. workers), archivers ignore the options they don't support.
+
+        :param dest: Directory where the files are extracted.
+        :param members: Names of the members to extract, all by default.
+        :param output: Binary file object (e.g. stdout) where the data of the files is written one after another,
+            instead of creating files in 'dest'.
+
+        :returns: Number of files extracted, None if the archiver can't extract archives.
+        """
+        return None
+
+    def cat(self, archive, member, output):
+        """Write the data of a member of an archive to a binary file object.
+
+        :returns: False if the member is not in the archive or the archiver can't read archives.
+        """
+        return False
+
+    def build_index(self, archive, **options):
+        """Build a sidecar index to read members of an archive without reading it all, if the format needs one.
+
+        :returns: Number of members indexed, None if the archiver doesn't use indexes.
+        """
+        return None
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Disk usage of directory trees. Directories are scanned in parallel and the usage of the files directly in
+every directory can be kept in a persistent cache, keyed by the inode and modification time of the directory.
+A directory whose modification time didn't change is not listed again on the next run.
+
+The modification time of a directory changes when entries are created, removed or renamed in it, not when a file
+in it is rewritten in place, or when something changes deeper in the tree. So every directory is still checked
+(one stat call) on every run, and a file that only changed size is not noticed until its directory changes
+(or the cache is refreshed).
+"""
+__author__ = "jmrbcu"
+import os
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import walk
+
+# usage of a directory and everything below it
+DiskUsage = namedtuple("DiskUsage", "path size files directories")
+
+
+def usage(st, apparent=False):
+    """Space used by a file: the allocated blocks like du, or its size if 'apparent'."""
+    if apparent or not hasattr(st, "st_blocks"):
+        return st.st_size
+    return st.st_blocks * 512
+
+
+class UsageCache(object):
+    """Persistent cache with the usage of the files directly in every directory measured, a json file.
+    Entries: directory path -> [inode, mtime_ns, apparent size, allocated size, files, subdirectory names]
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.directories = {}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        if data.get("version") != self.version:
+            return False
+        self.directories = data["directories"]
+        return True
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({"version": self.version, "directories": self.directories}, f)
+        getattr(os, "replace", os.rename)(tmp, self.path)
+
+    def replace(self, root, directories):
+        """Replace the entries of the tree in 'root' (removed directories included) with new ones."""
+        prefix = root.rstrip(os.sep) + os.sep
+        for path in [path for path in self.directories if path == root or path.startswith(prefix)]:
+            del self.directories[path]
+        self.directories.update(directories)
+
+
+def _stat_key(st):
+    return [st.st_ino, getattr(st, "st_mtime_ns", int(st.st_mtime * 1e9))]
+
+
+def _depth(path):
+    """Number of components of an absolute path, 0 for the root directory."""
+    return len([part for part in path.split(os.sep) if part])
+
+
+def _measure_directory(path, cached):
+    """Return the cache entry of a directory, the cached one if the directory didn't change, and whether
+    it was listed.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None, False
+    # taken before listing the directory: if it changes while it's listed, the next run lists it again
+    key = _stat_key(st)
+    entry = cached.get(path)
+    if entry is not None and entry[:2] == key:
+        return entry, False
+
+    apparent, allocated, files, subdirectories, errors = st.st_size, usage(st), 0, [], []
+    for batch in walk.scan(path, onerror=errors.append):
+        for dir_entry in batch:
+            if walk.is_dir(dir_entry):
+                subdirectories.append(dir_entry.name)
+                continue
+            try:
+                entry_st = dir_entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            apparent += entry_st.st_size
+            allocated += usage(entry_st)
+            files += 1
+
+    if errors:
+        # unreadable directory, never reused from the cache
+        key = [None, None]
+    return key + [apparent, allocated, files, sorted(subdirectories)], True
+
+
+def measure(root, workers=8, cache=None, apparent=False, max_depth=None):
+    """Measure the disk usage of a directory tree, see: FileSystemManager.disk_usage
+
+    :returns: (list(DiskUsage), directories listed, directories reused from the cache)
+    """
+    root = os.path.abspath(root)
+    if not os.path.isdir(root) or os.path.islink(root):
+        st = os.lstat(root)
+        return [DiskUsage(root, usage(st, apparent), 1, 0)], 0, 0
+
+    cached = cache.directories if cache is not None else {}
+    entries = {}
+    listed = reused = 0
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        pending = {executor.submit(_measure_directory, root, cached): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                entry, was_listed = future.result()
+                if entry is None:
+                    continue
+                entries[path] = entry
+                listed += was_listed
+                reused += not was_listed
+                for name in entry[5]:
+                    child = os.path.join(path, name)
+                    pending[executor.submit(_measure_directory, child, cached)] = child
+    finally:
+        executor.shutdown()
+
+    if cache is not None:
+        cache.replace(root, entries)
+
+    # totals, children before parents
+    size_index = 2 if apparent else 3
+    totals = {}
+    for path in sorted(entries, key=_depth, reverse=True):
+        entry = entries[path]
+        size, files, directories = entry[size_index], entry[4], 0
+        for name in entry[5]:
+            child = totals.get(os.path.join(path, name))
+            if child is not None:
+                size, files, directories = size + child[0], files + child[1], directories + child[2] + 1
+        totals[path] = (size, files, directories)
+
+    # report in du order: every directory after its subdirectories
+    depth = _depth(root)
+    result, stack = [], [(root, False)]
+    while stack:
+        path, expanded = stack.pop()
+        if expanded:
+            result.append(DiskUsage(path, *totals[path]))
+            continue
+        stack.append((path, True))
+        if max_depth is None or _depth(path) - depth < max_depth:
+            for name in reversed(entries[path][5]):
+                child = os.path.join(path, name)
+                if child in totals:
+                    stack.append((child, False))
+    return result, listed, reused
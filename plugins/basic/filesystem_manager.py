@@ -4,19 +4,473 @@ try:
     import pathlib
 except:
     import pathlib2 as pathlib
+import os
+import sys
+import site
+import errno
+import glob
+import time
+import logging
+import zipfile
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import walk
+
+logger = logging.getLogger(__name__)
+
+# result of every file compressed by: FileSystemManager.compress_batch
+CompressResult = namedtuple("CompressResult", "filename ok error size seconds")
+
+# result of every path of a bulk operation, see: FileSystemManager.touch_many
+OperationResult = namedtuple("OperationResult", "path ok error")
+
+# threads of the bulk operations, they mostly wait for the filesystem so many requests are kept in flight
+BULK_WORKERS = 32
+
+# cache of: FileSystemManager.disk_usage
+DISK_USAGE_CACHE = pathlib.Path("~/.cache/fstool/disk_usage.json").expanduser()
+
+
+def _import_path(obj):
+    """Return the sys.path entry needed to import the module of an object, e.g. the plugin search path, or
+    None if another process can't import it from there (e.g. it was imported from a plugin bundle).
+    """
+    module = sys.modules[type(obj).__module__]
+    path = getattr(module, "__file__", None)
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    for _ in range(type(obj).__module__.count(".") + 1):
+        path = os.path.dirname(path)
+    if os.path.isdir(path) or zipfile.is_zipfile(path):
+        return path
+    return None
+
+
+def _forks():
+    """Return True if worker processes are forked from this one, so they inherit its modules."""
+    get_start_method = getattr(multiprocessing, "get_start_method", None)
+    if get_start_method is None:
+        # python 2: always forks, except on windows
+        return os.name == "posix"
+    return get_start_method() == "fork"
+
+
+def _compress(archiver, filename, options):
+    start = time.time()
+    ok = archiver.compress(filename, **options)
+    return ok, time.time() - start
+
+
+def expand_paths(patterns, unmatched=None):
+    """Yield the paths matching some paths or glob patterns ("**" matches subdirectories), lazily.
+
+    :param unmatched: Called with every glob pattern that matches nothing.
+    """
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        if glob.has_magic(pattern):
+            matched = False
+            for path in _iglob(pattern):
+                matched = True
+                yield path
+            if not matched and unmatched is not None:
+                unmatched(pattern)
+        else:
+            yield pattern
+
+
+def _unmatched(errors):
+    """Return a function that adds an error result to 'errors' for every glob pattern matching nothing, like rm."""
+    def unmatched(pattern):
+        errors.append(OperationResult(pattern, False, os.strerror(errno.ENOENT)))
+    return unmatched
+
+
+def _iglob(pattern):
+    try:
+        return glob.iglob(pattern, recursive=True)
+    except TypeError:
+        # python 2: no recursive patterns
+        return _iglob_recursive(pattern)
+
+
+def _iglob_recursive(pattern):
+    """glob.iglob with "**" matching any number of subdirectories, hidden ones excluded, like python 3."""
+    parts = pattern.split(os.sep)
+    if "**" not in parts:
+        for path in glob.iglob(pattern):
+            yield path
+        return
+
+    i = parts.index("**")
+    head, rest = os.sep.join(parts[:i]), os.sep.join(parts[i + 1:])
+    if i == 1 and not head:
+        head = os.sep
+    for base in (glob.iglob(head) if glob.has_magic(head) else [head]):
+        if not os.path.isdir(base or os.curdir):
+            continue
+        for root, dirs, files in os.walk(base or os.curdir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            relroot = os.path.relpath(root, base or os.curdir)
+            directory = base if relroot == os.curdir else os.path.join(base, relroot)
+            if rest:
+                for path in _iglob_recursive(os.path.join(directory, rest)):
+                    yield path
+            else:
+                # "**" at the end also matches the files
+                if relroot != os.curdir:
+                    yield directory
+                elif base:
+                    yield os.path.join(base, "")
+                for name in sorted(f for f in files if not f.startswith(".")):
+                    yield os.path.join(directory, name)
+
+
+def _apply(operation, path):
+    try:
+        operation(path)
+    except Exception as e:
+        return OperationResult(path, False, str(e) or type(e).__name__)
+    return OperationResult(path, True, None)
+
+
+def _mkdir_parents(path):
+    try:
+        os.makedirs(path)
+    except OSError:
+        # created by another thread or already there
+        if not os.path.isdir(path):
+            raise
+
+
+def _touch(path):
+    pathlib.Path(path).touch()
+
+
+def run_bulk(operation, paths, workers=BULK_WORKERS, dry_run=False):
+    """Apply an operation to many paths on a bounded thread pool. Errors are collected per path instead of
+    stopping the operation. Paths are consumed lazily, at most a few per thread are waiting to run.
+
+    :param operation: Function called with every path.
+    :param dry_run: Do nothing, every path succeeds.
+
+    :returns: iterator(OperationResult) in completion order.
+    """
+    if dry_run:
+        for path in paths:
+            yield OperationResult(path, True, None)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = set()
+    try:
+        for path in paths:
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(_apply, operation, path))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+def write_report(results, action, dry_run=False):
+    """Write the errors of a bulk operation to stderr (or every path if 'dry_run') and a summary to stdout.
+
+    :returns: Number of errors.
+    """
+    done = failed = 0
+    for result in results:
+        if not result.ok:
+            failed += 1
+            sys.stderr.write("{0}: {1}\n".format(result.path, result.error))
+            continue
+        done += 1
+        if dry_run:
+            sys.stdout.write("would {0}: {1}\n".format(action, result.path))
+
+    sys.stdout.write("{0}{1}: {2} done, {3} failed\n".format("dry run, " if dry_run else "", action, done, failed))
+    return failed
 
 
 class FileSystemManager(object):
 
     def __init__(self, archivers):
-        self.archivers = {archiver.file_type: archiver for archiver in archivers}
+        # extension point with all archivers, indexed by file type
+        self.archivers = archivers
 
-    def compress(self, filename, file_type):
+    def compress(self, filename, file_type, **options):
         filename = str(pathlib.Path(filename).expanduser())
         archiver = self.archivers.get(file_type)
         if not archiver:
             return False
-        return archiver.compress(filename)
+        return archiver.compress(filename, **options)
+
+    def compress_batch(self, filenames, file_type, processes=None, max_memory=None, **options):
+        """Compress many files, one archive per file, in a process pool. Results are yielded as soon as
+        each file is done, in completion order. Filenames are consumed lazily, so they can come from a pipe.
+        If the worker processes can't import the archiver (e.g. it was imported from a plugin bundle and they
+        are not forked from this process), the files are compressed one at a time in this process.
+
+        :param filenames: Paths of the files to compress.
+        :type filenames: iterable(str)
+
+        :param file_type: File type of the archiver.
+        :type file_type: str
+
+        :param processes: Maximum number of files compressed at the same time, all cpus by default.
+        :type processes: int
+
+        :param max_memory: Maximum size in bytes of the files compressed at the same time. A file bigger
+            than the budget is compressed alone.
+        :type max_memory: int
+
+        :param options: Archiver options, "workers" defaults to 1 to not oversubscribe the cpus.
+
+        :returns: iterator(CompressResult)
+        """
+        archiver = self.archivers.get(file_type)
+        if not archiver:
+            raise ValueError("Unknown file type: {0}".format(file_type))
+
+        import_path = _import_path(archiver)
+        if import_path is None and not _forks():
+            # the worker processes can't import the archiver, compress one file at a time in this process and
+            # let the archiver use its own threads
+            logger.debug("Archiver module not importable from other processes, compressing serially")
+            processes = 1
+            executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            processes = processes or getattr(os, "cpu_count", multiprocessing.cpu_count)() or 1
+            options.setdefault("workers", 1)
+            if import_path is None:
+                # forked workers inherit the modules of this process and its import finders (plugin bundles)
+                executor = ProcessPoolExecutor(processes)
+            else:
+                # processes not forked from this one can't import the plugin modules, the initializer must not be
+                # defined in one of them. It runs before any task is unpickled, so it can't be done in _compress
+                try:
+                    executor = ProcessPoolExecutor(processes, initializer=site.addsitedir, initargs=(import_path,))
+                except TypeError:
+                    # python 2 (futures) has no initializer, but plugins are imported through sys.path there, and
+                    # worker processes get the sys.path of this one
+                    executor = ProcessPoolExecutor(processes)
+        pending = {}
+        in_flight = 0
+        try:
+            for filename in filenames:
+                filename = os.path.abspath(os.path.expanduser(filename))
+                try:
+                    size = os.path.getsize(filename)
+                except OSError as e:
+                    yield CompressResult(filename, False, str(e), 0, 0.0)
+                    continue
+
+                while pending and (len(pending) >= processes or max_memory and in_flight + size > max_memory):
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = self._batch_result(future, *pending.pop(future))
+                        in_flight -= result.size
+                        yield result
+
+                pending[executor.submit(_compress, archiver, filename, options)] = (filename, size)
+                in_flight += size
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield self._batch_result(future, *pending.pop(future))
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+
+    def _batch_result(self, future, filename, size):
+        error = future.exception()
+        if error is not None:
+            return CompressResult(filename, False, str(error) or type(error).__name__, size, 0.0)
+        ok, seconds = future.result()
+        return CompressResult(filename, bool(ok), None if ok else "archiver failed", size, seconds)
+
+    def archiver_for(self, archive):
+        """Return the archiver of an archive according to its file extension, None if there is no archiver."""
+        # longest file type first, e.g. "tar.gz" before "gz"
+        parts = os.path.basename(archive).split(".")
+        for i in range(1, len(parts)):
+            archiver = self.archivers.get(".".join(parts[i:]))
+            if archiver:
+                return archiver
+        return None
+
+    def extract(self, archive, dest=".", members=None, output=None, **options):
+        """Extract the members of an archive, see: Archiver.extract
+
+        :returns: Number of files extracted, None if there is no archiver for the archive.
+        """
+        archiver = self.archiver_for(archive)
+        if not archiver:
+            return None
+        archive = str(pathlib.Path(archive).expanduser())
+        dest = str(pathlib.Path(dest).expanduser())
+        count = archiver.extract(archive, dest, members, output, **options)
+        if output is not None:
+            output.flush()
+        return count
+
+    def cat(self, archive, member, output=None):
+        """Write the data of a member of an archive to a binary file object, stdout by default.
+
+        :returns: False if the member is not in the archive or there is no archiver for it.
+        """
+        archiver = self.archiver_for(archive)
+        if not archiver:
+            return False
+        if output is None:
+            output = getattr(sys.stdout, "buffer", sys.stdout)
+        archive = str(pathlib.Path(archive).expanduser())
+        ok = archiver.cat(archive, member, output)
+        output.flush()
+        return ok
+
+    def build_index(self, archive, **options):
+        """Build the sidecar index of an archive, see: Archiver.build_index"""
+        archiver = self.archiver_for(archive)
+        if not archiver:
+            raise ValueError("Unknown archive type: {0}".format(archive))
+        return archiver.build_index(str(pathlib.Path(archive).expanduser()), **options)
+
+    def disk_usage(self, path, workers=8, cache=False, refresh=False, apparent=False, max_depth=None):
+        """Measure the space used by a directory tree, like du. Subdirectories are scanned in parallel.
+
+        :param path: Directory or file to measure.
+        :type path: str
+
+        :param workers: Number of threads listing directories.
+        :type workers: int
+
+        :param cache: Keep the usage of every directory in a persistent cache (True for the default location or
+            the path of the cache file). On the next run only the directories whose modification time changed
+            are listed again, see: disk_usage module for what is not noticed.
+        :type cache: bool or str
+
+        :param refresh: List all directories again and update the cache.
+        :type refresh: bool
+
+        :param apparent: Count the size of the files instead of the allocated blocks.
+        :type apparent: bool
+
+        :param max_depth: Only report the directories up to this depth below 'path', all are measured anyway.
+        :type max_depth: int
+
+        :returns: list(DiskUsage), every directory after its subdirectories and 'path' last.
+        """
+        from .disk_usage import DiskUsage, UsageCache, measure
+
+        usage_cache = None
+        if cache:
+            usage_cache = UsageCache(str(DISK_USAGE_CACHE) if cache is True else str(cache))
+            if not refresh:
+                usage_cache.load()
+
+        # without trailing separators, so the paths of the subdirectories have a single one
+        path = os.path.normpath(os.path.expanduser(path))
+        result, listed, reused = measure(path, workers, usage_cache, apparent, max_depth)
+        logger.debug("Disk usage of: %s, %d directories listed, %d from the cache", path, listed, reused)
+        if usage_cache is not None:
+            usage_cache.save()
+
+        # report the paths as they were given
+        root = os.path.abspath(path)
+        return [DiskUsage(path + usage.path[len(root):], *usage[1:]) for usage in result]
+
+    def touch_many(self, paths, workers=BULK_WORKERS, dry_run=False):
+        """Create files or update their modification time, see: run_bulk
+
+        :param paths: Paths or glob patterns, a pattern only matches existing files.
+        :type paths: iterable(str)
+
+        :returns: iterator(OperationResult), patterns matching nothing are errors.
+        """
+        errors = []
+        for result in run_bulk(_touch, expand_paths(paths, _unmatched(errors)), workers, dry_run):
+            yield result
+        for error in errors:
+            yield error
+
+    def mkdir_many(self, paths, parents=False, workers=BULK_WORKERS, dry_run=False):
+        """Create directories, see: run_bulk
+
+        :param parents: Create the missing parent directories and don't fail if a directory exists, like mkdir -p
+        :type parents: bool
+
+        :returns: iterator(OperationResult)
+        """
+        paths = (os.path.expanduser(path) for path in paths)
+        return run_bulk(_mkdir_parents if parents else os.mkdir, paths, workers, dry_run)
+
+    def rmdir_many(self, paths, workers=BULK_WORKERS, dry_run=False):
+        """Remove empty directories, see: run_bulk
+
+        :param paths: Paths or glob patterns.
+        :type paths: iterable(str)
+
+        :returns: iterator(OperationResult), patterns matching nothing are errors.
+        """
+        errors = []
+        for result in run_bulk(os.rmdir, expand_paths(paths, _unmatched(errors)), workers, dry_run):
+            yield result
+        for error in errors:
+            yield error
+
+    def remove_many(self, paths, recursive=False, workers=BULK_WORKERS, dry_run=False):
+        """Remove files, and directory trees if 'recursive', see: run_bulk. The files of all trees are removed
+        concurrently while the trees are listed (see: walk), then the directories, the deepest ones first.
+
+        :param paths: Paths or glob patterns.
+        :type paths: iterable(str)
+
+        :returns: iterator(OperationResult), one per file and directory, patterns matching nothing are errors.
+        """
+        directories = []
+        errors = []
+
+        def onerror(e):
+            errors.append(OperationResult(e.filename, False, e.strerror or str(e)))
+
+        def files():
+            for path in expand_paths(paths, _unmatched(errors)):
+                if recursive and os.path.isdir(path) and not os.path.islink(path):
+                    directories.append(path)
+                    for batch in walk.walk(path, True, min(workers, 8), onerror):
+                        for entry in batch:
+                            if walk.is_dir(entry):
+                                directories.append(entry.path)
+                            else:
+                                yield entry.path
+                else:
+                    yield path
+
+        for result in run_bulk(os.unlink, files(), workers, dry_run):
+            yield result
+        for error in errors:
+            yield error
+
+        # a directory can only be removed after its subdirectories, so one level at a time
+        levels = {}
+        for path in directories:
+            levels.setdefault(path.rstrip(os.sep).count(os.sep), []).append(path)
+        for depth in sorted(levels, reverse=True):
+            for result in run_bulk(os.rmdir, levels[depth], workers, dry_run):
+                yield result
 
     def touch(self, filename):
         pathlib.Path(filename).expanduser().touch()
@@ -29,4 +483,3 @@ class FileSystemManager(object):
 
     def rmdir(self, options):
         pathlib.Path(options.path).rmdir()
-
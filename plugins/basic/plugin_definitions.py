@@ -1,11 +1,21 @@
 # -*- coding: utf-8 -*-
 __author__ = "jmrbcu"
+import sys
 import logging
 from plugin_manager import Plugin, ExtensionPoint, extends
 
 logger = logging.getLogger(__name__)
 
 
+def size(value):
+    """Parse a size in bytes with an optional K, M or G suffix, e.g. 512K"""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    value = value.strip().upper()
+    if value[-1:] in units:
+        return int(value[:-1]) * units[value[-1]]
+    return int(value)
+
+
 class BasicPlugin(Plugin):
 
     id = "basic"
@@ -19,27 +29,185 @@ class BasicPlugin(Plugin):
     enabled = True
 
     # other plugins can add archivers extending this extension point, look at plugin: 'archiver' for an example
-    archivers = ExtensionPoint("archivers")
+    # archivers are indexed by file type, so they can be looked up with: archivers[file_type]
+    archivers = ExtensionPoint("archivers", key="file_type")
 
     @extends("application.arguments")
     def _commands(self):
         from args import Command, Argument
-
-        filesystem_manager = self.plugin_manager.get_service("filesystem_manager")
+        from .filesystem_manager import BULK_WORKERS
 
         return [
-            Command("touch", lambda o: filesystem_manager.touch(o.filename), "create a new file", (
-                Argument("filename", help="path to the filename"),
+            Command("touch", self._touch, "create files or update their modification time", (
+                Argument("paths", nargs="+", help="files or glob patterns"),
+                Argument("--workers", type=int, default=BULK_WORKERS, help="files touched at the same time"),
+                Argument("--dry-run", action="store_true", help="only show what would be done"),
             )),
-            Command("remove", lambda o: filesystem_manager.remove(o.filename), "removes a file", (
-                Argument("filename", help="path to the filename"),
+            Command("remove", self._remove, "removes files", (
+                Argument("paths", nargs="+", help="files or glob patterns"),
+                Argument("-r", "--recursive", action="store_true", help="remove directories and their contents"),
+                Argument("--workers", type=int, default=BULK_WORKERS, help="files removed at the same time"),
+                Argument("--dry-run", action="store_true", help="only show what would be done"),
             )),
-            Command("compress", lambda o: filesystem_manager.compress(o.filename, o.file_type), "removes a file", (
+            Command("compress", self._compress, "compress a file", (
                 Argument("filename", help="path to the filename"),
                 Argument("file_type", help="file type", choices=[archiver.file_type for archiver in self.archivers]),
+                Argument("--workers", type=int, help="compression threads, if supported by the archiver"),
+                Argument("--block-size", type=size, help="size of the blocks compressed in parallel, e.g. 4M"),
+                Argument("--incremental", action="store_true", help="only write the files changed since the last run"),
+                Argument("--index", action="store_true", help="write a random access index, if supported"),
+                Argument("--index-interval", type=size, help="minimum distance between index checkpoints, e.g. 4M"),
+            )),
+            Command("extract", self._extract, "extract the files of an archive", (
+                Argument("archive", help="path to the archive"),
+                Argument("members", nargs="*", help="names of the files to extract, all by default"),
+                Argument("-C", "--directory", default=".", help="directory where the files are extracted"),
+                Argument("-O", "--stdout", action="store_true", help="write the data of the files to stdout"),
+                Argument("--workers", type=int, help="extraction threads, if supported by the archiver"),
+            )),
+            Command("cat", self._cat, "write a file of an archive to stdout", (
+                Argument("archive", help="path to the archive"),
+                Argument("member", help="name of the file in the archive"),
+            )),
+            Command("index", self._index, "build the random access index of an archive", (
+                Argument("archive", help="path to the archive"),
+                Argument("--interval", type=size, default=0, help="minimum distance between checkpoints, e.g. 4M"),
+            )),
+            Command("compress-batch", self._compress_batch, "compress many files, one archive per file", (
+                Argument("file_type", help="file type", choices=[archiver.file_type for archiver in self.archivers]),
+                Argument("paths", nargs="*", help="files or glob patterns, read from stdin if none is given or '-'"),
+                Argument("-f", "--from-file", help="read the paths from this file, one per line ('-' for stdin)"),
+                Argument("--processes", type=int, help="files compressed at the same time, all cpus by default"),
+                Argument("--max-memory", type=size, help="maximum size of the files compressed at the same time"),
+                Argument("--workers", type=int, help="compression threads per file, if supported by the archiver"),
+                Argument("--block-size", type=size, help="size of the blocks compressed in parallel, e.g. 4M"),
+                Argument("--incremental", action="store_true", help="only write the files changed since the last run"),
             )),
         ]
 
+    def _touch(self, options):
+        from .filesystem_manager import write_report
+
+        filesystem_manager = self.plugin_manager.get_service("filesystem_manager")
+        results = filesystem_manager.touch_many(options.paths, options.workers, options.dry_run)
+        return 1 if write_report(results, "touch", options.dry_run) else None
+
+    def _remove(self, options):
+        from .filesystem_manager import write_report
+
+        filesystem_manager = self.plugin_manager.get_service("filesystem_manager")
+        results = filesystem_manager.remove_many(options.paths, options.recursive, options.workers, options.dry_run)
+        return 1 if write_report(results, "remove", options.dry_run) else None
+
+    def _compress(self, options):
+        filesystem_manager = self.plugin_manager.get_service("filesystem_manager")
+        result = filesystem_manager.compress(
+            options.filename, options.file_type, workers=options.workers, block_size=options.block_size,
+            incremental=options.incremental, index=options.index, index_interval=options.index_interval or 0
+        )
+        if not result:
+            sys.stderr.write("{0}: unknown file type: {1}\n".format(options.filename, options.file_type))
+            return 1
+        if isinstance(result, dict):
+            # report of an incremental compress
+            print("{archive}: {added} added, {modified} modified, {unchanged} unchanged, {removed} removed, "
+                  "{bytes_read} bytes read, {bytes_written} bytes written".format(**result))
+        return None
+
+    def _extract(self, options):
+        filesystem_manager = self.plugin_manager.get_service("filesystem_manager")
+        output = getattr(sys.stdout, "buffer", sys.stdout) if options.stdout else None
+        archiver_options = {"workers": options.workers} if options.workers else {}
+        count = filesystem_manager.extract(
+            options.archive, options.directory, options.members, output, **archiver_options
+        )
+        if count is None:
+            sys.stderr.write("{0}: unknown archive type\n".format(options.archive))
+            return 1
+        if options.members and count < len(set(options.members)):
+            sys.stderr.write("{0}: {1} of {2} files not found\n".format(
+                options.archive, len(set(options.members)) - count, len(set(options.members))
+            ))
+            return 1
+        if output is None:
+            print("{0}: {1} files extracted to {2}".format(options.archive, count, options.directory))
+        return None
+
+    def _cat(self, options):
+        filesystem_manager = self.plugin_manager.get_service("filesystem_manager")
+        if not filesystem_manager.cat(options.archive, options.member):
+            sys.stderr.write("{0}: not found in {1}\n".format(options.member, options.archive))
+            return 1
+        return None
+
+    def _index(self, options):
+        filesystem_manager = self.plugin_manager.get_service("filesystem_manager")
+        members = filesystem_manager.build_index(options.archive, interval=options.interval)
+        if members is None:
+            sys.stderr.write("{0}: the archive format doesn't need an index\n".format(options.archive))
+            return 1
+        print("{0}: {1} files indexed".format(options.archive, members))
+        return None
+
+    def _compress_batch(self, options):
+        from .filesystem_manager import expand_paths
+
+        def read_paths(f):
+            for line in f:
+                line = line.rstrip("\n")
+                if line:
+                    yield line
+
+        def patterns():
+            if options.from_file == "-" or (not options.paths and not options.from_file):
+                for path in read_paths(sys.stdin):
+                    yield path
+            elif options.from_file:
+                with open(options.from_file) as f:
+                    for path in read_paths(f):
+                        yield path
+
+            for path in options.paths:
+                if path == "-":
+                    for line in read_paths(sys.stdin):
+                        yield line
+                else:
+                    yield path
+
+        archiver_options = {}
+        if options.workers:
+            archiver_options["workers"] = options.workers
+        if options.block_size:
+            archiver_options["block_size"] = options.block_size
+        if options.incremental:
+            archiver_options["incremental"] = True
+
+        unmatched = []
+
+        def no_match(pattern):
+            unmatched.append(pattern)
+            sys.stderr.write("{0}: No such file or directory\n".format(pattern))
+
+        filesystem_manager = self.plugin_manager.get_service("filesystem_manager")
+        results = filesystem_manager.compress_batch(
+            expand_paths(patterns(), no_match), options.file_type, options.processes, options.max_memory,
+            **archiver_options
+        )
+        done = failed = 0
+        for result in results:
+            done += 1
+            if result.ok:
+                sys.stdout.write("[{0}] ok {1} ({2} bytes, {3:.2f}s)\n".format(
+                    done, result.filename, result.size, result.seconds
+                ))
+            else:
+                failed += 1
+                sys.stdout.write("[{0}] error {1}: {2}\n".format(done, result.filename, result.error))
+            sys.stdout.flush()
+
+        sys.stdout.write("{0} files compressed, {1} failed\n".format(done - failed, failed))
+        return 1 if failed or unmatched else None
+
     def configure(self):
         logger.debug("Running 'configure', this method will be run before enabling the plugin")
 
@@ -52,4 +220,5 @@ class BasicPlugin(Plugin):
         #
         # Here we register a filesystem service instance as a service
         from .filesystem_manager import FileSystemManager
-        self.plugin_manager.register_service("filesystem_manager", FileSystemManager(self.archivers))
+        archivers = self.plugin_manager.get_extension_point("archivers")
+        self.plugin_manager.register_service("filesystem_manager", FileSystemManager(archivers))
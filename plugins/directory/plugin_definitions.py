@@ -4,12 +4,28 @@ try:
     import pathlib
 except:
     import pathlib2 as pathlib
+import sys
+import math
 import logging
 from plugin_manager import Plugin, extends
 
 logger = logging.getLogger(__name__)
 
 
+def human_size(size):
+    """Format a size in bytes with a K, M, G or T suffix, rounded up like du -h"""
+    unit = ""
+    for unit in ("", "K", "M", "G", "T"):
+        if size < 1024 or unit == "T":
+            break
+        size /= 1024.0
+    if not unit:
+        return str(size)
+    if size >= 10:
+        return "{0}{1}".format(int(math.ceil(size)), unit)
+    return "{0:.1f}{1}".format(math.ceil(size * 10) / 10.0, unit)
+
+
 class DirectoryPlugin(Plugin):
 
     id = "directory"
@@ -25,14 +41,57 @@ class DirectoryPlugin(Plugin):
     @extends("application.arguments")
     def _commands(self):
         from args import Command, Argument
+        from basic.filesystem_manager import BULK_WORKERS
 
-        filesystem_manager = self.plugin_manager.get_service("filesystem_manager")
         return [
-            Command("mkdir", lambda o: filesystem_manager.mkdir(o), "create a new directory", (
-                Argument("path", help="path to the directory"),
+            Command("mkdir", self._mkdir, "create new directories", (
+                Argument("paths", nargs="+", help="paths to the directories"),
+                Argument("-p", "--parents", action="store_true", help="create parent directories, no error if existing"),
+                Argument("--workers", type=int, default=BULK_WORKERS, help="directories created at the same time"),
+                Argument("--dry-run", action="store_true", help="only show what would be done"),
             )),
-            Command("rmdir", lambda o: filesystem_manager.rmdir(o), "removes a directory", (
-                Argument("path", help="path to the directory"),
+            Command("rmdir", self._rmdir, "removes empty directories", (
+                Argument("paths", nargs="+", help="directories or glob patterns"),
+                Argument("--workers", type=int, default=BULK_WORKERS, help="directories removed at the same time"),
+                Argument("--dry-run", action="store_true", help="only show what would be done"),
+            )),
+            Command("du", self._disk_usage, "show the space used by a directory tree", (
+                Argument("path", help="path to the directory", nargs="?", default="."),
+                Argument("-d", "--max-depth", type=int, help="only show directories up to this depth"),
+                Argument("-s", "--summarize", action="store_true", help="only show the total"),
+                Argument("-H", "--human-readable", action="store_true", help="sizes like 1.5K, 23M, 2.1G"),
+                Argument("--apparent-size", action="store_true", help="size of the files instead of disk usage"),
+                Argument("--cache", action="store_true",
+                         help="remember the usage of every directory, next runs only list changed directories"),
+                Argument("--refresh", action="store_true", help="list all directories again, updating the cache"),
+                Argument("--workers", type=int, default=8, help="threads listing directories"),
             )),
         ]
 
+    def _mkdir(self, options):
+        from basic.filesystem_manager import write_report
+
+        filesystem_manager = self.plugin_manager.get_service("filesystem_manager")
+        results = filesystem_manager.mkdir_many(options.paths, options.parents, options.workers, options.dry_run)
+        return 1 if write_report(results, "mkdir", options.dry_run) else None
+
+    def _rmdir(self, options):
+        from basic.filesystem_manager import write_report
+
+        filesystem_manager = self.plugin_manager.get_service("filesystem_manager")
+        results = filesystem_manager.rmdir_many(options.paths, options.workers, options.dry_run)
+        return 1 if write_report(results, "rmdir", options.dry_run) else None
+
+    def _disk_usage(self, options):
+        filesystem_manager = self.plugin_manager.get_service("filesystem_manager")
+        result = filesystem_manager.disk_usage(
+            options.path, options.workers, cache=options.cache, refresh=options.refresh,
+            apparent=options.apparent_size, max_depth=0 if options.summarize else options.max_depth
+        )
+        lines = []
+        # kilobytes rounded up like du, a file of a few bytes uses 1
+        for usage in result:
+            size = human_size(usage.size) if options.human_readable else str((usage.size + 1023) // 1024)
+            lines.append("{0}\t{1}\n".format(size, usage.path))
+        sys.stdout.write("".join(lines))
+
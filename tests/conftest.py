@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import os
+import sys
+import textwrap
+import importlib
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from plugin_manager import PluginManager  # noqa: E402
+
+PLUGIN_HEADER = "# -*- coding: utf-8 -*-\nfrom plugin_manager import Plugin, ExtensionPoint, extends\n"
+
+METADATA = '''
+    version = "0.1"
+    description = "Test plugin"
+    platform = "all"
+    author = ["tests"]
+    author_email = "tests@localhost"
+    enabled = True
+'''
+
+
+def _plugin_source(class_name, id, depends=(), body=""):
+    return PLUGIN_HEADER + "\n\nclass {0}(Plugin):\n    id = {1!r}\n    name = {1!r}\n    depends = {2!r}\n{3}{4}".format(
+        class_name, id, list(depends), METADATA, textwrap.indent(textwrap.dedent(body), "    ") if body else ""
+    )
+
+
+def _touch(path, content=None):
+    if content is not None:
+        with open(str(path), "w") as f:
+            f.write(content)
+    # a different modification time even on filesystems with a coarse resolution
+    st = os.stat(str(path))
+    os.utime(str(path), (st.st_atime, st.st_mtime + 10))
+
+
+@pytest.fixture
+def touch():
+    """Function writing a text file, if 'content' is given, and moving its modification time (or the one of a
+    directory) forward, so it is seen as changed: touch(path, content=None)
+    """
+    return _touch
+
+
+@pytest.fixture
+def search_path(tmp_path):
+    """Empty plugin search path, the modules imported from it are forgotten after the test."""
+    path = tmp_path / "plugins"
+    path.mkdir()
+    modules = set(sys.modules)
+    meta_path = list(sys.meta_path)
+    yield path
+    for name in set(sys.modules) - modules:
+        del sys.modules[name]
+    sys.meta_path[:] = meta_path
+    sys.path[:] = [entry for entry in sys.path if not entry.startswith(str(tmp_path))]
+    importlib.invalidate_caches()
+
+
+@pytest.fixture
+def plugins(monkeypatch):
+    """Import function for the modules of the plugins shipped in ROOT/plugins, e.g:
+    plugins("archiver.tgz_archiver"). The plugin modules imported are forgotten after the test.
+    """
+    path = os.path.join(ROOT, "plugins")
+    monkeypatch.syspath_prepend(path)
+    modules = set(sys.modules)
+    yield importlib.import_module
+    for name in set(sys.modules) - modules:
+        # other modules (e.g. the standard library) can't be imported twice safely
+        if (getattr(sys.modules[name], "__file__", None) or "").startswith(path + os.sep):
+            del sys.modules[name]
+
+
+@pytest.fixture
+def manager(search_path):
+    """Factory of plugin managers for the search path."""
+    def create(**kwargs):
+        return PluginManager(str(search_path), **kwargs)
+    return create
+
+
+@pytest.fixture
+def plugin_source():
+    """Function returning the source of a plugin definitions module with one plugin:
+    plugin_source(class_name, id, depends=(), body="")
+    """
+    return _plugin_source
+
+
+@pytest.fixture
+def write_plugin(search_path):
+    """Function writing a package plugin in the search path: search_path/package/plugin_definitions.py
+    write_plugin(package, source)
+    """
+    def write(package, source):
+        directory = os.path.join(str(search_path), package)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "__init__.py"), "w") as f:
+            f.write("")
+        with open(os.path.join(directory, "plugin_definitions.py"), "w") as f:
+            f.write(source)
+    return write
+
+
+@pytest.fixture
+def start_plugins(manager):
+    """Function returning a plugin manager for the search path with its plugins found, configured and enabled."""
+    def start(**kwargs):
+        plugin_manager = manager(**kwargs)
+        plugin_manager.find_plugins()
+        plugin_manager.configure_plugins()
+        plugin_manager.enable_plugins()
+        return plugin_manager
+    return start
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import os
+import sys
+
+import pytest
+
+from plugin_manager import PluginBundle
+
+BODY = '''
+items = ExtensionPoint("{0}.items")
+
+@extends("{0}.items")
+def _items(self):
+    return [{1!r}]
+'''
+
+
+@pytest.fixture
+def write(write_plugin, plugin_source):
+    """Function writing a plugin whose extender returns a value: write(id, value)"""
+    def write(id, value):
+        write_plugin(id, plugin_source(id.title(), id, body=BODY.format(id, value)))
+    return write
+
+
+def extensions(plugin_manager, id):
+    extension_point = plugin_manager.get_extension_point(id + ".items")
+    extension_point.reload_extensions()
+    return list(extension_point.extensions)
+
+
+def test_bundle_is_used(search_path, manager, write, tmp_path):
+    write("first", "bundled")
+    bundle = str(tmp_path / "plugins.bundle")
+    assert PluginBundle.build(str(search_path), bundle) == (1, 2)
+
+    plugin_manager = manager(static=True, bundle=bundle)
+    plugin_manager.find_plugins()
+    assert extensions(plugin_manager, "first") == ["bundled"]
+    assert sys.modules["first.plugin_definitions"].__file__.startswith(bundle)
+
+
+def test_stale_entries_use_the_search_path(search_path, manager, write, touch, tmp_path):
+    write("first", "bundled")
+    write("second", "bundled")
+    bundle = str(tmp_path / "plugins.bundle")
+    PluginBundle.build(str(search_path), bundle)
+
+    definitions = os.path.join(str(search_path), "first", "plugin_definitions.py")
+    with open(definitions) as f:
+        touch(definitions, f.read().replace("'bundled'", "'changed'"))
+    # removed after the bundle was built
+    os.remove(os.path.join(str(search_path), "second", "__init__.py"))
+    # added after the bundle was built
+    write("third", "new")
+
+    plugin_manager = manager(static=True, bundle=bundle)
+    plugin_manager.find_plugins()
+    assert not plugin_manager.bundle.names
+    assert extensions(plugin_manager, "first") == ["changed"]
+    assert extensions(plugin_manager, "third") == ["new"]
+    assert sys.modules["first.plugin_definitions"].__file__ == definitions
+
+
+def test_discard_stale(search_path, write, touch, tmp_path):
+    write("first", "bundled")
+    write("second", "bundled")
+    bundle = str(tmp_path / "plugins.bundle")
+    PluginBundle.build(str(search_path), bundle)
+    touch(os.path.join(str(search_path), "second", "__init__.py"), "# changed\n")
+
+    bundle = PluginBundle(bundle)
+    try:
+        assert bundle.discard_stale() == ["second"]
+        assert bundle.names == frozenset(["first"])
+        assert sorted(bundle.modules) == ["first", "first.plugin_definitions"]
+        assert bundle.discard_stale() == []
+    finally:
+        bundle.close()
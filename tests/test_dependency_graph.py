@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import pytest
+
+from plugin_manager import DependencyGraph, PluginError
+from benchmarks.plugin_tree import generate_plugin_tree, synthetic_graph
+
+
+def assert_topological(order, depends):
+    position = dict((id, i) for i, id in enumerate(order))
+    assert len(position) == len(depends)
+    for id, deps in depends.items():
+        for dep in deps:
+            assert position[dep] < position[id], "{0} comes before its dependency {1}".format(id, dep)
+
+
+def test_order_of_10k_plugins():
+    graph, depends = synthetic_graph(10000)
+    assert_topological(graph.order, depends)
+    # cached until the graph changes
+    assert graph.order is graph.order
+
+
+def test_order_after_remove_and_add():
+    graph, depends = synthetic_graph(1000)
+    leaf = graph.order[-1]
+    graph.remove(leaf)
+    del depends[leaf]
+    assert_topological(graph.order, depends)
+    graph.add(leaf, [graph.order[0]])
+    depends[leaf] = [graph.order[0]]
+    assert_topological(graph.order, depends)
+
+
+def test_dependencies_and_dependents():
+    graph = DependencyGraph()
+    graph.add("c", ["b"])
+    graph.add("b", ["a"])
+    graph.add("a", [])
+    graph.add("d", ["a"])
+    assert graph.dependencies("c") == ["a", "b", "c"]
+    assert graph.all_dependents("a") == ["a", "b", "d", "c"]
+
+
+def test_cycle_reports_its_members():
+    graph = DependencyGraph()
+    graph.add("base", [])
+    graph.add("x", ["base", "z"])
+    graph.add("y", ["x"])
+    graph.add("z", ["y"])
+    # depends on the cycle but it's not part of it
+    graph.add("outside", ["x"])
+
+    with pytest.raises(PluginError) as error:
+        graph.order
+    message = str(error.value)
+    assert "Cyclic dependency" in message
+    cycle = message.split(": ", 1)[1].split(" --> ")
+    assert cycle[0] == cycle[-1]
+    assert set(cycle) == set(["x", "y", "z"])
+
+
+def test_missing_dependency():
+    graph = DependencyGraph()
+    graph.add("a", ["missing"])
+    with pytest.raises(PluginError) as error:
+        graph.order
+    assert "missing" in str(error.value) and "a" in str(error.value)
+
+    with pytest.raises(PluginError):
+        graph.dependencies("a")
+
+
+def test_duplicated_node():
+    graph = DependencyGraph()
+    graph.add("a", [])
+    with pytest.raises(PluginError):
+        graph.add("a", [])
+
+
+def test_discovery_of_synthetic_tree(search_path, manager):
+    ids = generate_plugin_tree(str(search_path), count=300, depth=6, fan_out=3)
+    plugin_manager = manager(static=True)
+    plugin_manager.find_plugins()
+    order = [plugin.id for plugin in plugin_manager.plugins]
+    assert sorted(order) == sorted(ids)
+    depends = dict((plugin.id, plugin.depends) for plugin in plugin_manager.plugins)
+    assert_topological(order, depends)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import os
+import logging
+
+from plugin_manager import PluginManager
+
+
+def test_rediscovery(search_path, write_plugin, plugin_source):
+    write_plugin("first", plugin_source("First", "first"))
+    # any iterable, the search path is resolved once to a list
+    plugin_manager = PluginManager(path for path in [str(search_path)])
+    plugin_manager.find_plugins()
+    assert [plugin.id for plugin in plugin_manager.plugins] == ["first"]
+
+    write_plugin("second", plugin_source("Second", "second"))
+    plugin_manager.find_plugins()
+    assert sorted(plugin.id for plugin in plugin_manager.plugins) == ["first", "second"]
+
+
+def test_entries_that_are_not_modules_are_skipped(search_path, write_plugin, plugin_source, manager, caplog):
+    write_plugin("first", plugin_source("First", "first"))
+    os.makedirs(os.path.join(str(search_path), "__pycache__"))
+    with open(os.path.join(str(search_path), "README.txt"), "w") as f:
+        f.write("")
+
+    plugin_manager = manager()
+    with caplog.at_level(logging.ERROR):
+        plugin_manager.find_plugins()
+    assert [plugin.id for plugin in plugin_manager.plugins] == ["first"]
+    assert not caplog.records
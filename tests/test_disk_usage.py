@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import os
+import types
+import argparse
+
+import pytest
+
+
+@pytest.fixture
+def disk_usage(plugins):
+    return plugins("basic.disk_usage")
+
+
+def write(path, size):
+    with open(str(path), "w") as f:
+        f.write("x" * size)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """root: a.txt (10), sub: b.txt (20), sub/deep: c.txt (30)"""
+    root = tmp_path / "root"
+    (root / "sub" / "deep").mkdir(parents=True)
+    write(root / "a.txt", 10)
+    write(root / "sub" / "b.txt", 20)
+    write(root / "sub" / "deep" / "c.txt", 30)
+    return root
+
+
+def du(path):
+    """Apparent size of a directory tree, its files and its subdirectories, computed with os.walk"""
+    size, files, directories = os.lstat(path).st_size, 0, 0
+    for root, dirs, names in os.walk(path):
+        size += sum(os.lstat(os.path.join(root, name)).st_size for name in dirs + names)
+        files, directories = files + len(names), directories + len(dirs)
+    return size, files, directories
+
+
+def totals(result, root):
+    """list((path relative to root, size, files, directories)) of a result and the one expected"""
+    got = [(os.path.relpath(usage.path, str(root)),) + tuple(usage[1:]) for usage in result]
+    expected = [(os.path.relpath(usage.path, str(root)),) + du(usage.path) for usage in result]
+    return got, expected
+
+
+def test_totals_in_du_order(disk_usage, tree):
+    result, listed, reused = disk_usage.measure(str(tree), workers=4, apparent=True)
+    assert (listed, reused) == (3, 0)
+    got, expected = totals(result, tree)
+    assert got == expected
+    assert [(path, files, directories) for path, _, files, directories in got] == [
+        (os.path.join("sub", "deep"), 1, 0), ("sub", 2, 1), (".", 3, 2)
+    ]
+
+    # every directory is measured, only the first level is reported
+    result, _, _ = disk_usage.measure(str(tree), apparent=True, max_depth=1)
+    got, expected = totals(result, tree)
+    assert [path for path, _, _, _ in got] == ["sub", "."]
+    assert got == expected
+
+
+def test_file(disk_usage, tree):
+    result, _, _ = disk_usage.measure(str(tree / "a.txt"), apparent=True)
+    assert result == [disk_usage.DiskUsage(str(tree / "a.txt"), 10, 1, 0)]
+
+
+def test_cache_lists_only_changed_directories(disk_usage, tree, tmp_path, touch):
+    cache = disk_usage.UsageCache(str(tmp_path / "cache" / "usage.json"))
+    first, listed, reused = disk_usage.measure(str(tree), cache=cache, apparent=True)
+    assert (listed, reused) == (3, 0)
+    cache.save()
+
+    cache = disk_usage.UsageCache(cache.path)
+    assert cache.load()
+    result, listed, reused = disk_usage.measure(str(tree), cache=cache, apparent=True)
+    assert (listed, reused) == (0, 3)
+    assert result == first
+
+    write(tree / "sub" / "new.txt", 5)
+    touch(tree / "sub")
+    result, listed, reused = disk_usage.measure(str(tree), cache=cache, apparent=True)
+    assert (listed, reused) == (1, 2)
+    got, expected = totals(result, tree)
+    assert got == expected
+    assert got[-1][2] == 4
+
+    # removed directories are forgotten
+    os.remove(str(tree / "sub" / "deep" / "c.txt"))
+    os.rmdir(str(tree / "sub" / "deep"))
+    touch(tree / "sub")
+    result, listed, reused = disk_usage.measure(str(tree), cache=cache, apparent=True)
+    assert (listed, reused) == (1, 1)
+    assert str(tree / "sub" / "deep") not in cache.directories
+    got, expected = totals(result, tree)
+    assert got == expected
+    assert [path for path, _, _, _ in got] == ["sub", "."]
+
+
+def test_disk_usage_command(plugins, tree, tmp_path, monkeypatch):
+    filesystem_manager = plugins("basic.filesystem_manager")
+    manager = filesystem_manager.FileSystemManager(None)
+    cache = str(tmp_path / "usage.json")
+    monkeypatch.chdir(str(tree))
+
+    result = manager.disk_usage(".", cache=cache, apparent=True)
+    # paths as they were given
+    assert [usage.path for usage in result] == [os.path.join(".", "sub", "deep"), os.path.join(".", "sub"), "."]
+    assert os.path.exists(cache)
+    assert manager.disk_usage(".", cache=cache, apparent=True) == result
+    assert manager.disk_usage(".", cache=cache, refresh=True, apparent=True) == result
+
+
+def test_max_depth_of_the_root_directory(disk_usage, monkeypatch):
+    subdirectories = {os.sep: ["a"], os.path.join(os.sep, "a"): ["b"], os.path.join(os.sep, "a", "b"): []}
+    # every directory uses 1 byte and has 1 file
+    monkeypatch.setattr(
+        disk_usage, "_measure_directory", lambda path, cached: ([0, 0, 1, 1, 1, subdirectories[path]], True)
+    )
+
+    result, _, _ = disk_usage.measure(os.sep, apparent=True, max_depth=1)
+    assert result == [disk_usage.DiskUsage(os.path.join(os.sep, "a"), 2, 2, 1), disk_usage.DiskUsage(os.sep, 3, 3, 2)]
+
+
+def test_trailing_separator(plugins, tree):
+    manager = plugins("basic.filesystem_manager").FileSystemManager(None)
+    result = manager.disk_usage(str(tree) + os.sep, apparent=True)
+    assert [usage.path for usage in result] == [str(tree / "sub" / "deep"), str(tree / "sub"), str(tree)]
+
+
+def test_du_command_rounds_up(plugins, tree, capsys):
+    filesystem_manager = plugins("basic.filesystem_manager").FileSystemManager(None)
+    plugin_manager = types.SimpleNamespace(get_service=lambda id: filesystem_manager)
+    plugin = plugins("directory.plugin_definitions").DirectoryPlugin(plugin_manager)
+    plugin._disk_usage(argparse.Namespace(
+        path=str(tree / "a.txt"), workers=1, cache=False, refresh=False, apparent_size=True, summarize=False,
+        max_depth=None, human_readable=False
+    ))
+    assert capsys.readouterr()[0] == "1\t{0}\n".format(tree / "a.txt")
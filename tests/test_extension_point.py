@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import pytest
+
+from plugin_manager import ExtensionPoint, PluginError, extends
+
+
+class Item(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+def extender(*names, **kwargs):
+    """Return an extender of the "items" extension point with one item per name, counting its calls."""
+    calls = kwargs.get("calls", [])
+
+    @extends("items")
+    def fn():
+        calls.append(names)
+        return [Item(name) for name in names]
+    return fn
+
+
+def names(extension_point):
+    """Names of the items of the extension point, loading them if needed."""
+    return [item.name for item in extension_point._load()]
+
+
+def test_subscribers_see_invalidations():
+    extension_point = ExtensionPoint("items", key="name")
+    extension_point.add_extender(extender("a"))
+    extension_point.reload_extensions()
+
+    seen = []
+    extension_point.subscribe(lambda ep: seen.append((ep.generation, ep.loaded)))
+    generation = extension_point.generation
+    extension_point.invalidate()
+    assert seen == [(generation + 1, False)]
+
+    assert extension_point["a"].name == "a"
+    assert seen[-1] == (generation + 2, True)
+
+
+def test_duplicated_keys_are_rejected():
+    extension_point = ExtensionPoint("items", key="name")
+    extension_point.add_extender(extender("a", "b"))
+    extension_point.add_extender(extender("b"))
+    with pytest.raises(PluginError, match="Duplicated key: b"):
+        extension_point.reload_extensions()
+
+    # adding an extender to loaded extensions is checked too
+    extension_point = ExtensionPoint("items", key="name")
+    extension_point.add_extender(extender("a"))
+    extension_point.reload_extensions()
+    with pytest.raises(PluginError, match="Duplicated key: a"):
+        extension_point.add_extender(extender("a"))
+    assert names(extension_point) == ["a"]
+
+
+def test_only_changed_extenders_are_evaluated():
+    calls = []
+    first, second = extender("a", calls=calls), extender("b", calls=calls)
+    extension_point = ExtensionPoint("items", key="name")
+    extension_point.add_extender(first)
+    extension_point.add_extender(second)
+    assert names(extension_point) == ["a", "b"]
+    assert calls == [("a",), ("b",)]
+
+    third = extender("c", calls=calls)
+    extension_point.add_extender(third)
+    assert names(extension_point) == ["a", "b", "c"]
+    assert calls == [("a",), ("b",), ("c",)]
+
+    extension_point.remove_extender(second)
+    assert names(extension_point) == ["a", "c"]
+    assert "b" not in extension_point and extension_point["c"].name == "c"
+    assert calls == [("a",), ("b",), ("c",)]
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import os
+import sys
+import errno
+import types
+import multiprocessing
+
+import pytest
+
+
+@pytest.fixture
+def filesystem_manager(plugins):
+    return plugins("basic.filesystem_manager")
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "directory").mkdir()
+    (tmp_path / "file.txt").write_text(u"file")
+    return tmp_path
+
+
+@pytest.mark.parametrize("operation", ["touch_many", "rmdir_many", "remove_many"])
+def test_patterns_matching_nothing_are_errors(filesystem_manager, tree, operation, capsys):
+    manager = filesystem_manager.FileSystemManager(None)
+    pattern = str(tree / "*.missing")
+    results = list(getattr(manager, operation)([pattern]))
+    assert results == [filesystem_manager.OperationResult(pattern, False, os.strerror(errno.ENOENT))]
+
+    assert filesystem_manager.write_report(results, operation) == 1
+    out, err = capsys.readouterr()
+    assert err == "{0}: {1}\n".format(pattern, os.strerror(errno.ENOENT))
+    assert out == "{0}: 0 done, 1 failed\n".format(operation)
+
+
+def test_unmatched_patterns_dont_stop_the_others(filesystem_manager, tree, capsys):
+    manager = filesystem_manager.FileSystemManager(None)
+    missing = str(tree / "*.missing")
+    results = list(manager.remove_many([missing, str(tree / "*.txt"), str(tree / "dir*")], recursive=True))
+
+    assert sorted((result.path, result.ok) for result in results) == sorted([
+        (missing, False), (str(tree / "file.txt"), True), (str(tree / "directory"), True)
+    ])
+    assert os.listdir(str(tree)) == []
+    assert filesystem_manager.write_report(results, "remove") == 1
+    assert capsys.readouterr()[0] == "remove: 2 done, 1 failed\n"
+
+
+class BundledArchiver(object):
+    """Archiver whose module looks imported from a plugin bundle, see: bundled_archiver. It writes next to
+    every file the pid of the process that compressed it and the workers option.
+    """
+
+    def compress(self, filename, **options):
+        with open(filename + ".archived", "w") as f:
+            f.write("{0} {1}".format(os.getpid(), options.get("workers")))
+        return True
+
+
+def archived(filename):
+    with open(filename + ".archived") as f:
+        pid, workers = f.read().split()
+    return int(pid), workers
+
+
+@pytest.fixture
+def bundled_archiver(tmp_path, monkeypatch):
+    bundle = tmp_path / "plugins.bundle"
+    bundle.write_bytes(b"bundle")
+    package = types.ModuleType("bundled")
+    package.__file__ = str(bundle / "bundled" / "__init__.py")
+    module = types.ModuleType("bundled.archiver")
+    module.__file__ = str(bundle / "bundled" / "archiver.py")
+    module.BundledArchiver = type("BundledArchiver", (BundledArchiver,), {"__module__": module.__name__})
+    package.archiver = module
+    monkeypatch.setitem(sys.modules, package.__name__, package)
+    monkeypatch.setitem(sys.modules, module.__name__, module)
+    return module.BundledArchiver()
+
+
+def test_compress_batch_without_importable_archiver(filesystem_manager, tree, bundled_archiver, monkeypatch):
+    monkeypatch.setattr(filesystem_manager, "_forks", lambda: False)
+    assert filesystem_manager._import_path(bundled_archiver) is None
+    manager = filesystem_manager.FileSystemManager({"bundle": bundled_archiver})
+    missing = str(tree / "missing.txt")
+    results = list(manager.compress_batch([str(tree / "file.txt"), missing], "bundle", processes=4))
+
+    assert sorted((result.filename, result.ok) for result in results) == [(str(tree / "file.txt"), True), (missing, False)]
+    # compressed in this process, without limiting the archiver threads
+    assert archived(str(tree / "file.txt")) == (os.getpid(), "None")
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="worker processes are not forked")
+def test_compress_batch_with_forked_workers(filesystem_manager, tree, bundled_archiver):
+    assert filesystem_manager._forks()
+    manager = filesystem_manager.FileSystemManager({"bundle": bundled_archiver})
+    results = list(manager.compress_batch([str(tree / "file.txt")], "bundle", processes=2))
+
+    assert [(result.filename, result.ok) for result in results] == [(str(tree / "file.txt"), True)]
+    # forked workers inherit the module of the archiver
+    pid, workers = archived(str(tree / "file.txt"))
+    assert pid != os.getpid() and workers == "1"
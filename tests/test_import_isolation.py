@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import os
+import sys
+import importlib
+
+import pytest
+
+from plugin_manager import PluginBundle
+
+# a standard library module nothing else imports in the tests
+STDLIB = "colorsys"
+
+
+@pytest.fixture
+def shadowing(search_path, write_plugin, plugin_source):
+    """Search path with a plugin and a module named like a standard library module."""
+    write_plugin("plugin", plugin_source("Plugin", "plugin"))
+    with open(os.path.join(str(search_path), STDLIB + ".py"), "w") as f:
+        f.write("HIJACKED = True\n")
+    module = sys.modules.pop(STDLIB, None)
+    yield search_path
+    sys.modules.pop(STDLIB, None)
+    if module is not None:
+        sys.modules[STDLIB] = module
+
+
+def assert_stdlib(search_path):
+    module = importlib.import_module(STDLIB)
+    assert not hasattr(module, "HIJACKED")
+    assert not module.__file__.startswith(str(search_path))
+
+
+@pytest.mark.parametrize("static", [False, True])
+def test_search_path_does_not_shadow_stdlib(shadowing, manager, static):
+    plugin_manager = manager(static=static)
+    plugin_manager.find_plugins()
+    assert [plugin.id for plugin in plugin_manager.plugins] == ["plugin"]
+    assert_stdlib(shadowing)
+    # plugin modules are still importable
+    assert importlib.import_module("plugin.plugin_definitions").Plugin.id == "plugin"
+
+
+def test_bundle_does_not_shadow_stdlib(shadowing, manager, tmp_path):
+    bundle = str(tmp_path / "plugins.bundle")
+    PluginBundle.build(str(shadowing), bundle)
+    sys.modules.pop(STDLIB, None)
+    assert_stdlib(shadowing)
+
+    plugin_manager = manager(static=True, bundle=bundle)
+    plugin_manager.find_plugins()
+    assert STDLIB in plugin_manager.bundle.modules
+    sys.modules.pop(STDLIB, None)
+    assert_stdlib(shadowing)
+    assert importlib.import_module("plugin.plugin_definitions").__file__.startswith(bundle)
+
+
+def test_plugin_imports_skip_sys_path(search_path, write_plugin, plugin_source, manager, monkeypatch):
+    write_plugin("plugin", plugin_source("Plugin", "plugin"))
+    plugin_manager = manager()
+    plugin_manager.find_plugins()
+    meta_path = list(sys.meta_path)
+    assert meta_path.index(plugin_manager.finder) < meta_path.index(importlib.machinery.PathFinder)
+
+    searched = []
+    find_spec = importlib.machinery.PathFinder.find_spec
+
+    def recording(fullname, path=None, target=None):
+        searched.append(fullname)
+        return find_spec(fullname, path, target)
+
+    monkeypatch.setattr(importlib.machinery.PathFinder, "find_spec", recording)
+    sys.modules.pop("plugin.plugin_definitions", None)
+    sys.modules.pop("plugin", None)
+    assert importlib.import_module("plugin.plugin_definitions").Plugin.id == "plugin"
+    # the package is found by the plugin finder, only its submodule by the path finder, in the package __path__
+    assert "plugin" not in searched
+
+
+def test_search_path_does_not_shadow_installed_modules(search_path, manager, tmp_path, monkeypatch):
+    site_packages = tmp_path / "site-packages"
+    site_packages.mkdir()
+    for path in (site_packages, search_path):
+        with open(str(path / "installed.py"), "w") as f:
+            f.write("PATH = {0!r}\n".format(str(path)))
+    monkeypatch.syspath_prepend(str(site_packages))
+
+    plugin_manager = manager()
+    plugin_manager.find_plugins()
+    assert importlib.import_module("installed").PATH == str(site_packages)
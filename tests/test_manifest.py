@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import os
+import sys
+
+BODY = '''
+items = ExtensionPoint("cached.items")
+items_extender = extends("cached.items")(lambda self: ["item"])
+'''
+
+
+def forget(*packages):
+    for name in [name for name in sys.modules if name.split(".")[0] in packages]:
+        del sys.modules[name]
+
+
+def test_lazy_plugin_runs_its_extenders(write_plugin, plugin_source, manager, tmp_path):
+    write_plugin("cached", plugin_source("Cached", "cached", body=BODY))
+    manifest = str(tmp_path / "manifest.json")
+    manager(manifest=manifest).find_plugins()
+    forget("cached")
+
+    # described by the manifest, nothing is imported until the extender runs
+    plugin_manager = manager(manifest=manifest)
+    plugin_manager.find_plugins()
+    plugin = plugin_manager.plugins[0]
+    assert not plugin.loaded
+    assert "cached.plugin_definitions" not in sys.modules
+
+    extension_point = plugin_manager.get_extension_point("cached.items")
+    extension_point.reload_extensions()
+    assert list(extension_point.extensions) == ["item"]
+    assert plugin.loaded
+
+
+def test_changed_entries_are_rebuilt(search_path, write_plugin, plugin_source, manager, touch, tmp_path):
+    # the plugin class is defined in another module of the package
+    write_plugin("kept", plugin_source("Kept", "kept"))
+    write_plugin("changed", "from .impl import Changed\n")
+    impl = os.path.join(str(search_path), "changed", "impl.py")
+    with open(impl, "w") as f:
+        f.write(plugin_source("Changed", "changed"))
+    manifest = str(tmp_path / "manifest.json")
+    manager(manifest=manifest).find_plugins()
+    forget("kept", "changed")
+
+    touch(impl, plugin_source("Changed", "changed", depends=["kept"]))
+
+    plugin_manager = manager(manifest=manifest)
+    plugin_manager.find_plugins()
+    plugins = dict((plugin.id, plugin) for plugin in plugin_manager.plugins)
+    assert list(plugins["changed"].depends) == ["kept"]
+    assert "changed.plugin_definitions" in sys.modules
+    # unchanged entries are taken from the manifest without importing them
+    assert not plugins["kept"].loaded
+    assert "kept.plugin_definitions" not in sys.modules
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import time
+
+import pytest
+
+from plugin_manager import PluginError
+
+HOOK = '''
+def {hook}(self):
+    import time
+    events = self.plugin_manager.get_service("events")
+    start = time.time()
+    if {fail!r}:
+        raise ValueError("configure failed: " + self.id)
+    time.sleep({delay!r})
+    events.append((self.id, start, time.time()))
+'''
+
+
+@pytest.fixture
+def load(manager, write_plugin, plugin_source):
+    """Function writing the plugins: dict(id -> dependencies) and returning a plugin manager with them found."""
+    def load(plugins, delay=0.05, fail=(), hook="configure"):
+        for id, depends in plugins.items():
+            body = HOOK.format(hook=hook, delay=delay, fail=id in fail)
+            write_plugin(id, plugin_source(id.title(), id, depends, body=body))
+        plugin_manager = manager()
+        plugin_manager.find_plugins()
+        events = []
+        plugin_manager.register_service("events", events)
+        return plugin_manager, events
+    return load
+
+
+def test_dependencies_finish_first(load):
+    plugins = {"a": [], "b": ["a"], "c": ["a"], "d": ["b", "c"], "e": [], "f": ["e", "d"]}
+    plugin_manager, events = load(plugins)
+    plugin_manager.configure_plugins(parallel=True, max_workers=4)
+
+    times = dict((id, (start, end)) for id, start, end in events)
+    assert sorted(times) == sorted(plugins)
+    for id, depends in plugins.items():
+        for dep in depends:
+            assert times[dep][1] <= times[id][0], "{0} started before {1} finished".format(id, dep)
+    # independent plugins overlap
+    assert times["e"][0] < times["a"][1]
+
+
+def test_timeout_starts_when_the_hook_runs(load):
+    plugins = dict(("p{0}".format(i), []) for i in range(8))
+    plugin_manager, events = load(plugins, delay=0.2)
+    # 4 rounds of 2 hooks: the last ones are queued for 0.6 seconds, longer than the timeout
+    plugin_manager.configure_plugins(parallel=True, max_workers=2, timeout=0.5)
+    assert len(events) == 8
+
+
+def test_timeout(load):
+    plugin_manager, events = load({"slow": []}, delay=1.0)
+    start = time.time()
+    with pytest.raises(PluginError) as error:
+        plugin_manager.configure_plugins(parallel=True, timeout=0.2)
+    assert "slow" in str(error.value)
+    assert time.time() - start < 0.9
+
+
+def test_first_error_stops_scheduling(load):
+    plugins = {"base": [], "broken": ["base"], "dependent": ["broken"], "later": ["dependent"]}
+    plugin_manager, events = load(plugins, fail=("broken",))
+    with pytest.raises(ValueError) as error:
+        plugin_manager.configure_plugins(parallel=True, max_workers=2)
+    assert "broken" in str(error.value)
+    assert [id for id, _, _ in events] == ["base"]
+
+
+def test_enable_notifications(load):
+    plugins = {"a": [], "b": ["a"], "c": ["a"], "d": ["b", "c"], "e": [], "f": ["e", "d"]}
+    plugin_manager, events = load(plugins, hook="enable")
+    calls = []
+    plugin_manager.enable_plugins(
+        lambda enabled, plugin: calls.append((enabled, plugin.id, time.time())), parallel=True, max_workers=4
+    )
+
+    # one pair per plugin, around its enable
+    times = dict((id, (start, end)) for id, start, end in events)
+    assert sorted(times) == sorted(plugins)
+    for id in plugins:
+        notified = [(enabled, at) for enabled, plugin_id, at in calls if plugin_id == id]
+        assert [enabled for enabled, _ in notified] == [False, True]
+        assert notified[0][1] <= times[id][0] and times[id][1] <= notified[1][1]
+
+    # a plugin is about to be enabled only after its dependencies are enabled
+    order = [(enabled, id) for enabled, id, _ in calls]
+    for id, depends in plugins.items():
+        for dep in depends:
+            assert order.index((True, dep)) < order.index((False, id))
+    # independent plugins are enabled concurrently
+    assert order.index((False, "e")) < order.index((True, "a"))
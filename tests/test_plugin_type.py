@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import pytest
+
+STATEFUL = '''
+def configure(self):
+    self.configured = True
+
+def enable(self):
+    self.enabled_by = "enable"
+'''
+
+COMPACT = '''
+compact_instances = True
+__slots__ = ("configured",)
+
+def configure(self):
+    self.configured = True
+'''
+
+
+@pytest.fixture
+def load(write_plugin, plugin_source, start_plugins):
+    """Function starting a plugin: load(package, body) and returning its instance."""
+    def load(package, body):
+        write_plugin(package, plugin_source(package.title(), package, body=body))
+        return start_plugins()._plugins[package].instance
+    return load
+
+
+def test_instance_attributes(load):
+    instance = load("stateful", STATEFUL)
+    assert instance.configured is True
+    assert instance.enabled_by == "enable"
+
+
+def test_compact_instances(load):
+    instance = load("compact", COMPACT)
+    assert instance.configured is True
+    assert not hasattr(instance, "__dict__")
+    with pytest.raises(AttributeError):
+        instance.other = True
+
+
+def test_compact_instances_are_inherited(search_path):
+    from plugin_manager import Plugin
+
+    class Base(Plugin):
+        compact_instances = True
+
+    class Derived(Base):
+        pass
+
+    assert Base.__slots__ == () and Derived.__slots__ == ()
+    assert "__slots__" not in vars(type("Default", (Plugin,), {}))
+
+
+@pytest.mark.parametrize("static", [False, True])
+def test_missing_fields_are_logged(write_plugin, plugin_source, manager, static, caplog):
+    source = plugin_source("Incomplete", "incomplete").replace('    author_email = "tests@localhost"\n', "")
+    write_plugin("incomplete", source)
+    plugin_manager = manager(static=static)
+    plugin_manager.find_plugins()
+    assert not plugin_manager.plugins
+    errors = [record.getMessage() for record in caplog.records if record.levelname == "ERROR"]
+    assert len(errors) == 1
+    assert "error loading plugin: incomplete" in errors[0]
+    assert "Missing attribute: author_email in plugin: Incomplete" in errors[0]
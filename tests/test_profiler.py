@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import os
+import asyncio
+
+SLOW = '''
+def configure(self):
+    import time
+    time.sleep(0.05)
+
+async def enable(self):
+    import asyncio
+    await asyncio.sleep(0.1)
+'''
+
+
+def test_startup_report(search_path, write_plugin, plugin_source, manager):
+    write_plugin("base", plugin_source("Base", "base"))
+    write_plugin("slow", plugin_source("Slow", "slow", depends=["base"], body=SLOW))
+    # a directory without plugin definitions
+    os.makedirs(os.path.join(str(search_path), "helpers"))
+
+    plugin_manager = manager(profile=True)
+    plugin_manager.find_plugins()
+    plugin_manager.configure_plugins()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(plugin_manager.enable_plugins_async())
+    finally:
+        loop.close()
+
+    summary = plugin_manager.profiler.summary()
+    assert sorted(summary) == ["base", "slow"]
+    assert summary["slow"]["import"]["count"] == 1
+    assert summary["slow"]["configure"]["wall"] >= 0.05
+    # async hooks are measured while awaited, sleeping is not cpu time
+    enable = summary["slow"]["enable"]
+    assert enable["count"] == 1
+    assert enable["wall"] >= 0.1
+    assert enable["cpu"] < 0.05
+
+    report = plugin_manager.profiler.to_dict(plugin_manager)
+    assert [plugin["plugin"] for plugin in report["critical_path"]["plugins"]] == ["base", "slow"]
+
+
+def test_disabled_profiler_is_stateless(write_plugin, plugin_source, manager):
+    write_plugin("base", plugin_source("Base", "base"))
+    plugin_manager = manager(workers=4)
+    plugin_manager.find_plugins()
+    assert [plugin.id for plugin in plugin_manager.plugins] == ["base"]
+    # every measure of a disabled profiler is the same shared instance
+    assert plugin_manager.profiler.measure("other", "import").plugin_id is None
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import time
+import itertools
+import threading
+
+import pytest
+
+from plugin_manager import ServicePool, PluginError
+
+
+class Connection(object):
+
+    counter = itertools.count()
+
+    def __init__(self):
+        self.id = next(self.counter)
+        self.healthy = True
+        self.closed = False
+
+
+def pool_of(**kwargs):
+    disposed = []
+    kwargs.setdefault("dispose", disposed.append)
+    return ServicePool(Connection, **kwargs), disposed
+
+
+def hold(pool, acquired, release):
+    """Thread target: acquire an object, report it and keep it until 'release' is set."""
+    with pool.acquire() as obj:
+        acquired.append(obj)
+        release.wait(5)
+
+
+def test_max_size_blocks_until_an_object_is_returned():
+    pool, _ = pool_of(max_size=2)
+    acquired, release = [], threading.Event()
+    holders = [threading.Thread(target=hold, args=(pool, acquired, release)) for _ in range(2)]
+    for thread in holders:
+        thread.start()
+    while len(acquired) < 2:
+        time.sleep(0.01)
+
+    waiter_got = []
+    waiter = threading.Thread(target=hold, args=(pool, waiter_got, threading.Event()))
+    waiter.daemon = True
+    waiter.start()
+    time.sleep(0.1)
+    # still waiting: the pool is full
+    assert not waiter_got
+    assert pool.stats["in_use"] == 2
+
+    release.set()
+    for thread in holders:
+        thread.join()
+    waiter.join(5)
+    assert len(waiter_got) == 1 and waiter_got[0] in acquired
+    stats = pool.stats
+    assert stats["creations"] == 2 and stats["waits"] == 1 and stats["size"] == 2
+
+
+def test_acquire_timeout():
+    pool, _ = pool_of(max_size=1)
+    with pool.acquire():
+        start = time.time()
+        with pytest.raises(PluginError):
+            with pool.acquire(timeout=0.1):
+                pass
+        assert time.time() - start >= 0.1
+    # the object in use was not lost
+    with pool.acquire(timeout=0.1):
+        assert pool.stats["size"] == 1
+
+
+def test_unhealthy_objects_are_discarded():
+    pool, disposed = pool_of(max_size=2, health_check=lambda obj: obj.healthy)
+    with pool.acquire() as first:
+        first.healthy = False
+    with pool.acquire() as second:
+        assert second is not first
+    assert disposed == [first]
+    stats = pool.stats
+    assert stats["failed_health_checks"] == 1 and stats["size"] == 1
+
+
+def test_failing_health_check_discards_the_object():
+    def health_check(obj):
+        raise IOError("connection lost")
+
+    pool, disposed = pool_of(health_check=health_check)
+    with pool.acquire() as first:
+        pass
+    with pool.acquire() as second:
+        assert second is not first
+    assert disposed == [first]
+
+
+def test_objects_are_returned_on_exceptions():
+    pool, _ = pool_of(max_size=1)
+    with pytest.raises(ValueError):
+        with pool.acquire() as first:
+            raise ValueError("error using the object")
+    with pool.acquire(timeout=0.1) as second:
+        assert second is first
+    assert pool.stats["in_use"] == 0
+
+
+def test_factory_errors_free_the_slot():
+    calls = []
+
+    def factory():
+        calls.append(None)
+        if len(calls) == 1:
+            raise IOError("can't connect")
+        return Connection()
+
+    pool = ServicePool(factory, max_size=1)
+    with pytest.raises(IOError):
+        with pool.acquire():
+            pass
+    with pool.acquire(timeout=0.1) as obj:
+        assert isinstance(obj, Connection)
+
+
+def test_idle_objects_expire_keeping_min_size():
+    pool, disposed = pool_of(min_size=1, max_size=3, idle_timeout=0.05)
+    with pool.acquire():
+        with pool.acquire():
+            with pool.acquire():
+                pass
+    assert pool.stats["idle"] == 3
+    time.sleep(0.1)
+    with pool.acquire():
+        pass
+    stats = pool.stats
+    assert stats["evictions"] == 2 and stats["size"] == 1 and len(disposed) == 2
+
+
+def test_close_disposes_idle_and_returned_objects():
+    pool, disposed = pool_of()
+    with pool.acquire() as in_use:
+        with pool.acquire() as idle:
+            pass
+        pool.close()
+        assert disposed == [idle]
+    assert disposed == [idle, in_use]
+    with pytest.raises(PluginError):
+        with pool.acquire():
+            pass
+
+
+def test_contention():
+    pool, _ = pool_of(max_size=3)
+    lock = threading.Lock()
+    in_use, peak, errors = [0], [0], []
+
+    def worker():
+        try:
+            for _ in range(50):
+                with pool.acquire(timeout=5):
+                    with lock:
+                        in_use[0] += 1
+                        peak[0] = max(peak[0], in_use[0])
+                    time.sleep(0.0005)
+                    with lock:
+                        in_use[0] -= 1
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert peak[0] <= 3
+    stats = pool.stats
+    assert stats["acquisitions"] == 16 * 50 and stats["size"] <= 3 and stats["in_use"] == 0
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import gc
+import asyncio
+import time
+import weakref
+import threading
+
+import pytest
+
+from plugin_manager import PluginManager, SINGLETON, THREAD, CONTEXT, TRANSIENT
+
+
+class Service(object):
+
+    def __init__(self, version):
+        self.version = version
+
+
+@pytest.fixture
+def plugin_manager(tmp_path):
+    return PluginManager(str(tmp_path))
+
+
+@pytest.mark.parametrize("lifetime", [SINGLETON, THREAD, CONTEXT, TRANSIENT])
+def test_remove_and_register_again(plugin_manager, lifetime):
+    with plugin_manager.service_scope():
+        plugin_manager.register_factory("service", lambda: Service(1), lifetime=lifetime)
+        old = plugin_manager.get_service("service")
+        assert old.version == 1
+
+        plugin_manager.remove_service("service")
+        assert plugin_manager.get_service("service") is None
+        plugin_manager.register_factory("service", lambda: Service(2), lifetime=lifetime)
+        assert plugin_manager.get_service("service").version == 2
+
+
+@pytest.mark.parametrize("lifetime", [THREAD, CONTEXT])
+def test_removed_instances_are_released(plugin_manager, lifetime):
+    with plugin_manager.service_scope():
+        plugin_manager.register_factory("service", lambda: Service(1), lifetime=lifetime)
+        ref = weakref.ref(plugin_manager.get_service("service"))
+        plugin_manager.remove_service("service")
+        gc.collect()
+        assert ref() is None
+
+
+def test_thread_instances(plugin_manager):
+    plugin_manager.register_factory("service", lambda: Service(threading.current_thread().name), lifetime=THREAD)
+    results = {}
+
+    def run():
+        name = threading.current_thread().name
+        results[name] = (plugin_manager.get_service("service"), plugin_manager.get_service("service"))
+
+    threads = [threading.Thread(target=run, name="t{0}".format(i)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for name, (first, second) in results.items():
+        assert first is second and first.version == name
+
+
+def test_singleton_is_created_once(plugin_manager):
+    calls = []
+    barrier = threading.Barrier(16)
+
+    def factory():
+        calls.append(None)
+        # slow factory, every thread is waiting for the instance meanwhile
+        time.sleep(0.1)
+        return Service(len(calls))
+
+    plugin_manager.register_factory("service", factory, lifetime=SINGLETON)
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append(plugin_manager.get_service("service"))
+
+    threads = [threading.Thread(target=run) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 16 and all(result is results[0] for result in results)
+
+
+@pytest.mark.parametrize("register_again", [False, True])
+def test_remove_during_creation(plugin_manager, register_again):
+    creating = threading.Event()
+    removed = threading.Event()
+
+    def factory():
+        creating.set()
+        removed.wait()
+        return Service(1)
+
+    plugin_manager.register_factory("service", factory, lifetime=SINGLETON)
+    results = []
+    thread = threading.Thread(target=lambda: results.append(plugin_manager.get_service("service")))
+    thread.start()
+    creating.wait()
+    plugin_manager.remove_service("service")
+    if register_again:
+        plugin_manager.register_factory("service", lambda: Service(2), lifetime=SINGLETON)
+        # not blocked by the creation of the removed service
+        assert plugin_manager.get_service("service").version == 2
+    removed.set()
+    thread.join()
+
+    # the instance of the removed service is not kept
+    assert results == [None]
+    if register_again:
+        assert plugin_manager.get_service("service").version == 2
+    else:
+        assert plugin_manager.get_service("service") is None
+
+
+def test_remove_during_async_creation(plugin_manager):
+    async def run():
+        creating = asyncio.Event()
+        removed = asyncio.Event()
+
+        async def factory():
+            creating.set()
+            await removed.wait()
+            return Service(1)
+
+        plugin_manager.register_factory("service", factory, lifetime=SINGLETON)
+        task = asyncio.ensure_future(plugin_manager.get_service_async("service"))
+        await creating.wait()
+        plugin_manager.remove_service("service")
+
+        async def new_factory():
+            return Service(2)
+
+        plugin_manager.register_factory("service", new_factory, lifetime=SINGLETON)
+        assert (await plugin_manager.get_service_async("service")).version == 2
+        removed.set()
+        assert await task is None
+        assert (await plugin_manager.get_service_async("service")).version == 2
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
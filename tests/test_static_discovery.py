@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import gc
+import sys
+import asyncio
+import warnings
+
+import pytest
+
+from plugin_manager import PluginError, parse_plugin_definitions
+
+CONSTANT_IDS = '''
+items = ExtensionPoint(ITEMS)
+
+@extends(ITEMS)
+def _items(self):
+    return ["item"]
+'''
+
+
+def test_literal_ids_are_described(plugin_source):
+    source = plugin_source("Literal", "literal", body='''
+items = ExtensionPoint("literal.items", key="name")
+
+@extends("literal.items")
+def _items(self):
+    return []
+''')
+    plugins = parse_plugin_definitions(source, "literal.plugin_definitions")
+    assert plugins[0]["extension_points"] == [["literal.items", "name"]]
+    assert plugins[0]["extenders"] == [["_items", "literal.items"]]
+
+
+def test_constant_ids_fall_back_to_import(write_plugin, plugin_source, start_plugins):
+    source = plugin_source("Constant", "constant", body=CONSTANT_IDS).replace(
+        "\n\nclass", '\nITEMS = "constant.items"\n\n\nclass', 1
+    )
+    assert parse_plugin_definitions(source, "constant.plugin_definitions") is None
+
+    write_plugin("constant", source)
+    plugin_manager = start_plugins(static=True)
+    extension_point = plugin_manager.get_extension_point("constant.items")
+    assert extension_point is not None
+    extension_point.reload_extensions()
+    assert list(extension_point.extensions) == ["item"]
+
+
+def test_async_plugin(write_plugin, plugin_source, manager):
+    source = plugin_source("Async", "async", body='''
+items = ExtensionPoint("async.items")
+calls = []
+
+async def configure(self):
+    Async.calls.append("configure")
+
+async def enable(self):
+    Async.calls.append("enable")
+
+@extends("async.items")
+async def _items(self):
+    return ["item"]
+''')
+    plugins = parse_plugin_definitions(source, "async.plugin_definitions")
+    assert plugins[0]["extenders"] == [["_items", "async.items"]]
+    assert sorted(plugins[0]["hooks"]) == ["configure", "enable"]
+
+    write_plugin("async", source)
+    plugin_manager = manager(static=True)
+    plugin_manager.find_plugins()
+    # the extender is known before the plugin is imported
+    extension_point = plugin_manager.get_extension_point("async.items")
+    assert len(list(extension_point.extenders)) == 1
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(plugin_manager.configure_plugins_async())
+        loop.run_until_complete(plugin_manager.enable_plugins_async())
+        assert loop.run_until_complete(extension_point.reload_extensions_async()) == ["item"]
+    finally:
+        loop.close()
+    assert sys.modules["async.plugin_definitions"].Async.calls == ["configure", "enable"]
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_async_hooks_need_the_async_api(write_plugin, plugin_source, manager, parallel):
+    write_plugin("async", plugin_source("Async", "async", body='''
+async def configure(self):
+    pass
+'''))
+    plugin_manager = manager(static=True)
+    plugin_manager.find_plugins()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        with pytest.raises(PluginError) as error:
+            plugin_manager.configure_plugins(parallel=parallel)
+        gc.collect()
+    assert "configure_plugins_async" in str(error.value)
+
+
+CONDITIONAL = '''
+
+try:
+    import json
+except ImportError:
+    json = None
+else:
+    class Conditional(Plugin):
+        id = "conditional"
+        name = "conditional"
+        depends = []
+        version = "0.1"
+        description = "Conditional plugin"
+        platform = "all"
+        author = ["tests"]
+        author_email = "tests@localhost"
+        enabled = True
+'''
+
+
+def test_conditional_classes_fall_back_to_import(write_plugin, plugin_source, manager):
+    source = plugin_source("Plain", "plain") + CONDITIONAL
+    assert parse_plugin_definitions(source, "conditional.plugin_definitions") is None
+
+    write_plugin("conditional", source)
+    plugin_manager = manager(static=True)
+    plugin_manager.find_plugins()
+    assert sorted(plugin.id for plugin in plugin_manager.plugins) == ["conditional", "plain"]
+
+
+def test_assigned_extenders_fall_back_to_import(write_plugin, plugin_source, start_plugins):
+    source = plugin_source("Assigned", "assigned", body='''
+items = ExtensionPoint("assigned.items")
+items_extender = extends("assigned.items")(_items)
+''').replace("\n\nclass", "\n\ndef _items(self):\n    return [\"item\"]\n\n\nclass", 1)
+    assert parse_plugin_definitions(source, "assigned.plugin_definitions") is None
+
+    write_plugin("assigned", source)
+    plugin_manager = start_plugins(static=True)
+    extension_point = plugin_manager.get_extension_point("assigned.items")
+    assert len(list(extension_point.extenders)) == 1
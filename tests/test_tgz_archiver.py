@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import io
+import os
+import gzip
+import random
+import tarfile
+
+import pytest
+
+
+@pytest.fixture
+def archiver(plugins):
+    return plugins("archiver.tgz_archiver").TgzArchiver()
+
+
+@pytest.fixture
+def cat(plugins):
+    """Return the content of a file of an archive or None if it is not archived."""
+    arcname = plugins("archiver.incremental").arcname
+
+    def cat(archiver, archive, path):
+        output = io.BytesIO()
+        if not archiver.cat(archive, arcname(str(path)), output):
+            return None
+        return output.getvalue().decode("utf-8")
+    return cat
+
+
+@pytest.fixture
+def tree(tmp_path, touch):
+    source = tmp_path / "source"
+    source.mkdir()
+    touch(source / "kept.txt", "kept")
+    touch(source / "modified.txt", "first version")
+    touch(source / "removed.txt", "removed")
+    return source
+
+
+@pytest.mark.parametrize("index", [False, True])
+def test_cat_layers(tree, index, archiver, cat, touch):
+    archive = str(tree) + ".tar.gz"
+    assert archiver.compress(str(tree), incremental=True, index=index)["added"] == 3
+
+    touch(tree / "modified.txt", "second version")
+    touch(tree / "added.txt", "added")
+    os.remove(str(tree / "removed.txt"))
+    report = archiver.compress(str(tree), incremental=True, index=index)
+    assert (report["added"], report["modified"], report["removed"]) == (1, 1, 1)
+    assert os.path.exists(archiver._layer_path(archive, 1))
+
+    assert cat(archiver, archive, tree / "kept.txt") == "kept"
+    assert cat(archiver, archive, tree / "modified.txt") == "second version"
+    assert cat(archiver, archive, tree / "added.txt") == "added"
+    assert cat(archiver, archive, tree / "removed.txt") is None
+    assert cat(archiver, archive, tree / "missing.txt") is None
+
+
+def test_cat_without_manifest(tree, archiver, cat):
+    archive = str(tree) + ".tar.gz"
+    archiver.compress(str(tree), incremental=True)
+    os.remove(archive + ".manifest.json")
+
+    assert cat(archiver, archive, tree / "modified.txt") == "first version"
+    assert cat(archiver, archive, tree / "missing.txt") is None
+
+
+@pytest.fixture
+def ParallelGzipWriter(plugins):
+    return plugins("archiver.tgz_archiver").ParallelGzipWriter
+
+
+def test_parallel_gzip_members_are_standard(ParallelGzipWriter):
+    rnd = random.Random(0)
+    data = bytes(bytearray(rnd.choice(b"abcdefgh") for _ in range(100000)))
+    output = io.BytesIO()
+    with ParallelGzipWriter(output, workers=4, block_size=4096) as writer:
+        for start in range(0, len(data), 1000):
+            writer.write(data[start:start + 1000])
+    assert len(writer.checkpoints) == 25
+    assert gzip.GzipFile(fileobj=io.BytesIO(output.getvalue())).read() == data
+
+    # nothing written is still a valid gzip file
+    output = io.BytesIO()
+    ParallelGzipWriter(output).close()
+    assert gzip.GzipFile(fileobj=io.BytesIO(output.getvalue())).read() == b""
+
+
+def test_parallel_gzip_tar_is_readable(ParallelGzipWriter, tree, tmp_path):
+    archive = str(tmp_path / "tree.tar.gz")
+    with open(archive, "wb") as f:
+        with ParallelGzipWriter(f, workers=2, block_size=1024) as writer:
+            with tarfile.open(fileobj=writer, mode="w|") as tar:
+                tar.add(str(tree), arcname="tree")
+    assert len(writer.checkpoints) > 1
+
+    with tarfile.open(archive, mode="r:gz") as tar:
+        assert sorted(tar.getnames()) == ["tree", "tree/kept.txt", "tree/modified.txt", "tree/removed.txt"]
+        assert tar.extractfile("tree/modified.txt").read() == b"first version"
+
+
+@pytest.mark.parametrize("options, xfl", [({}, 2), ({"level": 1}, 4)])
+def test_compression_level(tree, archiver, options, xfl):
+    # the extra flags of the gzip header tell the compression level: 2 maximum (as tarfile), 4 fastest
+    archiver.compress(str(tree), **options)
+    with open(str(tree) + ".tar.gz", "rb") as f:
+        assert bytearray(f.read(10))[8] == xfl
+
+
+def malicious(tmp_path, kind):
+    """Write a tar.gz with a member that extracted would write in tmp_path/outside."""
+    archive = str(tmp_path / "malicious.tar.gz")
+    outside = str(tmp_path / "outside")
+    members = {
+        "parent": (tarfile.REGTYPE, "../outside", ""),
+        "absolute": (tarfile.REGTYPE, outside, ""),
+        "symlink": (tarfile.SYMTYPE, "link", "../outside"),
+        "hardlink": (tarfile.LNKTYPE, "link", outside),
+        "device": (tarfile.CHRTYPE, "device", ""),
+    }
+    type, name, linkname = members[kind]
+    with tarfile.open(archive, "w:gz") as tar:
+        info = tarfile.TarInfo(name)
+        info.type = type
+        info.linkname = linkname
+        data = b"evil" if type == tarfile.REGTYPE else b""
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+        if type == tarfile.SYMTYPE:
+            # written through the link
+            info = tarfile.TarInfo("link")
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b"evil"))
+    return archive, outside
+
+
+@pytest.mark.parametrize("filtered", [True, False])
+@pytest.mark.parametrize("kind", ["parent", "absolute", "symlink", "hardlink", "device"])
+def test_extract_stays_in_destination(tmp_path, archiver, plugins, monkeypatch, kind, filtered):
+    tgz_archiver = plugins("archiver.tgz_archiver")
+    if filtered and not tgz_archiver._EXTRACT_OPTIONS:
+        pytest.skip("tarfile without extraction filters")
+    if not filtered:
+        monkeypatch.setattr(tgz_archiver, "_EXTRACT_OPTIONS", {})
+    with open(str(tmp_path / "outside"), "w") as f:
+        f.write("kept")
+    archive, outside = malicious(tmp_path, kind)
+    dest = tmp_path / "dest"
+    dest.mkdir()
+
+    if filtered and kind == "absolute":
+        # the data filter extracts absolute names relative to the destination
+        archiver.extract(archive, str(dest))
+    else:
+        with pytest.raises(tarfile.TarError):
+            archiver.extract(archive, str(dest))
+    with open(outside) as f:
+        assert f.read() == "kept"
+    assert not os.path.exists(str(dest / "device"))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import gc
+import sys
+import weakref
+
+import pytest
+
+PROVIDER = '''
+items = ExtensionPoint("provider.items")
+
+def configure(self):
+    self.plugin_manager.register_service("provider.service", Service())
+
+@extends("provider.items")
+def _items(self):
+    return ["provider"]
+'''
+
+CONSUMER = '''
+@extends("provider.items")
+def _items(self):
+    return ["consumer"]
+'''
+
+SERVICE = '''
+
+class Service(object):
+    pass
+'''
+
+
+@pytest.fixture
+def plugin_manager(write_plugin, plugin_source, start_plugins):
+    """Plugin manager with a provider plugin and a consumer plugin depending on it."""
+    write_plugin("provider", plugin_source("Provider", "provider", body=PROVIDER) + SERVICE)
+    write_plugin("consumer", plugin_source("Consumer", "consumer", depends=["provider"], body=CONSUMER))
+    return start_plugins()
+
+
+def extensions(plugin_manager):
+    extension_point = plugin_manager.get_extension_point("provider.items")
+    extension_point.reload_extensions()
+    return sorted(extension_point.extensions)
+
+
+def references(plugin_manager, id, module):
+    """Weak references to the instance of a plugin and its plugin definitions module."""
+    return weakref.ref(plugin_manager._plugins[id].instance), weakref.ref(sys.modules[module])
+
+
+def test_unload_releases_instances_and_modules(plugin_manager):
+    assert extensions(plugin_manager) == ["consumer", "provider"]
+
+    refs = references(plugin_manager, "provider", "provider.plugin_definitions")
+    refs += references(plugin_manager, "consumer", "consumer.plugin_definitions")
+    service = weakref.ref(plugin_manager.get_service("provider.service"))
+
+    assert sorted(plugin_manager.unload_plugin("provider")) == ["consumer", "provider"]
+    gc.collect()
+
+    assert all(ref() is None for ref in refs)
+    assert service() is None
+    assert not [name for name in sys.modules if name.split(".")[0] in ("provider", "consumer")]
+    assert plugin_manager.get_extension_point("provider.items") is None
+    assert not plugin_manager.plugins
+
+
+def test_unload_dependent_only(plugin_manager):
+    refs = references(plugin_manager, "consumer", "consumer.plugin_definitions")
+
+    assert plugin_manager.unload_plugin("consumer") == ["consumer"]
+    gc.collect()
+
+    assert all(ref() is None for ref in refs)
+    assert [plugin.id for plugin in plugin_manager.plugins] == ["provider"]
+    assert extensions(plugin_manager) == ["provider"]
+
+
+def test_reload_after_unload(plugin_manager):
+    old = references(plugin_manager, "provider", "provider.plugin_definitions")
+    paths = [plugin.path for plugin in plugin_manager.plugins]
+
+    plugin_manager.unload_plugin("provider")
+    # unloaded plugins are not discovered again by find_plugins
+    plugin_manager.find_plugins()
+    assert not plugin_manager.plugins
+
+    assert plugin_manager.reload_plugins(paths) == ["provider", "consumer"]
+    gc.collect()
+
+    assert all(ref() is None for ref in old)
+    new = references(plugin_manager, "provider", "provider.plugin_definitions")
+    assert all(ref() is not None for ref in new)
+    assert extensions(plugin_manager) == ["consumer", "provider"]
+    assert plugin_manager.get_service("provider.service") is not None
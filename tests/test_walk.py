@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import os
+import heapq
+import types
+import random
+import threading
+
+import pytest
+
+import walk
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Tree with 3 levels of directories, 5 files in every directory and a link to a directory."""
+    paths = []
+    pending = [(str(tmp_path / "root"), 0)]
+    os.mkdir(pending[0][0])
+    while pending:
+        directory, depth = pending.pop()
+        for i in range(5):
+            path = os.path.join(directory, "file{0}.txt".format(i))
+            with open(path, "w") as f:
+                f.write("x" * i)
+            paths.append(path)
+        if depth < 3:
+            for i in range(3):
+                path = os.path.join(directory, "dir{0}".format(i))
+                os.mkdir(path)
+                paths.append(path)
+                pending.append((path, depth + 1))
+    link = os.path.join(str(tmp_path / "root"), "link")
+    os.symlink(os.path.join(str(tmp_path / "root"), "dir0"), link)
+    paths.append(link)
+    return str(tmp_path / "root"), sorted(paths)
+
+
+def walked(path, **kwargs):
+    return sorted(entry.path for batch in walk.walk(path, **kwargs) for entry in batch)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_recursive_walk(tree, workers):
+    root, paths = tree
+    # small batches, so directories are yielded in more than one batch
+    assert walked(root, recursive=True, workers=workers, batch_size=2) == paths
+
+
+def test_walk_only_the_directory(tree):
+    root, paths = tree
+    assert walked(root, workers=4) == [path for path in paths if os.path.dirname(path) == root]
+
+
+def test_errors_are_reported(tmp_path):
+    errors = []
+    assert walked(str(tmp_path / "missing"), recursive=True, workers=4, onerror=errors.append) == []
+    assert len(errors) == 1 and isinstance(errors[0], OSError)
+
+
+def test_parallel_walk_stops_with_the_consumer(tree):
+    root, _ = tree
+    threads = set(threading.enumerate())
+    batches = walk.walk(root, recursive=True, workers=4, batch_size=1)
+    next(batches)
+    batches.close()
+    # the worker threads are joined when the generator is closed
+    assert not set(threading.enumerate()) - threads
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_external_sort_merges_runs(reverse):
+    rnd = random.Random(0)
+    items = [(rnd.randint(0, 100), i) for i in range(2500)]
+    result = list(walk.external_sort(items, key=lambda item: item[0], reverse=reverse, run_size=300))
+    # equal keys keep their order, as sorted does
+    assert result == sorted(items, key=lambda item: item[0], reverse=reverse)
+
+
+def test_external_sort_in_memory():
+    assert list(walk.external_sort([3, 1, 2], run_size=10)) == [1, 2, 3]
+    assert list(walk.external_sort([], run_size=10)) == []
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_merge_without_key_support(monkeypatch, reverse):
+    # heapq.merge has no 'key' nor 'reverse' before python 3.5
+    def merge(*iterables, **kwargs):
+        if kwargs:
+            raise TypeError("merge() got an unexpected keyword argument")
+        return heapq.merge(*iterables)
+    monkeypatch.setattr(walk, "heapq", types.SimpleNamespace(merge=merge))
+
+    runs = [[(1, "a"), (3, "a")], [(1, "b"), (2, "b")], [(3, "c")]]
+    if reverse:
+        runs = [run[::-1] for run in runs]
+    items = [item for run in runs for item in run]
+    result = list(walk.external_sort(iter(items), key=lambda item: item[0], reverse=reverse, run_size=2))
+    assert result == sorted(items, key=lambda item: item[0], reverse=reverse)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import os
+import sys
+import time
+
+import pytest
+
+from plugin_manager import PluginBundle, PluginWatcher
+
+VALUE = '''
+def configure(self):
+    self.plugin_manager.register_service("{0}.value", {1!r})
+'''
+
+
+@pytest.fixture
+def define(search_path, write_plugin, plugin_source):
+    """Function writing a plugin that registers a service with a value: define(package, value, create=True)"""
+    def define(package, value, create=True):
+        source = plugin_source(package.title(), package, body=VALUE.format(package, value))
+        if create:
+            write_plugin(package, source)
+        else:
+            with open(os.path.join(str(search_path), package, "plugin_definitions.py"), "w") as f:
+                f.write(source)
+    return define
+
+
+@pytest.fixture
+def load(search_path, define, start_plugins, tmp_path):
+    """Function returning a plugin manager with two plugins started and the list of its reloads. With
+    bundled=True the plugins are loaded from a plugin bundle built from the search path.
+    """
+    def load(bundled=False):
+        define("first", "old")
+        define("second", "old")
+        if bundled:
+            bundle = str(tmp_path / "plugins.bundle")
+            PluginBundle.build(str(search_path), bundle)
+            plugin_manager = start_plugins(static=True, bundle=bundle)
+        else:
+            plugin_manager = start_plugins()
+
+        # count the reloads
+        calls = []
+        reload_plugins = plugin_manager.reload_plugins
+
+        def counted(plugin_paths, notify=None):
+            calls.append(sorted(os.path.basename(path) for path in plugin_paths))
+            return reload_plugins(plugin_paths, notify)
+        plugin_manager.reload_plugins = counted
+        return plugin_manager, calls
+    return load
+
+
+def test_poll_reloads_changed_plugins(define, load):
+    plugin_manager, calls = load()
+    watcher = PluginWatcher(plugin_manager)
+    assert watcher.poll() == []
+    assert calls == []
+
+    define("first", "new value", create=False)
+    assert watcher.poll() == ["first"]
+    assert calls == [["first"]]
+    assert plugin_manager.get_service("first.value") == "new value"
+    assert plugin_manager.get_service("second.value") == "old"
+
+    # nothing changed since the last poll
+    assert watcher.poll() == []
+    assert len(calls) == 1
+
+
+def test_polling_loop_reloads_batches_once(define, load):
+    plugin_manager, calls = load()
+    watcher = PluginWatcher(plugin_manager, interval=0.2)
+    # force the polling mode even if inotify is available
+    watcher._inotify = None
+
+    define("first", "new value", create=False)
+    define("second", "new value", create=False)
+    watcher.start()
+    try:
+        deadline = time.time() + 5
+        while not calls and time.time() < deadline:
+            time.sleep(0.05)
+        # give the loop the chance of reloading again
+        time.sleep(0.5)
+    finally:
+        watcher.stop()
+
+    assert calls == [["first", "second"]]
+    assert plugin_manager.get_service("first.value") == "new value"
+    assert plugin_manager.get_service("second.value") == "new value"
+
+
+def test_poll_reloads_bundled_plugins(search_path, define, load):
+    plugin_manager, calls = load(bundled=True)
+    assert plugin_manager.bundle.names == frozenset(["first", "second"])
+    assert sys.modules["first.plugin_definitions"].__file__.startswith(plugin_manager.bundle.path)
+    watcher = PluginWatcher(plugin_manager)
+
+    define("first", "new value", create=False)
+    assert watcher.poll() == ["first"]
+    assert plugin_manager.get_service("first.value") == "new value"
+    assert plugin_manager.get_service("second.value") == "old"
+    assert plugin_manager.bundle.names == frozenset(["second"])
+    assert sys.modules["first.plugin_definitions"].__file__.startswith(str(search_path))
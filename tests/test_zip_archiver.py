@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+__author__ = "jmrbcu"
+import io
+import os
+import types
+import zipfile
+import argparse
+
+import pytest
+
+
+@pytest.fixture
+def archiver(plugins):
+    return plugins("archiver.zip_archiver").ZipArchiver()
+
+
+@pytest.fixture
+def tree(tmp_path, touch):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "directory").mkdir()
+    touch(source / "kept.txt", "kept")
+    touch(source / "directory" / "nested.txt", "nested " * 1000)
+    touch(source / "modified.txt", "first version")
+    touch(source / "removed.txt", "removed")
+    return source
+
+
+def contents(archive):
+    with zipfile.ZipFile(archive) as source:
+        assert source.testzip() is None
+        return dict((name, source.read(name).decode("utf-8")) for name in source.namelist())
+
+
+def test_incremental_rewrite_copies_unchanged_members(tree, archiver, plugins, touch):
+    arcname = plugins("archiver.incremental").arcname
+    archive = str(tree) + ".zip"
+    assert archiver.compress(str(tree), incremental=True)["added"] == 4
+
+    # same size and modification time: unchanged for the manifest, so it must be copied from the archive
+    nested = tree / "directory" / "nested.txt"
+    st = os.stat(str(nested))
+    with open(str(nested), "w") as f:
+        f.write("NESTED " * 1000)
+    os.utime(str(nested), (st.st_atime, st.st_mtime))
+
+    touch(tree / "modified.txt", "second version")
+    os.remove(str(tree / "removed.txt"))
+    report = archiver.compress(str(tree), incremental=True)
+    assert (report["added"], report["modified"], report["removed"], report["unchanged"]) == (0, 1, 1, 2)
+
+    assert contents(archive) == {
+        arcname(str(tree / "kept.txt")): "kept",
+        arcname(str(tree / "directory" / "nested.txt")): "nested " * 1000,
+        arcname(str(tree / "modified.txt")): "second version",
+    }
+
+
+def test_compress_command_exit_status(tree, archiver, plugins, capsys):
+    filesystem_manager = plugins("basic.filesystem_manager").FileSystemManager({"zip": archiver})
+    plugin_manager = types.SimpleNamespace(get_service=lambda id: filesystem_manager)
+    plugin = plugins("basic.plugin_definitions").BasicPlugin(plugin_manager)
+
+    def compress(file_type="zip", incremental=False):
+        return plugin._compress(argparse.Namespace(
+            filename=str(tree), file_type=file_type, workers=None, block_size=None, incremental=incremental,
+            index=False, index_interval=None
+        ))
+
+    assert compress() is None
+    assert compress(incremental=True) is None
+    assert "4 added" in capsys.readouterr()[0]
+    assert compress("rar") == 1
+    assert "unknown file type: rar" in capsys.readouterr()[1]
+
+
+def test_extract_round_trip(tree, archiver, plugins, tmp_path):
+    arcname = plugins("archiver.incremental").arcname
+    archive = str(tree) + ".zip"
+    archiver.compress(str(tree), incremental=True)
+    names = dict((name, arcname(str(tree / name))) for name in (
+        "kept.txt", os.path.join("directory", "nested.txt"), "modified.txt", "removed.txt"
+    ))
+
+    dest = tmp_path / "extracted"
+    assert archiver.extract(archive, str(dest), workers=4) == 4
+    for name, member in names.items():
+        with open(str(dest / member)) as extracted, open(str(tree / name)) as original:
+            assert extracted.read() == original.read()
+
+    # only some members, written to a stream in archive order
+    output = io.BytesIO()
+    assert archiver.extract(archive, members=[names["modified.txt"], names["kept.txt"]], output=output) == 2
+    assert output.getvalue() == b"keptfirst version"
+
+    output = io.BytesIO()
+    assert archiver.cat(archive, names["modified.txt"], output)
+    assert output.getvalue() == b"first version"
+    assert not archiver.cat(archive, "missing.txt", io.BytesIO())
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""Directory traversal for huge trees, used by the commands that list or measure directories. Entries are
+os.DirEntry objects read with scandir and streamed in batches, subdirectories can be scanned in parallel.
+"""
+__author__ = "jmrbcu"
+import os
+import sys
+import stat
+import heapq
+import pickle
+import tempfile
+import itertools
+import threading
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+BATCH_SIZE = 1024
+
+# fields of an entry that can be printed or used to sort, "type" and "inode" are known without a stat call on
+# posix systems, the others need one stat call per entry (none on windows), see: os.DirEntry
+FIELDS = ("type", "inode", "size", "mtime", "mode")
+SORT_KEYS = ("name", "size", "mtime")
+
+
+# type and permission characters of: filemode
+_FILEMODE_TABLE = (
+    (
+        (stat.S_IFLNK, "l"), (stat.S_IFSOCK, "s"), (stat.S_IFREG, "-"), (stat.S_IFBLK, "b"), (stat.S_IFDIR, "d"),
+        (stat.S_IFCHR, "c"), (stat.S_IFIFO, "p"),
+    ),
+    ((stat.S_IRUSR, "r"),),
+    ((stat.S_IWUSR, "w"),),
+    ((stat.S_IXUSR | stat.S_ISUID, "s"), (stat.S_ISUID, "S"), (stat.S_IXUSR, "x")),
+    ((stat.S_IRGRP, "r"),),
+    ((stat.S_IWGRP, "w"),),
+    ((stat.S_IXGRP | stat.S_ISGID, "s"), (stat.S_ISGID, "S"), (stat.S_IXGRP, "x")),
+    ((stat.S_IROTH, "r"),),
+    ((stat.S_IWOTH, "w"),),
+    ((stat.S_IXOTH | stat.S_ISVTX, "t"), (stat.S_ISVTX, "T"), (stat.S_IXOTH, "x")),
+)
+
+
+def filemode(mode):
+    """Return the mode of a file as a string like '-rwxr-xr-x', stat.filemode is not available in python 2."""
+    chars = []
+    for table in _FILEMODE_TABLE:
+        for bit, char in table:
+            if mode & bit == bit:
+                chars.append(char)
+                break
+        else:
+            chars.append("-")
+    return "".join(chars)
+
+
+def fsencode(path):
+    """Return a path as the bytes of its filesystem name, os.fsencode is not available in python 2."""
+    if isinstance(path, bytes):
+        return path
+    if hasattr(os, "fsencode"):
+        return os.fsencode(path)
+    return path.encode(sys.getfilesystemencoding() or "utf-8")
+
+
+def is_dir(entry):
+    """True if the entry is a directory, symbolic links are not followed."""
+    try:
+        return entry.is_dir(follow_symlinks=False)
+    except OSError:
+        return False
+
+
+def scan(path, batch_size=BATCH_SIZE, onerror=None, on_directory=None):
+    """Yield the entries of a directory in batches (lists of os.DirEntry).
+
+    :param onerror: Called with the OSError raised reading the directory, errors are ignored by default.
+    :param on_directory: Called with the path of every subdirectory, as soon as it is found.
+    """
+    try:
+        entries = scandir(path)
+    except OSError as e:
+        if onerror is not None:
+            onerror(e)
+        return
+
+    batch = []
+    try:
+        for entry in entries:
+            batch.append(entry)
+            if on_directory is not None and is_dir(entry):
+                on_directory(entry.path)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    except OSError as e:
+        if onerror is not None:
+            onerror(e)
+    finally:
+        if hasattr(entries, "close"):
+            entries.close()
+    if batch:
+        yield batch
+
+
+def walk(path, recursive=False, workers=1, onerror=None, batch_size=BATCH_SIZE):
+    """Yield the entries of a directory in batches (lists of os.DirEntry), with the entries of all its
+    subdirectories if 'recursive'. Symbolic links to directories are not followed. Memory use doesn't depend
+    on the number of entries of a directory.
+
+    :param workers: Number of threads scanning subdirectories in parallel when 'recursive'. With more than one
+        worker the batches of different directories are yielded in any order.
+    :param onerror: Called with the OSError raised reading a directory (from the worker threads when parallel),
+        errors are ignored by default.
+    """
+    if recursive and workers > 1:
+        return _parallel_walk(path, workers, onerror, batch_size)
+    return _walk(path, recursive, onerror, batch_size)
+
+
+def _walk(path, recursive, onerror, batch_size):
+    pending = [path]
+    while pending:
+        subdirectories = []
+        on_directory = subdirectories.append if recursive else None
+        for batch in scan(pending.pop(), batch_size, onerror, on_directory):
+            yield batch
+        # depth first, subdirectories in the order they were found
+        pending.extend(reversed(subdirectories))
+
+
+def _parallel_walk(path, workers, onerror, batch_size):
+    directories = queue.Queue()
+    # bounded, so a slow consumer stops the workers instead of piling up batches in memory
+    batches = queue.Queue(maxsize=workers * 4)
+    stop = threading.Event()
+    lock = threading.Lock()
+    pending = [1]
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def on_directory(directory):
+        with lock:
+            pending[0] += 1
+        directories.put(directory)
+
+    def worker():
+        while True:
+            directory = directories.get()
+            if directory is None:
+                return
+            try:
+                for batch in scan(directory, batch_size, onerror, on_directory):
+                    if not put(batch):
+                        return
+            except BaseException as e:
+                put(e)
+                return
+
+            with lock:
+                pending[0] -= 1
+                finished = pending[0] == 0
+            if finished:
+                put(done)
+
+    directories.put(path)
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        for _ in threads:
+            directories.put(None)
+        for thread in threads:
+            thread.join()
+
+
+def _type(entry):
+    try:
+        if entry.is_symlink():
+            return "l"
+        if entry.is_dir(follow_symlinks=False):
+            return "d"
+        if entry.is_file(follow_symlinks=False):
+            return "f"
+    except OSError:
+        pass
+    return "?"
+
+
+def field_values(entry, fields):
+    """Return the values of some FIELDS of an entry, the stat call is only done if a field needs it. Values of
+    entries that disappeared are -1 (or "?" for the mode).
+    """
+    st = None
+    values = []
+    for field in fields:
+        if field == "type":
+            values.append(_type(entry))
+        elif field == "inode":
+            values.append(entry.inode())
+        else:
+            if st is None:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    st = False
+            if field == "size":
+                values.append(st.st_size if st else -1)
+            elif field == "mtime":
+                values.append(int(st.st_mtime) if st else -1)
+            elif field == "mode":
+                values.append(getattr(stat, "filemode", filemode)(st.st_mode) if st else "?")
+            else:
+                raise ValueError("Unknown field: {0}".format(field))
+    return values
+
+
+def records(batches, fields=()):
+    """Yield a tuple (path, values of 'fields') for every entry of the batches."""
+    for batch in batches:
+        for entry in batch:
+            yield tuple([entry.path] + field_values(entry, fields))
+
+
+def external_sort(items, key=None, reverse=False, run_size=100000):
+    """Sort items with bounded memory: runs of 'run_size' items are sorted in memory and written to temporary
+    files, then the runs are merged. Items must be picklable. Yields the items sorted.
+    """
+    items = iter(items)
+    runs = []
+    try:
+        while True:
+            run = list(itertools.islice(items, run_size))
+            if not run:
+                break
+            run.sort(key=key, reverse=reverse)
+            if not runs and len(run) < run_size:
+                # everything fits in memory
+                for item in run:
+                    yield item
+                return
+
+            f = tempfile.TemporaryFile()
+            for start in range(0, len(run), BATCH_SIZE):
+                pickle.dump(run[start:start + BATCH_SIZE], f, pickle.HIGHEST_PROTOCOL)
+            f.seek(0)
+            runs.append(f)
+            del run
+
+        for item in _merge([_read_run(f) for f in runs], key, reverse):
+            yield item
+    finally:
+        for f in runs:
+            f.close()
+
+
+class _Reversed(object):
+    """Sort key in reverse order."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _merge(iterables, key, reverse):
+    """heapq.merge with 'key' and 'reverse', decorating the items in python versions before 3.5. Equal items
+    keep the order of the iterables.
+    """
+    try:
+        return heapq.merge(*iterables, key=key, reverse=reverse)
+    except TypeError:
+        pass
+
+    def decorate(i, iterable):
+        for n, item in enumerate(iterable):
+            value = key(item) if key is not None else item
+            # the position breaks ties, so items are never compared
+            yield _Reversed(value) if reverse else value, i, n, item
+
+    return (item for _, _, _, item in heapq.merge(*[decorate(i, iterable) for i, iterable in enumerate(iterables)]))
+
+
+def _read_run(f):
+    while True:
+        try:
+            chunk = pickle.load(f)
+        except EOFError:
+            return
+        for item in chunk:
+            yield item
+
+
+def write_records(records, output, separator=b"\n", batch_size=BATCH_SIZE):
+    """Write records (see: records) to a binary file object, one per line with the values separated by tabs.
+    Lines are written in batches. Paths are written as the bytes of the filesystem name.
+
+    :returns: Number of records written.
+    """
+    count = 0
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return count
+        lines = []
+        for record in batch:
+            line = fsencode(record[0])
+            if len(record) > 1:
+                line += b"\t" + "\t".join(str(value) for value in record[1:]).encode("ascii")
+            lines.append(line + separator)
+        output.write(b"".join(lines))
+        count += len(batch)